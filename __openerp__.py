@@ -18,6 +18,7 @@
     'data': [
             'security/ir.model.access.csv',
 	    'checklist_data.xaml',
+            'checklist_report_view.xaml',
             ],
     'test': [],
     'installable': True,
@@ -0,0 +1,21 @@
+{
+   'name': 'Checklist Benchmark',
+    'version': '0.1',
+    'category': 'Hidden',
+    'description': """\
+            Concrete checklist models used by bench/run.py; never install in a
+            production database.
+            """,
+    'author': 'Ethan Furman',
+    'maintainer': 'Ethan Furman',
+    'website': '',
+    'depends': [
+            'fnx_checklist',
+            ],
+    'data': [
+            'security.xml',
+            ],
+    'test': [],
+    'installable': True,
+    'active': False,
+}
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+from osv import osv
+import logging
+
+
+_logger = logging.getLogger(__name__)
+
+# models
+
+class checklist(osv.Model):
+    "checklist"
+    _inherit = "fnx.checklist"
+    _name = "bench.checklist"
+
+
+class question(osv.Model):
+    "checklist question"
+    _inherit = "fnx.checklist.question"
+    _name = "bench.checklist.question"
+
+
+class checklist_history(osv.Model):
+    "checklist history"
+    _inherit = "fnx.checklist.history"
+    _name = "bench.checklist.history"
+
+
+class question_history(osv.Model):
+    "checklist answer history"
+    _inherit = "fnx.checklist.history.answer"
+    _name = "bench.checklist.history.answer"
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+the per-model bootstrap as it was before add_permissions/add_report became
+set-based; kept only so bench/run.py can time both against the same database
+"""
+
+from openerp.exceptions import ERPError
+
+def add_permissions(model, cr, context):
+    "add default permissions if none exist"
+    cr.execute("SELECT id FROM ir_model WHERE model='%s'" % (model._name, ))
+    model_id = cr.fetchone()[0]
+    cr.execute("SELECT id FROM ir_model_access WHERE model_id=%s" % (model_id, ))
+    #
+    if not cr.rowcount:
+        imd_name = 'access_%s_all' % (model._table, )
+        ima_name = '%s_all' % (model._table, )
+        #
+        cr.execute("SELECT nextval('ir_model_access_id_seq')")
+        ima_id = cr.fetchone()[0]
+        cr.execute("""
+                INSERT INTO ir_model_access
+                    (
+                      id, name, model_id, perm_read, perm_write, perm_create, perm_unlink,
+                      create_uid, create_date, write_uid, write_date
+                      )
+                VALUES
+                    (
+                      %s, '%s', %s, true, true, true, true,
+                      1, now() AT TIME ZONE 'UTC', 1, now() AT TIME ZONE 'UTC'
+                      )
+                    """
+                    % (ima_id, ima_name, model_id)
+                    )
+        #
+        cr.execute("SELECT nextval('ir_model_data_id_seq')")
+        imd_id = cr.fetchone()[0]
+        cr.execute("""
+                INSERT into ir_model_data
+                    (
+                    id, module, name, model, res_id, date_init, date_update,
+                    create_uid, create_date, write_uid, write_date,
+                    noupdate
+                    )
+                VALUES
+                    (
+                      %s, '%s', '%s', 'ir.model.access', %s, now() AT TIME ZONE 'UTC', now() AT TIME ZONE 'UTC',
+                      1, now() AT TIME ZONE 'UTC', 1, now() AT TIME ZONE 'UTC',
+                      true
+                      )
+                    """
+                    % (imd_id, model._module, imd_name, ima_id)
+                    )
+
+def add_report(model, cr, context):
+    "add checklist report to model"
+    #
+    # calculate db values
+    #
+    module = model._module
+    model_name = model._name
+    title_name = model.__class__.__doc__.title().replace('.',' ')
+    report_xml_id = '%s.%s' % (module, model_name)
+    imd_xml_id = 'report_%s_%s' % (module, model._table)
+    # ???_id will be calculated later
+    #
+    # get or create ir.actions.report.xml entry (ir_act_report_xml)
+    # -------------------------------------------------------------------------------------------------------
+    # |  id | header | model         | name         | report_name     | report_type | type                  |
+    # | --- | ------ | ------------- | ------------ | --------------- | ----------- | --------------------- |
+    # | ??? | t      | <model.name>  | <title name> | <report xml_id> | pdf         | ir.actions.report.xml |
+    # -------------------------------------------------------------------------------------------------------
+    #
+    cr.execute("""
+        SELECT id
+        FROM ir_act_report_xml
+        WHERE header='t' AND report_type='pdf' AND type='ir.actions.report.xml' AND
+              model='%s' AND name='%s' AND report_name='%s'
+              """
+              % (model_name, title_name, report_xml_id)
+              )
+    rows = cr.fetchall()
+    if len(rows) > 1:
+        raise ValueError('%s: too many matches found:\n%s' % (model_name, rows))
+    elif rows:
+        action_id = rows[0][0]
+    else:
+        # create it
+        cr.execute("SELECT nextval('ir_actions_id_seq')")
+        action_id = cr.fetchone()[0]
+        cr.execute("""
+            INSERT INTO ir_act_report_xml
+                (
+                  id, header, report_type, type, model, name, report_name,
+                  create_uid, create_date, write_uid, write_date,
+                  auto, multi, attachment_use
+                   )
+            VALUES
+                (
+                  %s, 't', 'pdf', 'ir.actions.report.xml', '%s', '%s', '%s',
+                  1, now() AT TIME ZONE 'UTC', 1, now() AT TIME ZONE 'UTC',
+                  false, false, false
+                  )
+                """
+                % (action_id, model_name, title_name, report_xml_id)
+                  )
+    #
+    # get or create ir.model.data entry (ir_model_data)
+    #
+    # --------------------------------------------------------------------
+    # | module           | name         | model                 | res_id |
+    # | ---------------- | ------------ | --------------------- | ------ |
+    # | <current module> | <imd xml_id> | ir.actions.report.xml | ???_id |
+    # --------------------------------------------------------------------
+    #
+    cr.execute("""
+        SELECT id, model, res_id
+        FROM ir_model_data
+        WHERE module='%s' AND name='%s'
+        """
+        % (module, imd_xml_id)
+        )
+    if not cr.rowcount:
+        # create entry
+        cr.execute("SELECT nextval('ir_model_data_id_seq')")
+        imd_id = cr.fetchone()[0]
+        cr.execute("""
+            INSERT into ir_model_data
+                (
+                module, name, model, res_id, date_init, date_update,
+                create_uid, create_date, write_uid, write_date,
+                noupdate
+                )
+            VALUES
+                (
+                  '%s', '%s', '%s', %s, now() AT TIME ZONE 'UTC', now() AT TIME ZONE 'UTC',
+                  1, now() AT TIME ZONE 'UTC', 1, now() AT TIME ZONE 'UTC',
+                  true
+                  )
+                """
+                % (module, imd_xml_id, model_name, action_id)
+                )
+    else:
+        # validate entry
+        imd_id, imd_model, imd_res_id = cr.fetchone()
+        if imd_model != model_name or imd_res_id != action_id:
+            raise ERPError(
+                    'Duplicate Entry',
+                    'record %s.%s already exists and points to %s:%s'
+                        % (module, imd_xml_id, imd_model, imd_res_id),
+                        )
+    #
+    # get or create ir.values entry (ir_values)
+    #
+    # --------------------------------------------------------------------------------------------
+    # | key    | key2               | value                        | model        | name         |
+    # | ------ | ------------------ | ---------------------------- | ------------ | ------------ |
+    # | action | client_print_multi | ir.actions.report.xml,???_id | <model.name> | <title name> |
+    # --------------------------------------------------------------------------------------------
+    cr.execute("""
+        SELECT id
+        FROM ir_values
+        WHERE
+            key='action' AND
+            key2='client_print_multi' AND
+            value='ir.actions.report.xml,%s' AND
+            model='%s'
+            """
+            % (action_id, model_name),
+            )
+    if not cr.rowcount:
+        cr.execute("SELECT nextval('ir_values_id_seq')")
+        iv_id = cr.fetchone()[0]
+        cr.execute("""
+            INSERT INTO ir_values
+                (
+                  id, key, key2, value, model, name, res_id,
+                  create_uid, create_date, write_uid, write_date
+                  )
+            VALUES
+                (
+                  %s, 'action', 'client_print_multi', 'ir.actions.report.xml,%s', '%s', '%s', 0,
+                  1, now() AT TIME ZONE 'UTC', 1, now() AT TIME ZONE 'UTC'
+                  )
+                """
+                % (iv_id, action_id, model_name, title_name),
+                )
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+benchmark the checklist entry points against a throwaway database
+
+    python bench/run.py --addons-path=<openerp addons>,<dir holding fnx_checklist>
+
+For every data size (checklists x questions x histories) a fresh database is
+created, fnx_checklist_bench (concrete models living next to this script) is
+installed, synthetic data is generated, and each entry point is timed; the
+database is dropped afterwards unless --keep is given.
+
+Wall time, query count (the cursor's sql_log_count) and peak memory (the
+process high-water mark, so only growth shows up) are printed and compared
+with the stored baseline.  --save writes the results as the new baseline,
+--check exits with status 1 if anything regressed past --tolerance.
+
+The module bootstrap (add_permissions/add_report) is also timed against the
+per-model version it replaced (bench/legacy_bootstrap.py), both for a first
+install (the entries are removed inside a savepoint first) and for the no-op
+re-run every registry load performs.  check_query_plans is run against the
+generated data, so a lookup that stopped using its index fails the run.
+"""
+
+from __future__ import print_function
+
+from argparse import ArgumentParser
+from contextlib import contextmanager
+import json
+import os
+import random
+import resource
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+BASELINE = os.path.join(HERE, 'baseline.json')
+SIZES = '10x10x100,50x20x1000,200x30x10000'
+
+MODULE = 'fnx_checklist_bench'
+CHECKLIST = 'bench.checklist'
+HISTORY = 'bench.checklist.history'
+REPORT_CHECKLIST = 'report.%s.%s' % (MODULE, CHECKLIST)
+REPORT_HISTORY = 'report.%s.%s' % (MODULE, HISTORY)
+
+# reports are drawn in the benchmark process, never queued as background jobs
+SYNC = {'report_sync': True}
+
+# how many single histories are created through the ORM per run
+ORM_CREATES = 20
+# what part of the histories is answered and marked done
+DONE_RATIO = 0.8
+
+
+def main():
+    parser = ArgumentParser(description='benchmark the checklist entry points')
+    parser.add_argument('--addons-path', required=True, help='openerp addons path, must include fnx_checklist')
+    parser.add_argument('--db-host', default=None)
+    parser.add_argument('--db-port', default=None)
+    parser.add_argument('--db-user', default=None)
+    parser.add_argument('--db-password', default=None)
+    parser.add_argument('--sizes', default=SIZES, help='comma separated CHECKLISTSxQUESTIONSxHISTORIES (%(default)s)')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline file (%(default)s)')
+    parser.add_argument('--save', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--check', action='store_true', help='exit with 1 if anything regressed')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slow down (%(default)s)')
+    parser.add_argument('--pdf-cache', action='store_true', help='leave the rendered-record cache enabled')
+    parser.add_argument('--keep', action='store_true', help='do not drop the benchmark databases')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    #
+    import openerp
+    from openerp.tools import config
+    options = ['--addons-path=%s,%s' % (args.addons_path, HERE)]
+    for name in ('db_host', 'db_port', 'db_user', 'db_password'):
+        value = getattr(args, name)
+        if value:
+            options.append('--%s=%s' % (name, value))
+    config.parse_config(options)
+    if not args.pdf_cache:
+        config['checklist_pdf_cache_size'] = 0
+    openerp.netsvc.init_logger()
+    #
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    results = {}
+    for size in args.sizes.split(','):
+        checklists, questions, histories = [int(n) for n in size.split('x')]
+        random.seed(args.seed)
+        results[size] = run_size(checklists, questions, histories, keep=args.keep)
+    regressed = report(results, baseline, args.tolerance)
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+            f.write('\n')
+        print('baseline saved to %s' % (args.baseline, ))
+    if args.check and regressed:
+        sys.exit(1)
+
+def run_size(checklists, questions, histories, keep=False):
+    "time every entry point against a fresh database of the given size"
+    from openerp import SUPERUSER_ID
+    from openerp.addons.fnx_checklist.checklist import add_permissions, add_report
+    from openerp.modules.registry import RegistryManager
+    from openerp.netsvc import Service
+    from openerp.tools import config
+    uid = SUPERUSER_ID
+    db_name = 'checklist_bench_%d_%d' % (os.getpid(), checklists * questions * histories)
+    create_database(db_name)
+    timings = []
+    try:
+        # installation runs add_permissions/add_report for the first time
+        config['init'] = {MODULE: 1}
+        with measure(timings, 'install module', None):
+            RegistryManager.new(db_name, update_module=True)
+        config['init'] = {}
+        registry = RegistryManager.new(db_name)
+        cr = registry.db.cursor()
+        try:
+            checklist_model = registry.get(CHECKLIST)
+            history_model = registry.get(HISTORY)
+            question_model = registry.get('%s.question' % (CHECKLIST, ))
+            checklist_ids = generate_checklists(cr, uid, checklist_model, checklists, questions)
+            #
+            models = [registry.get(n) for n in (
+                    CHECKLIST, '%s.question' % (CHECKLIST, ), HISTORY, '%s.answer' % (HISTORY, ),
+                    )]
+            with measure(timings, 'add_permissions', cr):
+                add_permissions(models, cr, {})
+            with measure(timings, 'add_report', cr):
+                add_report([registry.get(CHECKLIST), registry.get(HISTORY)], cr, {})
+            time_bootstrap(timings, cr, models, [registry.get(CHECKLIST), registry.get(HISTORY)])
+            #
+            question_model.clear_caches()
+            with measure(timings, 'onchange_checklist_id (cold)', cr):
+                for id in checklist_ids:
+                    history_model.onchange_checklist_id(cr, uid, [], id)
+            with measure(timings, 'onchange_checklist_id (warm)', cr):
+                for id in checklist_ids:
+                    history_model.onchange_checklist_id(cr, uid, [], id)
+            #
+            assignments = [(random.choice(checklist_ids), uid) for _ in range(histories)]
+            with measure(timings, 'create_histories', cr):
+                history_ids = history_model.create_histories(cr, uid, assignments)
+            with measure(timings, 'create (orm, x%d)' % (ORM_CREATES, ), cr):
+                for id in checklist_ids[:ORM_CREATES]:
+                    values = history_model.onchange_checklist_id(cr, uid, [], id)['value']
+                    history_model.create(cr, uid, {
+                            'checklist_id': id,
+                            'user_id': uid,
+                            'answer_ids': [(0, 0, v) for v in values['answer_ids']],
+                            })
+            done_ids = answer_histories(cr, history_model, history_ids)
+            cr.commit()
+            # raises if one of the main lookups no longer uses its index
+            with measure(timings, 'check_query_plans', cr):
+                history_model.check_query_plans(cr, uid)
+            #
+            service = Service._services[REPORT_CHECKLIST]
+            with measure(timings, 'checklist_report (checklists)', cr):
+                service.create(cr, uid, checklist_ids, {'model': CHECKLIST}, context=SYNC)
+            service = Service._services[REPORT_HISTORY]
+            with measure(timings, 'checklist_report (histories)', cr):
+                service.create(cr, uid, done_ids, {'model': HISTORY}, context=SYNC)
+            with measure(timings, 'pack_histories', cr):
+                history_model.pack_histories(cr, uid, done_ids)
+            with measure(timings, 'checklist_report (packed histories)', cr):
+                service.create(cr, uid, done_ids, {'model': HISTORY}, context=SYNC)
+            cr.rollback()
+        finally:
+            cr.close()
+    finally:
+        RegistryManager.delete(db_name)
+        if not keep:
+            drop_database(db_name)
+    return dict((name, values) for name, values in timings)
+
+def time_bootstrap(timings, cr, models, report_models):
+    "time the legacy per-model bootstrap against the set-based one, fresh and re-run"
+    from openerp.addons.fnx_checklist.checklist import add_permissions, add_report
+    import legacy_bootstrap
+    def legacy():
+        for model in models:
+            legacy_bootstrap.add_permissions(model, cr, {})
+        for model in report_models:
+            legacy_bootstrap.add_report(model, cr, {})
+    def set_based():
+        add_permissions(models, cr, {})
+        add_report(report_models, cr, {})
+    for label, bootstrap in (('legacy, per model', legacy), ('set-based', set_based)):
+        cr.execute('SAVEPOINT bootstrap')
+        clear_bootstrap(cr, models, report_models)
+        with measure(timings, 'bootstrap install (%s)' % (label, ), cr):
+            bootstrap()
+        with measure(timings, 'bootstrap re-run (%s)' % (label, ), cr):
+            bootstrap()
+        cr.execute('ROLLBACK TO SAVEPOINT bootstrap')
+
+def clear_bootstrap(cr, models, report_models):
+    "remove the access rules and report entries the bootstrap creates"
+    cr.execute(
+            '''DELETE FROM ir_model_access
+               WHERE model_id IN (SELECT id FROM ir_model WHERE model IN %s)''',
+            (tuple(m._name for m in models), ),
+            )
+    cr.execute(
+            '''DELETE FROM ir_model_data WHERE (module, name) IN
+               (SELECT * FROM unnest(%s::varchar[], %s::varchar[]))''',
+            (
+                [m._module for m in models] + [m._module for m in report_models],
+                ['access_%s_all' % (m._table, ) for m in models]
+                    + ['report_%s_%s' % (m._module, m._table) for m in report_models],
+                ))
+    cr.execute(
+            '''DELETE FROM ir_values
+               WHERE key = 'action' AND key2 = 'client_print_multi' AND model IN %s''',
+            (tuple(m._name for m in report_models), ),
+            )
+    cr.execute(
+            '''DELETE FROM ir_act_report_xml WHERE report_type = 'pdf' AND model IN %s''',
+            (tuple(m._name for m in report_models), ),
+            )
+
+def generate_checklists(cr, uid, checklist_model, checklists, questions):
+    "create checklists with questions of rotating response types; returns their ids"
+    types = ['yes_no', 'pass_fail', 'done_skip']
+    checklist_ids = []
+    for i in range(checklists):
+        checklist_ids.append(checklist_model.create(cr, uid, {
+                'name': 'Checklist %05d' % (i, ),
+                'question_ids': [
+                    (0, 0, {'question': 'Question %03d of checklist %05d' % (j, i), 'response_type': types[j % 3]})
+                    for j in range(questions)
+                    ],
+                }))
+    return checklist_ids
+
+def answer_histories(cr, history_model, history_ids):
+    "answer DONE_RATIO of the histories at random and mark them done; returns their ids"
+    answer_model = history_model.pool.get('%s.answer' % (history_model._name, ))
+    responses = history_model.pool.get('fnx.checklist.allowed_response').get_responses(cr, 1)
+    done_ids = sorted(random.sample(history_ids, int(len(history_ids) * DONE_RATIO)))
+    if not done_ids:
+        return []
+    cr.execute(
+            '''SELECT a.id, q.response_type
+               FROM "%s" a
+               JOIN "%s" h ON h.id = a.checklist_history_id
+               JOIN fnx_checklist_version_question q ON q.version_id = h.version_id AND q.position = a.position
+               WHERE h.id IN %%s'''
+               % (answer_model._table, history_model._table),
+            (tuple(done_ids), ),
+            )
+    answers = cr.fetchall()
+    cr.execute(
+            '''UPDATE "%s" a
+               SET answer_id = v.answer_id, detail = NULLIF(v.detail, '')
+               FROM unnest(%%s::int[], %%s::int[], %%s::varchar[]) AS v(id, answer_id, detail)
+               WHERE a.id = v.id'''
+               % (answer_model._table, ),
+            (
+                [a[0] for a in answers],
+                [random.choice(responses[a[1]]).id for a in answers],
+                [random.random() < 0.1 and 'needs follow-up' or '' for a in answers],
+                ))
+    cr.execute(
+            '''UPDATE "%s" SET state = 'done', date_end = now() AT TIME ZONE 'UTC' WHERE id IN %%s'''
+            % (history_model._table, ),
+            (tuple(done_ids), ),
+            )
+    return done_ids
+
+@contextmanager
+def measure(timings, name, cr):
+    "append (name, {seconds, queries, peak_mb}) to timings for the enclosed block"
+    queries = cr.sql_log_count if cr is not None else 0
+    start = time.time()
+    yield
+    seconds = time.time() - start
+    queries = cr.sql_log_count - queries if cr is not None else 0
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    timings.append((name, {'seconds': round(seconds, 4), 'queries': queries, 'peak_mb': round(peak_mb, 1)}))
+    print('    %-40s %9.3fs %7d queries %8.1f MB' % (name, seconds, queries, peak_mb))
+
+def report(results, baseline, tolerance):
+    "print results next to the baseline; returns True if anything regressed"
+    regressed = False
+    for size in sorted(results, key=lambda s: [int(n) for n in s.split('x')]):
+        print('\n%s (checklists x questions x histories)' % (size, ))
+        print('    %-40s %10s %10s %8s %8s' % ('', 'seconds', 'baseline', 'queries', 'baseline'))
+        for name, now in sorted(results[size].items()):
+            then = baseline.get(size, {}).get(name)
+            flag = ''
+            if then is not None:
+                if (
+                        now['seconds'] > then['seconds'] * (1 + tolerance)
+                        or now['queries'] > then['queries']
+                    ):
+                    flag = '  <-- regressed'
+                    regressed = True
+            print('    %-40s %10.3f %10s %8d %8s%s' % (
+                    name, now['seconds'],
+                    then and '%.3f' % then['seconds'] or '-',
+                    now['queries'],
+                    then and then['queries'] or '-',
+                    flag,
+                    ))
+    return regressed
+
+def create_database(db_name):
+    from openerp import sql_db
+    db = sql_db.db_connect('postgres')
+    cr = db.cursor()
+    try:
+        cr.autocommit(True)
+        cr.execute('''CREATE DATABASE "%s" ENCODING 'unicode' TEMPLATE "template0"''' % (db_name, ))
+    finally:
+        cr.close()
+
+def drop_database(db_name):
+    from openerp import sql_db
+    sql_db.close_db(db_name)
+    db = sql_db.db_connect('postgres')
+    cr = db.cursor()
+    try:
+        cr.autocommit(True)
+        cr.execute('DROP DATABASE IF EXISTS "%s"' % (db_name, ))
+    finally:
+        cr.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,22 +2,128 @@
 
 from aenum import NamedTuple
 from collections import defaultdict
+from datetime import date, datetime
 from fnx.oe import Normalize
 from io import BytesIO
+from multiprocessing import cpu_count, Pool
 from openerp import pooler, SUPERUSER_ID
 from openerp.exceptions import ERPError
 from openerp.netsvc import Service
 from openerp.report.interface import report_int
 from openerp.report.render import render
-from openerp.tools import DEFAULT_SERVER_DATETIME_FORMAT
+from openerp.tools import config, DEFAULT_SERVER_DATE_FORMAT, DEFAULT_SERVER_DATETIME_FORMAT, ormcache
 from osv import fields, osv
 from reportlab.pdfgen.canvas import Canvas
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.units import inch
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from itertools import islice
+from tempfile import gettempdir, mkstemp, SpooledTemporaryFile, TemporaryFile
+import base64
+import binascii
+import cgi
+import csv
+import gzip
+import hashlib
+import json
+import openerp
 import logging
+import os
+import psycopg2
+import random
+import re
+import threading
+import time
+import traceback
+import zlib
+
+try:
+    from PyPDF2 import PdfFileMerger, PdfFileReader, PdfFileWriter
+except ImportError:
+    PdfFileMerger = PdfFileReader = PdfFileWriter = None
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
 
 
 _logger = logging.getLogger(__name__)
+_perf_logger = logging.getLogger(__name__ + '.perf')
+
+PDF_AUTHOR = 'Sunridge Farms'
+PDF_SUBJECT = 'Product Specification Labels'
+
+# selections smaller than PARALLEL_MIN_RECORDS are always drawn serially, as is
+# everything outside prefork workers (see can_fork_renderers)
+PARALLEL_MIN_RECORDS = 50
+PARALLEL_CHUNK_SIZE = 25
+
+# selections of STREAM_MIN_RECORDS or more are fetched STREAM_CHUNK_SIZE records
+# at a time, drawn STREAM_PART_SIZE records per temporary pdf, and concatenated
+# into a file that is spooled to disk past STREAM_SPOOL_SIZE; as larger prints
+# are queued (see ASYNC_MIN_RECORDS) this happens in report jobs, or with
+# report_sync in the context
+STREAM_MIN_RECORDS = 1000
+STREAM_CHUNK_SIZE = 200
+STREAM_PART_SIZE = 1000
+STREAM_SPOOL_SIZE = 8 * 1024 * 1024
+
+# default disk budget of the rendered-record cache; set checklist_pdf_cache_size
+# to 0 in the server config to disable it
+FRAGMENT_CACHE_SIZE = 256 * 1024 * 1024
+
+# done histories older than ARCHIVE_AGE_MONTHS whole months are moved to the
+# archive, ARCHIVE_BATCH_SIZE at a time
+ARCHIVE_AGE_MONTHS = 3
+ARCHIVE_BATCH_SIZE = 1000
+
+# instrumentation is switched on per database with these ir.config_parameter
+# keys: INSTRUMENT_LOG_KEY=1 logs every traced operation to the
+# <module>.perf logger, INSTRUMENT_SAMPLE_KEY=<0..1> stores that fraction of
+# them as fnx.checklist.timing samples; settings are re-read every
+# INSTRUMENT_REFRESH seconds and samples kept TIMING_KEEP_DAYS days
+INSTRUMENT_LOG_KEY = 'fnx_checklist.instrument'
+INSTRUMENT_SAMPLE_KEY = 'fnx_checklist.instrument_sample'
+INSTRUMENT_REFRESH = 60
+TIMING_KEEP_DAYS = 30
+
+# reports of ASYNC_MIN_RECORDS or more records (or with report_async in the
+# context, but never with report_sync) are queued as fnx.checklist.report.job
+# and drawn by a background thread, which polls every JOB_POLL_SECONDS and
+# exits after JOB_IDLE_SECONDS without work; running jobs untouched for
+# JOB_STALE_MINUTES are retried by the scheduled action
+ASYNC_MIN_RECORDS = 300
+JOB_POLL_SECONDS = 2
+JOB_IDLE_SECONDS = 60
+JOB_STALE_MINUTES = 30
+
+# deleted checklists, questions, histories and answers are remembered for
+# TOMBSTONE_KEEP_DAYS so sync() can report them; clients whose watermark is
+# older than that start over
+TOMBSTONE_KEEP_DAYS = 90
+
+# question texts and answer details are searched (see search_text) through
+# pg_trgm indexes, or full text indexes where the extension is not available;
+# TEXT_SEARCH_LIMIT histories are returned by default
+TEXT_SEARCH_LIMIT = 100
+
+# answer exports (see checklist_history.export_answers) are read from a
+# server-side cursor EXPORT_CHUNK_SIZE rows at a time; each row holds
+# EXPORT_FIELDS
+EXPORT_CHUNK_SIZE = 5000
+EXPORT_FIELDS = (
+        'history_id', 'history', 'checklist', 'user', 'date_end',
+        'position', 'question', 'response_type', 'response', 'detail',
+        )
+
+# PostgreSQL cuts identifiers (index names included) to this many bytes
+PG_NAME_LENGTH = 63
+
+# history columns holding the answers of packed histories, see
+# checklist_history.pack_histories
+PACKED_COLUMNS = ('packed_answer_ids', 'packed_answers', 'packed_detail_positions', 'packed_details')
 
 # enumerations
 
@@ -33,12 +139,85 @@ class Allowed_Response_Type(fields.SelectionEnum):
     pass_fail = 'Pass/Fail'
     done_skip = 'Done/Skip'
 
+class Job_Status(fields.SelectionEnum):
+    _order_ = 'pending running done failed'
+    pending = 'Pending'
+    running = 'Running'
+    done = 'Done'
+    failed = 'Failed'
+
+class Response_Result(fields.SelectionEnum):
+    # position of a response within its type
+    _order_ = 'affirmative negative not_applicable'
+    affirmative = 'Affirmative'
+    negative = 'Negative'
+    not_applicable = 'N/A'
+
+# plain data
+
+class Area(NamedTuple):
+    width = 0
+    height = 1
+
+class Point(NamedTuple):
+    x = 0
+    y = 1
+
+class Response(NamedTuple):
+    id = 0
+    name = 1
+
+class TemplateQuestion(NamedTuple):
+    id = 0
+    question = 1
+    response_type = 2
+
+class QuestionSnapshot(NamedTuple):
+    version = 0
+    questions = 1
+    version_id = 2
+
+class ReportHeader(NamedTuple):
+    id = 0
+    name = 1
+    checklist = 2   # None for checklist templates
+    user = 3
+    date_end = 4
+
+class ReportLine(NamedTuple):
+    question = 0
+    response_type = 1
+    response = 2
+    detail = 3
+
+class Page(NamedTuple):
+    header = 0      # ReportHeader on a record's first page, None after
+    rule = 1        # y of the rule line
+    rows = 2        # [PageRow, ...]
+
+class PageRow(NamedTuple):
+    top = 0         # baseline of the first question line
+    text = 1        # question lines
+    choice = 2      # choices (templates) or response (histories)
+    detail_top = 3  # baseline of the first detail line
+    detail = 4      # detail lines
+    bottom = 5      # baseline of the last line
+
+
 # models
 ##
 ## fnx.checklist
 ## fnx.checklist.question
 ## fnx.checklist.history
 ## fnx.checklist.history.answer
+## fnx.checklist.allowed_response
+## fnx.checklist.version
+## fnx.checklist.version.question
+## fnx.checklist.statistic
+## fnx.checklist.timing
+## fnx.checklist.timing.summary
+## fnx.checklist.report.job
+## fnx.checklist.tombstone
 
 
 class checklist(Normalize, osv.AbstractModel):
@@ -57,13 +236,327 @@ class checklist(Normalize, osv.AbstractModel):
                 checklist_report(self._name, report_name)
     #
     def _auto_init(self, cr, context=None):
+        self._rename_duplicates(cr)
         res = super(checklist, self)._auto_init(cr, context=context)
         # one-time creation of structures
-        if self._name != 'fnx.checklist':
-            add_report(self, cr, context)
-        add_permissions(self, cr, context)
+        queue_bootstrap(self, cr, report=self._name != 'fnx.checklist')
+        add_indexes(self, cr, [
+                ('write_date_idx', '(write_date)'),
+                ])
+        return res
+    #
+    def _auto_end(self, cr, context=None):
+        res = super(checklist, self)._auto_end(cr, context=context)
+        run_bootstrap(cr, context)
+        return res
+    #
+    def _rename_duplicates(self, cr):
+        "suffix repeated checklist names with their id, so the unique(name) constraint can be added"
+        if not self._auto:
+            return
+        cr.execute('SELECT to_regclass(%s)', ('"%s"' % (self._table, ), ))
+        if not cr.fetchone()[0]:
+            return
+        cr.execute(
+                '''UPDATE "%s" c
+                   SET name = left(c.name, 128 - length(' (' || c.id || ')')) || ' (' || c.id || ')'
+                   FROM (
+                       SELECT id, row_number() OVER (PARTITION BY name ORDER BY id) AS n
+                       FROM "%s"
+                       ) d
+                   WHERE c.id = d.id AND d.n > 1
+                   RETURNING c.id, c.name'''
+                   % (self._table, self._table),
+                )
+        renamed = sorted(cr.fetchall())
+        if renamed:
+            _logger.warning(
+                    '%s: %d duplicate checklist name(s) renamed: %s',
+                    self._name, len(renamed),
+                    ', '.join('%d -> %s' % (id, name) for id, name in renamed),
+                    )
+    #
+    # question changes made while saving a checklist are versioned once, at the end
+    #
+    def create(self, cr, uid, values, context=None):
+        ctx = dict(context or {}, checklist_version_deferred=True)
+        id = super(checklist, self).create(cr, uid, values, context=ctx)
+        self.pool.get('%s.question' % (self._name, )).questions_changed(cr, uid, [id], context=context)
+        return id
+    #
+    def write(self, cr, uid, ids, values, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        ctx = dict(context or {}, checklist_version_deferred=True)
+        res = super(checklist, self).write(cr, uid, ids, values, context=ctx)
+        self.pool.get('%s.question' % (self._name, )).questions_changed(cr, uid, ids, context=context)
+        return res
+    #
+    def unlink(self, cr, uid, ids, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        res = super(checklist, self).unlink(cr, uid, ids, context=context)
+        self.pool.get('%s.question' % (self._name, )).clear_caches()
+        self.pool.get('fnx.checklist.tombstone').add(cr, self._name, ids)
         return res
     #
+    def sync(self, cr, uid, watermark=False, context=None):
+        """
+        return this module's checklist records changed since watermark
+
+        The result holds 'watermark' (pass it next time), 'reset', and a
+        columnar payload (see columnar()) for each of checklist, question,
+        history, answer and version_question, with the ids deleted since
+        watermark under 'deleted'.  Without a usable watermark 'reset' is True
+        and everything is sent, but only open histories.  Histories and
+        answers are the ones uid may read; the questions of the versions the
+        sent histories were answered against are always included.
+
+        Packed histories (see pack_histories) are sent with their packed
+        columns, which replace whatever answers the client holds for them;
+        their answer rows are reported deleted when packed, and come back as
+        changed answers under the same ids when unpacked.
+        """
+        history_model = self.pool.get('%s.history' % (self._name, ))
+        answer_model = self.pool.get('%s.history.answer' % (self._name, ))
+        question_model = self.pool.get('%s.question' % (self._name, ))
+        # rows written by transactions still running are stamped earlier than
+        # their commit, so the next watermark cannot be later than their start
+        cr.execute(
+                '''SELECT least(now(), min(xact_start)) AT TIME ZONE 'UTC',
+                          (now() - interval '1 day' * %s) AT TIME ZONE 'UTC'
+                   FROM pg_stat_activity
+                   WHERE datname = current_database()''',
+                (TOMBSTONE_KEEP_DAYS, ),
+                )
+        new_watermark, horizon = cr.fetchone()
+        reset = not watermark or watermark < horizon.strftime(DEFAULT_SERVER_DATETIME_FORMAT)
+        if reset:
+            changed = []
+            history_domain = [('state', 'in', ['ready', 'active'])]
+        else:
+            changed = [('write_date', '>=', watermark)]
+            history_domain = changed
+        checklist_ids = self.search(cr, uid, changed, context=context)
+        question_ids = question_model.search(cr, uid, changed, context=context)
+        history_ids = history_model.search(cr, uid, history_domain, context=context)
+        # answers of the histories sent, and any answered since
+        answer_ids = set(answer_model.search(cr, uid, [('checklist_history_id', 'in', history_ids)], context=context))
+        if not reset:
+            answer_ids.update(answer_model.search(cr, uid, changed, context=context))
+        answer_ids = sorted(answer_ids)
+        version_question_ids = []
+        if history_ids:
+            cr.execute(
+                    '''SELECT q.id
+                       FROM fnx_checklist_version_question q
+                       WHERE q.version_id IN (SELECT DISTINCT version_id FROM "%s" WHERE id IN %%s)'''
+                       % (history_model._table, ),
+                    (tuple(history_ids), ),
+                    )
+            version_question_ids = [r[0] for r in cr.fetchall()]
+        tombstone = self.pool.get('fnx.checklist.tombstone')
+        result = {
+                'watermark': new_watermark.strftime('%Y-%m-%d %H:%M:%S.%f'),
+                'reset': reset,
+                }
+        for kind, model, ids, extra in (
+                ('checklist', self, checklist_ids, ()),
+                ('question', question_model, question_ids, ()),
+                ('history', history_model, history_ids, PACKED_COLUMNS),
+                ('answer', answer_model, answer_ids, ()),
+                ('version_question', self.pool.get('fnx.checklist.version.question'), version_question_ids, ()),
+            ):
+            payload = result[kind] = columnar(model, cr, ids, extra)
+            payload['deleted'] = [] if reset else tombstone.get_deleted(cr, model._name, watermark)
+        return result
+    #
+    def import_checklists(self, cr, uid, data, format='csv', context=None):
+        """
+        create checklists, with their questions, from csv or yaml text
+
+        csv has a header row naming its columns -- name, question,
+        response_type, and optionally description -- and one row per question
+        (a row without a question adds a checklist with no questions); yaml is
+        a list of {name, description, questions: [{question, response_type}]}.
+        Checklists whose name is already taken are skipped; returns the new
+        checklist ids.  Names are unique (see _rename_duplicates).
+        """
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        checklists = []
+        if format == 'csv':
+            found = {}
+            for row in csv.DictReader(BytesIO(data)):
+                row = dict((k.strip().lower(), (v or '').decode('utf-8').strip()) for k, v in row.items() if k)
+                name = row.get('name')
+                if name not in found:
+                    found[name] = len(checklists)
+                    checklists.append({'name': name, 'description': row.get('description'), 'questions': []})
+                if row.get('question'):
+                    checklists[found[name]]['questions'].append(row)
+        elif format == 'yaml':
+            if yaml is None:
+                raise ERPError('Missing Library', 'PyYAML is needed to import yaml')
+            checklists = yaml.safe_load(data) or []
+            if not isinstance(checklists, list):
+                raise ERPError('Invalid Checklists', 'yaml must hold a list of checklists')
+        else:
+            raise ERPError('Invalid Format', 'import format must be csv or yaml, not %r' % (format, ))
+        errors = []
+        seen = set()
+        entries = []
+        for i, checklist in enumerate(checklists, start=1):
+            if not isinstance(checklist, dict):
+                errors.append('checklist %d is not a mapping' % (i, ))
+                continue
+            if not isinstance(checklist.get('questions') or [], list) or not all(
+                    isinstance(q, dict) for q in checklist.get('questions') or ()
+                ):
+                errors.append('checklist %d: questions must be a list of mappings' % (i, ))
+                continue
+            name = unicode(checklist.get('name') or '').strip()
+            if not name:
+                errors.append('checklist %d has no name' % (i, ))
+            elif len(name) > 128:
+                errors.append('checklist %d: name must have at most 128 characters, not %d' % (i, len(name)))
+            elif name in seen:
+                errors.append('checklist %d (%s): listed twice' % (i, name))
+            seen.add(name)
+            description = checklist.get('description')
+            if description is not None and not isinstance(description, basestring):
+                errors.append('checklist %d (%s): description must be text' % (i, name))
+            questions = []
+            for j, question in enumerate(checklist.get('questions') or (), start=1):
+                text = unicode(question.get('question') or '').strip()
+                response_type = unicode(question.get('response_type') or '').strip()
+                if response_type not in Allowed_Response_Type.__members__:
+                    errors.append('checklist %d (%s), question %d: %r is not a response type' % (i, name, j, response_type))
+                if not text or len(text) > 128:
+                    errors.append('checklist %d (%s), question %d: must have 1 to 128 characters' % (i, name, j))
+                questions.append((text, response_type))
+            entries.append((name, checklist.get('description') or None, questions))
+        if errors:
+            raise ERPError('Invalid Checklists', '\n'.join(errors))
+        return self._insert_checklists(cr, uid, entries, context=context)
+    #
+    def _insert_checklists(self, cr, uid, entries, context=None):
+        """
+        insert [(name, description, [(question, response_type), ...]), ...]
+
+        Names already taken are skipped; returns the new checklist ids.
+        """
+        if not entries:
+            return []
+        question_model = self.pool.get('%s.question' % (self._name, ))
+        self.check_access_rights(cr, uid, 'create')
+        question_model.check_access_rights(cr, uid, 'create')
+        cr.execute(
+                '''INSERT INTO "%s"
+                       (
+                         name, description,
+                         create_uid, create_date, write_uid, write_date
+                         )
+                   SELECT v.name, v.description,
+                          %%s, now() AT TIME ZONE 'UTC', %%s, now() AT TIME ZONE 'UTC'
+                   FROM unnest(%%s::varchar[], %%s::text[]) WITH ORDINALITY AS v(name, description, seq)
+                   ORDER BY v.seq
+                   ON CONFLICT (name) DO NOTHING
+                   RETURNING id, name'''
+                   % (self._table, ),
+                (uid, uid, [e[0] for e in entries], [e[1] for e in entries]),
+                )
+        created = dict((name, id) for id, name in cr.fetchall())
+        skipped = [e[0] for e in entries if e[0] not in created]
+        if skipped:
+            _logger.info('%s: %d existing checklist(s) skipped: %s', self._name, len(skipped), ', '.join(skipped))
+        questions = [
+                (created[name], text, response_type)
+                for name, _, items in entries
+                if name in created
+                for text, response_type in items
+                ]
+        if questions:
+            cr.execute(
+                    '''INSERT INTO "%s"
+                           (
+                             checklist_id, question, response_type,
+                             create_uid, create_date, write_uid, write_date
+                             )
+                       SELECT v.checklist_id, v.question, v.response_type,
+                              %%s, now() AT TIME ZONE 'UTC', %%s, now() AT TIME ZONE 'UTC'
+                       FROM unnest(%%s::int[], %%s::varchar[], %%s::varchar[])
+                            WITH ORDINALITY AS v(checklist_id, question, response_type, seq)
+                       ORDER BY v.seq'''
+                       % (question_model._table, ),
+                    [uid, uid] + [list(c) for c in zip(*questions)],
+                    )
+        ids = [created[e[0]] for e in entries if e[0] in created]
+        question_model.questions_changed(cr, uid, ids, context=context)
+        return ids
+    #
+    def clone_checklists(self, cr, uid, target, ids=None, context=None):
+        """
+        copy checklists (default: all of them), with their questions, to the
+        checklist model target of another module
+
+        Columns both models store are copied in one statement; names already
+        taken in target are skipped, and new checklists are matched to their
+        source by name, which is unique in both.  Returns the new ids in target.
+        """
+        target_model = self.pool.get(target)
+        if not isinstance(target_model, checklist) or target_model._name == self._name:
+            raise ERPError('Invalid Model', '%s is not another checklist model' % (target, ))
+        question_model = self.pool.get('%s.question' % (self._name, ))
+        target_question = self.pool.get('%s.question' % (target, ))
+        self.check_access_rights(cr, uid, 'read')
+        target_model.check_access_rights(cr, uid, 'create')
+        target_question.check_access_rights(cr, uid, 'create')
+        columns = [c for c in shared_columns(self, target_model) if c != 'name']
+        question_columns = [c for c in shared_columns(question_model, target_question) if c != 'checklist_id']
+        if ids is not None and not ids:
+            return []
+        cr.execute(
+                '''WITH source AS (
+                       SELECT DISTINCT ON (name) * FROM "%(source)s" %(where)s ORDER BY name, id
+                       ),
+                   new AS (
+                       INSERT INTO "%(target)s"
+                           (name%(columns)s, create_uid, create_date, write_uid, write_date)
+                       SELECT s.name%(s_columns)s, %%(uid)s, now() AT TIME ZONE 'UTC', %%(uid)s, now() AT TIME ZONE 'UTC'
+                       FROM source s
+                       ORDER BY s.id
+                       ON CONFLICT (name) DO NOTHING
+                       RETURNING id, name
+                       ),
+                   new_questions AS (
+                       INSERT INTO "%(target_question)s"
+                           (checklist_id%(q_columns)s, create_uid, create_date, write_uid, write_date)
+                       SELECT n.id%(sq_columns)s, %%(uid)s, now() AT TIME ZONE 'UTC', %%(uid)s, now() AT TIME ZONE 'UTC'
+                       FROM new n
+                       JOIN source s ON s.name = n.name
+                       JOIN "%(source_question)s" q ON q.checklist_id = s.id
+                       ORDER BY n.id, q.id
+                       )
+                   SELECT id FROM new ORDER BY id'''
+                   % {
+                       'source': self._table,
+                       'target': target_model._table,
+                       'source_question': question_model._table,
+                       'target_question': target_question._table,
+                       'where': ids is not None and 'WHERE id IN %(ids)s' or '',
+                       'columns': ''.join(', "%s"' % c for c in columns),
+                       's_columns': ''.join(', s."%s"' % c for c in columns),
+                       'q_columns': ''.join(', "%s"' % c for c in question_columns),
+                       'sq_columns': ''.join(', q."%s"' % c for c in question_columns),
+                       },
+                {'uid': uid, 'ids': ids and tuple(ids)},
+                )
+        new_ids = [r[0] for r in cr.fetchall()]
+        _logger.info('%s: %d checklist(s) cloned to %s', self._name, len(new_ids), target)
+        target_question.questions_changed(cr, uid, new_ids, context=context)
+        return new_ids
+    #
     # extra columns added here should also be added to checklist.history
     #
     _columns = {
@@ -75,8 +568,8 @@ class checklist(Normalize, osv.AbstractModel):
                 ),
         }
     #
-    _constraints = [
-        (lambda s, *a: s.check_unique('name', *a), '\nChecklist name already exists', ['name']),
+    _sql_constraints = [
+        ('name_uniq', 'unique(name)', 'Checklist name already exists'),
         ]
 
 
@@ -90,13 +583,149 @@ class question(Normalize, osv.AbstractModel):
         super(question, self).__init__(pool, cr)
         # fix-up pointer fields
         self._columns['checklist_id']._obj = self._name.rsplit('.', 1)[0]
+        # compiled question lists, see get_snapshots()
+        self._snapshots = {}
     #
     def _auto_init(self, cr, context=None):
         res = super(question, self)._auto_init(cr, context=context)
         # one-time creation of structures
-        add_permissions(self, cr, context)
+        queue_bootstrap(self, cr)
+        add_indexes(self, cr, [
+                ('checklist_idx', '(checklist_id, id)'),
+                ('write_date_idx', '(write_date)'),
+                ])
+        return res
+    #
+    def _auto_end(self, cr, context=None):
+        res = super(question, self)._auto_end(cr, context=context)
+        run_bootstrap(cr, context)
+        return res
+    #
+    def create(self, cr, uid, values, context=None):
+        res = super(question, self).create(cr, uid, values, context=context)
+        self.questions_changed(cr, uid, [values.get('checklist_id')], context=context)
+        return res
+    #
+    def write(self, cr, uid, ids, values, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        checklist_ids = self._get_checklist_ids(cr, ids)
+        res = super(question, self).write(cr, uid, ids, values, context=context)
+        if values.get('checklist_id'):
+            checklist_ids.append(values['checklist_id'])
+        self.questions_changed(cr, uid, checklist_ids, context=context)
+        return res
+    #
+    def unlink(self, cr, uid, ids, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        checklist_ids = self._get_checklist_ids(cr, ids)
+        res = super(question, self).unlink(cr, uid, ids, context=context)
+        self.questions_changed(cr, uid, checklist_ids, context=context)
+        self.pool.get('fnx.checklist.tombstone').add(cr, self._name, ids)
         return res
     #
+    def _get_checklist_ids(self, cr, ids):
+        if not ids:
+            return []
+        cr.execute('SELECT DISTINCT checklist_id FROM "%s" WHERE id IN %%s' % (self._table, ), (tuple(ids), ))
+        return [r[0] for r in cr.fetchall()]
+    #
+    def questions_changed(self, cr, uid, checklist_ids, context=None):
+        """
+        snapshot a new version of each checklist whose questions changed
+
+        Skipped while the checklist itself is being saved, which calls this
+        once it is done.
+        """
+        if not (context or {}).get('checklist_version_deferred'):
+            checklist_ids = [id for id in checklist_ids if id]
+            self.pool.get('fnx.checklist.version').snapshot(cr, uid, self, checklist_ids)
+        self.clear_caches()
+    #
+    def clear_caches(self):
+        # only this process' snapshots; the other workers' are checked against
+        # the database by get_snapshots, so the registry-wide signal (which
+        # makes every worker drop all of its caches) is not sent
+        self._snapshots.clear()
+        super(question, self).clear_caches()
+    #
+    def get_snapshots(self, cr, uid, checklist_ids, context=None):
+        """
+        return {checklist_id: QuestionSnapshot(version, questions, version_id)}
+
+        questions is a tuple of TemplateQuestion(id, question, response_type) in
+        display order, version is the (checklist write_date, latest question
+        write_date, question count) it was compiled from, and version_id the
+        matching fnx.checklist.version; snapshots are shared and must not be
+        modified.  Unknown checklist ids are left out.
+
+        Cached snapshots are checked against their version with one aggregate
+        query, so changes that skip clear_caches() (raw sql, other workers) are
+        picked up as long as they touch write_date or the question count.
+        """
+        self.check_access_rights(cr, uid, 'read')
+        checklist_model = self.pool.get(self._columns['checklist_id']._obj)
+        cached = [id for id in set(checklist_ids) if id in self._snapshots]
+        stale = []
+        if cached:
+            cr.execute(
+                    '''SELECT c.id, c.write_date, max(q.write_date), count(q.id)
+                       FROM "%s" c
+                       LEFT JOIN "%s" q ON q.checklist_id = c.id
+                       WHERE c.id IN %%s
+                       GROUP BY c.id'''
+                       % (checklist_model._table, self._table),
+                    (tuple(cached), ),
+                    )
+            current = dict((r[0], tuple(r[1:])) for r in cr.fetchall())
+            for id in cached:
+                if current.get(id) != self._snapshots[id].version:
+                    del self._snapshots[id]
+                    stale.append(id)
+        missing = [id for id in set(checklist_ids) if id not in self._snapshots]
+        if missing:
+            cr.execute(
+                    '''SELECT c.id, c.write_date, q.id, q.question, q.response_type, q.write_date,
+                              (SELECT max(v.id) FROM fnx_checklist_version v
+                               WHERE v.model = %%s AND v.checklist_id = c.id)
+                       FROM "%s" c
+                       LEFT JOIN "%s" q ON q.checklist_id = c.id
+                       WHERE c.id IN %%s
+                       ORDER BY c.id, q.id'''
+                       % (checklist_model._table, self._table),
+                    (checklist_model._name, tuple(missing)),
+                    )
+            compiled = {}
+            unversioned = []
+            for checklist_id, checklist_date, id, text, response_type, write_date, version_id in cr.fetchall():
+                checklist_date, latest, questions, version_id = compiled.setdefault(
+                        checklist_id,
+                        (checklist_date, [None], [], version_id),
+                        )
+                if id is not None:
+                    questions.append(TemplateQuestion(id, text, response_type))
+                    latest[0] = max(latest[0], write_date)
+                if (version_id is None or checklist_id in stale) and checklist_id not in unversioned:
+                    unversioned.append(checklist_id)
+            if unversioned:
+                # checklists that predate versioning get their first version now, and
+                # ones changed behind our back a new one if their questions differ
+                version_ids = self.pool.get('fnx.checklist.version').snapshot(cr, SUPERUSER_ID, self, unversioned)
+                for checklist_id, version_id in version_ids.items():
+                    compiled[checklist_id] = compiled[checklist_id][:3] + (version_id, )
+            for checklist_id, (checklist_date, latest, questions, version_id) in compiled.items():
+                self._snapshots[checklist_id] = QuestionSnapshot(
+                        (checklist_date, latest[0], len(questions)),
+                        tuple(questions),
+                        version_id,
+                        )
+        return dict(
+                (id, self._snapshots[id])
+                for id in checklist_ids
+                if id in self._snapshots
+                )
+    #
     _columns = {
         'question': fields.char("Question", size=128, required=True),
         'checklist_id': fields.many2one('fnx.checklist', 'Checklist', required=True),
@@ -120,20 +749,206 @@ class checklist_history(Normalize, osv.AbstractModel):
         self._columns['answer_ids']._obj = '%s.answer' % (self._name, )
         user_id = self._columns['user_id']
         if self._name != 'fnx.checklist.history' and not user_id._domain:
-            group_id = fields.ref('%s.group_%s_staff' % (self._module, self._module))
-            user_id._domain = [('groups_id','=',group_id(pool, cr))]
+            group_id = staff_group_id(pool, cr, '%s.group_%s_staff' % (self._module, self._module))
+            user_id._domain = [('groups_id','=',group_id)]
             report_name = 'report.%s.%s' % (self._module, self._name)
             if report_name not in Service._services:
                 checklist_report(self._name, report_name)
     #
     def _auto_init(self, cr, context=None):
+        # the summary columns are filled with their default when added, so
+        # histories written before them are told apart here
+        cr.execute(
+                '''SELECT bool_or(column_name = 'id'), bool_or(column_name = 'answered_count')
+                   FROM information_schema.columns
+                   WHERE table_name = %s AND column_name IN ('id', 'answered_count')''',
+                (self._table, ),
+                )
+        exists, scored = cr.fetchone()
+        self._unscored = bool(self._auto and exists and not scored)
         res = super(checklist_history, self)._auto_init(cr, context=context)
         # one-time creation of structures
-        if self._name != 'fnx.checklist.history':
-            add_report(self, cr, context)
-        add_permissions(self, cr, context)
+        queue_bootstrap(self, cr, report=self._name != 'fnx.checklist.history')
+        # open histories are searched with state in (ready, active) so that the
+        # partial indexes apply
+        add_indexes(self, cr, [
+                ('checklist_idx', '(checklist_id, date_end)'),
+                ('open_user_idx', "(user_id, date_end) WHERE state IN ('ready', 'active')"),
+                ('open_date_end_idx', "(date_end) WHERE state IN ('ready', 'active')"),
+                ('write_date_idx', '(write_date)'),
+                ('failed_idx', '(date_end) WHERE negative_count > 0'),
+                ('score_idx', '(score, date_end)'),
+                ('version_idx', '(version_id)'),
+                ])
+        # compact storage of done histories, see pack_histories()
+        add_columns(self, cr, [
+                ('packed_answer_ids', 'integer[]'),
+                ('packed_answers', 'smallint[]'),
+                ('packed_detail_positions', 'smallint[]'),
+                ('packed_details', 'varchar[]'),
+                ])
+        # packed answers are read by id, see question_history.read()
+        add_indexes(self, cr, [
+                ('packed_answer_ids_idx', 'USING gin (packed_answer_ids) WHERE packed_answer_ids IS NOT NULL'),
+                ])
+        if self._auto:
+            # packed details are searched as one string, which has to be immutable to be indexed
+            cr.execute(
+                    '''CREATE OR REPLACE FUNCTION fnx_checklist_join(varchar[]) RETURNS text
+                       LANGUAGE sql IMMUTABLE AS $$ SELECT array_to_string($1, ' ') $$'''
+                    )
+        add_text_indexes(self, cr, [
+                ('packed_details', 'fnx_checklist_join(packed_details)'),
+                ])
+        add_archive(self, cr)
+        return res
+    #
+    def _auto_end(self, cr, context=None):
+        res = super(checklist_history, self)._auto_end(cr, context=context)
+        run_bootstrap(cr, context)
+        if self._auto:
+            self._migrate_to_versions(cr)
+            self._fill_packed_answer_ids(cr)
+            self._fill_scores(cr)
         return res
     #
+    def _fill_packed_answer_ids(self, cr):
+        "give the answers of histories packed before their ids were kept an id each"
+        answer_model = self.pool.get('%s.answer' % (self._name, ))
+        cr.execute(
+                '''UPDATE "%s" h
+                   SET packed_answer_ids = ARRAY(
+                       SELECT nextval('%s_id_seq')::integer
+                       FROM generate_series(1, array_length(h.packed_answers, 1))
+                       )
+                   WHERE h.packed_answers IS NOT NULL AND h.packed_answer_ids IS NULL'''
+                   % (self._table, answer_model._table),
+                )
+        if cr.rowcount:
+            _logger.info('%s: %d packed histories given answer ids', self._name, cr.rowcount)
+    #
+    def _fill_scores(self, cr):
+        "count the answers of histories written before the summary columns existed"
+        if not self._unscored:
+            return
+        self._unscored = False
+        cr.execute('SELECT id FROM "%s" ORDER BY id' % (self._table, ))
+        ids = [r[0] for r in cr.fetchall()]
+        for start in range(0, len(ids), ARCHIVE_BATCH_SIZE):
+            self.update_scores(cr, ids[start:start+ARCHIVE_BATCH_SIZE])
+        if ids:
+            _logger.info('%s: %d histories scored', self._name, len(ids))
+    #
+    def _migrate_to_versions(self, cr):
+        """
+        convert histories written before checklist versions existed
+
+        Every distinct list of questions found in a checklist's histories
+        becomes a version of that checklist, answers are numbered, and the
+        copied question text and response type columns are dropped.
+        """
+        answer_model = self.pool.get('%s.answer' % (self._name, ))
+        question_model = self.pool.get('%s.question' % (self._name.rsplit('.', 1)[0]))
+        checklist_model = self.pool.get(self._name.rsplit('.', 1)[0])
+        version_model = self.pool.get('fnx.checklist.version')
+        cr.execute(
+                '''SELECT table_name, column_name
+                   FROM information_schema.columns
+                   WHERE table_name IN %s
+                     AND column_name IN ('question', 'response_type', 'packed_questions', 'packed_types')''',
+                ((answer_model._table, self._table), ),
+                )
+        legacy = set(cr.fetchall())
+        if not legacy:
+            return
+        _logger.info('%s: converting histories to checklist versions', self._name)
+        # every checklist starts with its current questions as a version
+        cr.execute('SELECT id FROM "%s"' % (checklist_model._table, ))
+        version_model.snapshot(cr, SUPERUSER_ID, question_model, [r[0] for r in cr.fetchall()])
+        # number the answers
+        cr.execute(
+                '''UPDATE "%s" a
+                   SET position = n.pos
+                   FROM (
+                       SELECT id, row_number() OVER (PARTITION BY checklist_history_id ORDER BY id) - 1 AS pos
+                       FROM "%s"
+                       ) n
+                   WHERE a.id = n.id AND a.position IS NULL'''
+                   % (answer_model._table, answer_model._table),
+                )
+        # collect the question lists in use
+        used = []
+        if (answer_model._table, 'question') in legacy:
+            cr.execute(
+                    '''SELECT h.id, h.checklist_id,
+                              array_agg(a.question ORDER BY a.position),
+                              array_agg(a.response_type ORDER BY a.position)
+                       FROM "%s" h
+                       JOIN "%s" a ON a.checklist_history_id = h.id
+                       WHERE h.version_id IS NULL
+                       GROUP BY h.id, h.checklist_id'''
+                       % (self._table, answer_model._table),
+                    )
+            used.extend(cr.fetchall())
+        if (self._table, 'packed_questions') in legacy:
+            cr.execute(
+                    '''SELECT id, checklist_id, packed_questions, packed_types
+                       FROM "%s"
+                       WHERE version_id IS NULL AND packed_answers IS NOT NULL'''
+                       % (self._table, ),
+                    )
+            used.extend(cr.fetchall())
+        if used:
+            # match them against the checklists' versions, creating any that are missing
+            checklist_ids = list(set(u[1] for u in used if u[1]))
+            known = {}
+            sequences = defaultdict(int)
+            if checklist_ids:
+                cr.execute(
+                        '''SELECT id, checklist_id, sequence
+                           FROM fnx_checklist_version
+                           WHERE model = %s AND checklist_id IN %s''',
+                        (checklist_model._name, tuple(checklist_ids)),
+                        )
+                versions = cr.fetchall()
+                contents = version_model.get_questions(cr, SUPERUSER_ID, [v[0] for v in versions])
+                for version_id, checklist_id, sequence in versions:
+                    key = checklist_id, tuple((q.question, q.response_type) for q in contents[version_id])
+                    known.setdefault(key, version_id)
+                    sequences[checklist_id] = max(sequences[checklist_id], sequence)
+            new = []
+            for history_id, checklist_id, questions, types in used:
+                key = checklist_id, tuple(zip(questions, types))
+                if key not in known:
+                    known[key] = None
+                    sequences[checklist_id] += 1
+                    new.append((checklist_id, sequences[checklist_id], key[1]))
+            if new:
+                for (checklist_id, _, questions), version_id in zip(
+                        new,
+                        version_model.add_versions(cr, SUPERUSER_ID, checklist_model._name, new),
+                    ):
+                    known[checklist_id, questions] = version_id
+            cr.execute(
+                    '''UPDATE "%s" h
+                       SET version_id = v.version_id
+                       FROM unnest(%%s::int[], %%s::int[]) AS v(id, version_id)
+                       WHERE h.id = v.id'''
+                       % (self._table, ),
+                    (
+                        [u[0] for u in used],
+                        [known[u[1], tuple(zip(u[2], u[3]))] for u in used],
+                        ))
+        cr.execute(
+                '''ALTER TABLE "%s" DROP COLUMN IF EXISTS question, DROP COLUMN IF EXISTS response_type'''
+                % (answer_model._table, )
+                )
+        cr.execute(
+                '''ALTER TABLE "%s" DROP COLUMN IF EXISTS packed_questions, DROP COLUMN IF EXISTS packed_types'''
+                % (self._table, )
+                )
+        _logger.info('%s: %d histories converted, %d versions added', self._name, len(used), len(new) if used else 0)
+    #
     _columns = {
         'name': fields.char("Name",size=128),
         'checklist_id': fields.many2one('fnx.checklist', 'Checklist'),
@@ -145,23 +960,988 @@ class checklist_history(Normalize, osv.AbstractModel):
             domain=[],
             ),
         'state': fields.selection(Status, "Status"),
+        'version_id': fields.many2one('fnx.checklist.version', 'Checklist Version', readonly=True),
+        # answer summary, kept current by update_scores()
+        'answered_count': fields.integer('Answered', readonly=True),
+        'affirmative_count': fields.integer('Passed', readonly=True),
+        'negative_count': fields.integer('Failed', readonly=True),
+        'not_applicable_count': fields.integer('N/A', readonly=True),
+        'score': fields.integer('Score (%)', readonly=True, group_operator='avg'),
         }
     #
     _defaults = {
         'state' : lambda *a: Status.ready,
         'user_id': lambda s, cr, uid, context: uid,
+        'answered_count': 0,
+        'affirmative_count': 0,
+        'negative_count': 0,
+        'not_applicable_count': 0,
         }
     #
+    def create(self, cr, uid, values, context=None):
+        if values.get('checklist_id') and not values.get('version_id'):
+            question_model = self.pool.get('%s.question' % (self._name.rsplit('.', 1)[0]))
+            snapshot = question_model.get_snapshots(cr, uid, [values['checklist_id']], context=context).get(values['checklist_id'])
+            if snapshot:
+                values = dict(values, version_id=snapshot.version_id)
+        # answers created with the history are scored once, at the end
+        ctx = dict(context or {}, checklist_scores_deferred=True)
+        id = super(checklist_history, self).create(cr, uid, values, context=ctx)
+        # answers not created by onchange_checklist_id are numbered in order
+        answer_model = self.pool.get('%s.answer' % (self._name, ))
+        cr.execute(
+                '''UPDATE "%s" a
+                   SET position = n.pos
+                   FROM (
+                       SELECT id, row_number() OVER (ORDER BY id) - 1 AS pos
+                       FROM "%s"
+                       WHERE checklist_history_id = %%s
+                       ) n
+                   WHERE a.id = n.id AND NOT EXISTS (
+                       SELECT 1 FROM "%s" WHERE checklist_history_id = %%s AND position IS NOT NULL
+                       )
+                   RETURNING a.id'''
+                   % (answer_model._table, answer_model._table, answer_model._table),
+                (id, id),
+                )
+        # which makes them countable
+        numbered = [r[0] for r in cr.fetchall()]
+        self.pool.get('fnx.checklist.statistic').add_answers(cr, answer_model, numbered, 1)
+        self.update_scores(cr, [id])
+        return id
+    #
+    def read(self, cr, uid, ids, fields=None, context=None, load='_classic_read'):
+        res = super(checklist_history, self).read(cr, uid, ids, fields=fields, context=context, load=load)
+        if res and (not fields or 'answer_ids' in fields):
+            # packed answers keep their ids, and are read from the packed columns
+            records = isinstance(res, dict) and [res] or res
+            cr.execute(
+                    '''SELECT id, packed_answer_ids FROM "%s"
+                       WHERE id IN %%s AND packed_answer_ids IS NOT NULL'''
+                       % (self._table, ),
+                    (tuple(r['id'] for r in records), ),
+                    )
+            packed = dict(cr.fetchall())
+            for record in records:
+                if record['id'] in packed:
+                    record['answer_ids'] = packed[record['id']]
+        return res
+    #
+    def write(self, cr, uid, ids, values, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if (
+                'checklist_id' in values
+                or 'answer_ids' in values
+                or values.get('state', 'done') != 'done'
+            ):
+            self.unpack_histories(cr, uid, ids, context=context)
+        # answers changed with the histories are scored once, at the end
+        ctx = dict(context or {}, checklist_scores_deferred=True)
+        if 'checklist_id' not in values:
+            res = super(checklist_history, self).write(cr, uid, ids, values, context=ctx)
+        else:
+            if 'version_id' not in values:
+                question_model = self.pool.get('%s.question' % (self._name.rsplit('.', 1)[0]))
+                checklist_id = values['checklist_id']
+                snapshot = checklist_id and question_model.get_snapshots(cr, uid, [checklist_id], context=context).get(checklist_id)
+                values = dict(values, version_id=snapshot and snapshot.version_id or False)
+            # answers are counted against their history's checklist: all of them
+            # are taken off the old one, the answers left after the write (with
+            # any answer_ids commands applied uncounted) are added to the new one
+            statistic = self.pool.get('fnx.checklist.statistic')
+            answer_model = self.pool.get('%s.answer' % (self._name, ))
+            domain = [('checklist_history_id', 'in', ids)]
+            statistic.add_answers(cr, answer_model, answer_model.search(cr, SUPERUSER_ID, domain, context=context), -1)
+            ctx['checklist_statistics_deferred'] = True
+            res = super(checklist_history, self).write(cr, uid, ids, values, context=ctx)
+            statistic.add_answers(cr, answer_model, answer_model.search(cr, SUPERUSER_ID, domain, context=context), 1)
+        if 'answer_ids' in values:
+            self.update_scores(cr, ids)
+        return res
+    #
+    def unlink(self, cr, uid, ids, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        # the answers outlive their history, but no longer count
+        self.unpack_histories(cr, uid, ids, context=context)
+        answer_model = self.pool.get('%s.answer' % (self._name, ))
+        answer_ids = answer_model.search(cr, SUPERUSER_ID, [('checklist_history_id', 'in', ids)], context=context)
+        self.pool.get('fnx.checklist.statistic').add_answers(cr, answer_model, answer_ids, -1)
+        res = super(checklist_history, self).unlink(cr, uid, ids, context=context)
+        self.pool.get('fnx.checklist.tombstone').add(cr, self._name, ids)
+        return res
+    #
     def onchange_checklist_id(self, cr, uid, ids, id, context=None):
+        trace = start_trace(self.pool, cr, 'onchange', self._name)
         question_model = '%s.question' % (self._name.rsplit('.', 1)[0])
         question_model = self.pool.get(question_model)
-        question_ids = question_model.search(cr, uid, [('checklist_id', '=', id)], context=context)
-        records = question_model.browse(cr, uid, question_ids, context=context)
         results = []
-        for rec in records:
-            obj = {'question': rec.question, 'response_type': rec.response_type}
-            results.append(obj)
-        return {'value': {'answer_ids': results}}
+        version_id = False
+        with trace.span('snapshot'):
+            snapshot = id and question_model.get_snapshots(cr, uid, [id], context=context).get(id)
+        if snapshot:
+            version_id = snapshot.version_id
+            for position, rec in enumerate(snapshot.questions):
+                obj = {'position': position, 'question': rec.question, 'response_type': rec.response_type}
+                results.append(obj)
+        trace.finish()
+        return {'value': {'version_id': version_id, 'answer_ids': results}}
+    #
+    def create_histories(self, cr, uid, assignments, context=None):
+        """
+        create a history, with all its answers, for each (checklist_id, user_id)
+
+        Rows are inserted with a fixed number of set-based statements; returns
+        the new history ids in assignments order.
+        """
+        if not assignments:
+            return []
+        answer_model = self.pool.get('%s.answer' % (self._name, ))
+        question_model = self.pool.get('%s.question' % (self._name.rsplit('.', 1)[0]))
+        checklist_model = self.pool.get(self._name.rsplit('.', 1)[0])
+        self.check_access_rights(cr, uid, 'create')
+        answer_model.check_access_rights(cr, uid, 'create')
+        checklist_ids = [a[0] for a in assignments]
+        user_ids = [a[1] for a in assignments]
+        snapshots = question_model.get_snapshots(cr, SUPERUSER_ID, checklist_ids, context=context)
+        missing = set(checklist_ids) - set(snapshots)
+        if missing:
+            raise ERPError(
+                    'Missing Checklist',
+                    'checklist(s) %s do not exist' % (', '.join(str(m) for m in sorted(missing)), ),
+                    )
+        cr.execute(
+                "SELECT nextval('%s_id_seq') FROM generate_series(1, %%s)" % (self._table, ),
+                (len(assignments), ),
+                )
+        history_ids = [r[0] for r in cr.fetchall()]
+        cr.execute(
+                '''INSERT INTO "%s"
+                       (
+                         id, name, checklist_id, version_id, user_id, state,
+                         answered_count, affirmative_count, negative_count, not_applicable_count,
+                         create_uid, create_date, write_uid, write_date
+                         )
+                   SELECT v.id, c.name, v.checklist_id, v.version_id, v.user_id, 'ready',
+                          0, 0, 0, 0,
+                          %%s, now() AT TIME ZONE 'UTC', %%s, now() AT TIME ZONE 'UTC'
+                   FROM unnest(%%s::int[], %%s::int[], %%s::int[], %%s::int[])
+                        AS v(id, checklist_id, version_id, user_id)
+                   JOIN "%s" c ON c.id = v.checklist_id'''
+                   % (self._table, checklist_model._table),
+                (
+                    uid, uid, history_ids, checklist_ids,
+                    [snapshots[c].version_id for c in checklist_ids],
+                    user_ids,
+                    ))
+        answer_history_ids = []
+        answer_positions = []
+        for history_id, checklist_id in zip(history_ids, checklist_ids):
+            for position in range(len(snapshots[checklist_id].questions)):
+                answer_history_ids.append(history_id)
+                answer_positions.append(position)
+        cr.execute(
+                '''INSERT INTO "%s"
+                       (
+                         checklist_history_id, position,
+                         create_uid, create_date, write_uid, write_date
+                         )
+                   SELECT v.history_id, v.position,
+                          %%s, now() AT TIME ZONE 'UTC', %%s, now() AT TIME ZONE 'UTC'
+                   FROM unnest(%%s::int[], %%s::int[])
+                        WITH ORDINALITY AS v(history_id, position, seq)
+                   ORDER BY v.seq'''
+                   % (answer_model._table, ),
+                (uid, uid, answer_history_ids, answer_positions),
+                )
+        return history_ids
+    #
+    def submit_answers(self, cr, uid, submissions, context=None):
+        """
+        record answers for many histories at once
+
+        submissions is {history_id: {position: response}}, where response is a
+        response id or name, or [response, detail]; keys and response ids may
+        be strings (as sent over rpc).  An answer's detail is only changed when one is sent.
+        Everything is validated before anything is written, and only open
+        (ready or active) histories can be answered.  They become active, or
+        done (with date_end set) once every answer is filled; returns
+        [(history_id, state), ...].
+        """
+        if not submissions:
+            return []
+        answer_model = self.pool.get('%s.answer' % (self._name, ))
+        statistic = self.pool.get('fnx.checklist.statistic')
+        submitted = {}
+        for history_id, answers in submissions.items():
+            for position, response in answers.items():
+                detail = None
+                has_detail = isinstance(response, (list, tuple))
+                if has_detail:
+                    response, detail = response
+                submitted[int(history_id), int(position)] = response, has_detail, detail or None
+        history_ids = sorted(set(k[0] for k in submitted))
+        self.check_access_rights(cr, uid, 'write')
+        answer_model.check_access_rights(cr, uid, 'write')
+        self.check_access_rule(cr, uid, history_ids, 'write', context=context)
+        # validate
+        errors = []
+        cr.execute(
+                'SELECT id, state FROM "%s" WHERE id IN %%s ORDER BY id' % (self._table, ),
+                (tuple(history_ids), ),
+                )
+        for history_id, state in cr.fetchall():
+            if state not in ('ready', 'active'):
+                errors.append('history %d is %s, not open' % (history_id, state))
+        if errors:
+            raise ERPError('Invalid Answers', '\n'.join(errors))
+        self.unpack_histories(cr, uid, history_ids, context=context)
+        codes = {}
+        for type, resps in self.pool.get('fnx.checklist.allowed_response').get_responses(cr, SUPERUSER_ID).items():
+            for resp in resps:
+                codes[type, resp.id] = resp.id
+                codes[type, resp.name.lower()] = resp.id
+        cr.execute(
+                '''SELECT a.checklist_history_id, a.position, a.id, q.response_type
+                   FROM "%s" a
+                   JOIN "%s" h ON h.id = a.checklist_history_id
+                   JOIN fnx_checklist_version_question q
+                        ON q.version_id = h.version_id AND q.position = a.position
+                   WHERE h.id IN %%s'''
+                   % (answer_model._table, self._table),
+                (tuple(history_ids), ),
+                )
+        questions = dict(((r[0], r[1]), (r[2], r[3])) for r in cr.fetchall())
+        answer_ids, response_ids, detail_flags, details = [], [], [], []
+        for key, (response, has_detail, detail) in sorted(submitted.items()):
+            if key not in questions:
+                errors.append('history %d has no question %d' % key)
+                continue
+            answer_id, response_type = questions[key]
+            if isinstance(response, basestring):
+                # ids may be sent as strings too; anything else is a name
+                response = response.strip()
+                try:
+                    response = int(response)
+                except ValueError:
+                    response = response.lower()
+            elif response is not None:
+                try:
+                    response = int(response)
+                except (TypeError, ValueError):
+                    pass
+            response_id = codes.get((response_type, response))
+            if response_id is None:
+                errors.append('history %d, question %d: %r is not a %s response' % (key + (response, response_type)))
+                continue
+            answer_ids.append(answer_id)
+            response_ids.append(response_id)
+            detail_flags.append(has_detail)
+            details.append(detail)
+        if errors:
+            raise ERPError('Invalid Answers', '\n'.join(errors))
+        # apply
+        statistic.add_answers(cr, answer_model, answer_ids, -1)
+        cr.execute(
+                '''UPDATE "%s" a
+                   SET answer_id = v.answer_id,
+                       detail = CASE WHEN v.has_detail THEN v.detail ELSE a.detail END,
+                       write_uid = %%s, write_date = now() AT TIME ZONE 'UTC'
+                   FROM unnest(%%s::int[], %%s::int[], %%s::boolean[], %%s::varchar[])
+                        AS v(id, answer_id, has_detail, detail)
+                   WHERE a.id = v.id'''
+                   % (answer_model._table, ),
+                (uid, answer_ids, response_ids, detail_flags, details),
+                )
+        statistic.add_answers(cr, answer_model, answer_ids, 1)
+        self.update_scores(cr, history_ids)
+        cr.execute(
+                '''UPDATE "%s" h
+                   SET state = CASE WHEN f.open = 0 THEN 'done' ELSE 'active' END,
+                       date_end = CASE WHEN f.open = 0 THEN now() AT TIME ZONE 'UTC' ELSE h.date_end END,
+                       write_uid = %%s, write_date = now() AT TIME ZONE 'UTC'
+                   FROM (
+                       SELECT checklist_history_id AS id, count(*) FILTER (WHERE answer_id IS NULL) AS open
+                       FROM "%s"
+                       WHERE checklist_history_id IN %%s
+                       GROUP BY checklist_history_id
+                       ) f
+                   WHERE h.id = f.id AND h.state IN ('ready', 'active')'''
+                   % (self._table, answer_model._table),
+                (uid, tuple(history_ids)),
+                )
+        cr.execute(
+                'SELECT id, state FROM "%s" WHERE id IN %%s ORDER BY id' % (self._table, ),
+                (tuple(history_ids), ),
+                )
+        return cr.fetchall()
+    #
+    def update_scores(self, cr, ids):
+        "recount the answers of the histories in ids, live or packed, and store the summary"
+        if not ids:
+            return
+        answer_model = self.pool.get('%s.answer' % (self._name, ))
+        results = self.pool.get('fnx.checklist.allowed_response').get_results(cr, SUPERUSER_ID)
+        cr.execute(
+                '''UPDATE "%(history)s" h
+                   SET answered_count = s.answered,
+                       affirmative_count = s.affirmative,
+                       negative_count = s.negative,
+                       not_applicable_count = s.not_applicable,
+                       score = round(100.0 * s.affirmative / NULLIF(s.affirmative + s.negative, 0))
+                   FROM (
+                       SELECT h.id,
+                              count(a.answer_id) AS answered,
+                              count(*) FILTER (WHERE r.result = 'affirmative') AS affirmative,
+                              count(*) FILTER (WHERE r.result = 'negative') AS negative,
+                              count(*) FILTER (WHERE r.result = 'not_applicable') AS not_applicable
+                       FROM "%(history)s" h
+                       LEFT JOIN (
+                           SELECT checklist_history_id AS history_id, answer_id
+                           FROM "%(answer)s"
+                           WHERE checklist_history_id IN %%(ids)s
+                         UNION ALL
+                           SELECT id, NULLIF(u.code, 0)
+                           FROM "%(history)s"
+                           CROSS JOIN LATERAL unnest(packed_answers) AS u(code)
+                           WHERE id IN %%(ids)s AND packed_answers IS NOT NULL
+                           ) a ON a.history_id = h.id
+                       LEFT JOIN unnest(%%(response_ids)s::int[], %%(results)s::varchar[])
+                            AS r(id, result) ON r.id = a.answer_id
+                       WHERE h.id IN %%(ids)s
+                       GROUP BY h.id
+                       ) s
+                   WHERE h.id = s.id'''
+                   % {'history': self._table, 'answer': answer_model._table},
+                {
+                    'ids': tuple(set(ids)),
+                    'response_ids': list(results.keys()),
+                    'results': list(results.values()),
+                    })
+    #
+    def search_text(self, cr, uid, text, domain=None, limit=None, context=None):
+        """
+        return [(history_id, [highlight, ...]), ...] for the newest histories
+        with text in a question or an answer detail
+
+        Each highlight is a "question: detail" html snippet with the matches in
+        <b>.  domain further restricts the histories, and record rules apply;
+        live and packed histories are searched, archived ones are not.
+        """
+        text = (text or '').strip()
+        if not text:
+            return []
+        limit = limit or TEXT_SEARCH_LIMIT
+        answer_model = self.pool.get('%s.answer' % (self._name, ))
+        question_mode = text_search_mode(cr, 'fnx_checklist_version_question')
+        detail_mode = text_search_mode(cr, answer_model._table)
+        question_match, question_text = text_match(question_mode, 'question', text)
+        detail_match, detail_text = text_match(detail_mode, 'detail', text)
+        packed_match, packed_text = text_match(
+                text_search_mode(cr, self._table), 'fnx_checklist_join("%s".packed_details)' % (self._table, ), text,
+                )
+        # each kind of match is found through its own index, newest first, with
+        # domain and the record rules applied before the limit
+        self.check_access_rights(cr, uid, 'read')
+        query = self._where_calc(cr, uid, domain or [], context=context)
+        self._apply_ir_rules(cr, uid, query, 'read', context=context)
+        from_clause, where_clause, where_params = query.get_sql()
+        where_params = list(where_params)
+        # the where clause's own placeholders have to survive the second formatting
+        branch = '''(SELECT "%s".id FROM %s WHERE (%s) AND %%s ORDER BY "%s".id DESC LIMIT %%%%s)''' % (
+                self._table, from_clause.replace('%', '%%'), (where_clause or 'true').replace('%', '%%'), self._table,
+                )
+        cr.execute(
+                '\nUNION\n'.join([
+                    branch % ('''"%s".version_id IN (
+                                   SELECT version_id FROM fnx_checklist_version_question WHERE %s
+                                   )''' % (self._table, question_match), ),
+                    branch % ('''"%s".id IN (
+                                   SELECT checklist_history_id FROM "%s" WHERE %s
+                                   )''' % (self._table, answer_model._table, detail_match), ),
+                    branch % (packed_match, ),
+                    ]) + '\nORDER BY 1 DESC LIMIT %s',
+                where_params + [question_text, limit]
+                    + where_params + [detail_text, limit]
+                    + where_params + [packed_text, limit]
+                    + [limit],
+                )
+        ids = [r[0] for r in cr.fetchall()]
+        if not ids:
+            return []
+        cr.execute(
+                '''SELECT a.history_id, q.question, a.detail
+                   FROM (
+                       SELECT checklist_history_id AS history_id, position, detail
+                       FROM "%(answer)s"
+                       WHERE checklist_history_id IN %%s
+                     UNION ALL
+                       SELECT h.id, u.pos - 1, d.detail
+                       FROM "%(history)s" h
+                       CROSS JOIN LATERAL unnest(h.packed_answers) WITH ORDINALITY AS u(code, pos)
+                       LEFT JOIN LATERAL unnest(h.packed_detail_positions, h.packed_details)
+                            AS d(pos, detail) ON d.pos = u.pos - 1
+                       WHERE h.id IN %%s AND h.packed_answers IS NOT NULL
+                       ) a
+                   JOIN "%(history)s" h ON h.id = a.history_id
+                   JOIN fnx_checklist_version_question q
+                        ON q.version_id = h.version_id AND q.position = a.position
+                   WHERE %(question)s OR %(detail)s
+                   ORDER BY a.history_id, a.position'''
+                   % {
+                       'history': self._table,
+                       'answer': answer_model._table,
+                       'question': text_match(question_mode, 'q.question', text)[0],
+                       'detail': text_match(detail_mode, 'a.detail', text)[0],
+                       },
+                (tuple(ids), tuple(ids), question_text, detail_text),
+                )
+        words = re.compile('|'.join(re.escape(w) for w in text.split()), re.I)
+        highlights = defaultdict(list)
+        for history_id, question, detail in cr.fetchall():
+            snippet = highlight_text(words, question)
+            if detail:
+                snippet = '%s: %s' % (snippet, highlight_text(words, detail))
+            highlights[history_id].append(snippet)
+        return [(id, highlights[id]) for id in ids]
+    #
+    def issue_checklists(self, cr, uid, checklist_ids=None, batch_size=500, context=None):
+        """
+        scheduler entry point: create a fresh history of each checklist for every
+        member of the module's staff group
+
+        checklist_ids defaults to every checklist of this module
+        """
+        checklist_model = self.pool.get(self._name.rsplit('.', 1)[0])
+        if checklist_ids is None:
+            checklist_ids = checklist_model.search(cr, uid, [], context=context)
+        user_ids = self.pool.get('res.users').search(
+                cr, uid, self._columns['user_id']._domain,
+                context=context,
+                )
+        assignments = [(c, u) for c in checklist_ids for u in user_ids]
+        history_ids = []
+        for i in range(0, len(assignments), batch_size):
+            history_ids.extend(self.create_histories(cr, uid, assignments[i:i+batch_size], context=context))
+        _logger.info(
+                '%s: issued %d checklist(s) to %d user(s)',
+                self._name, len(checklist_ids), len(user_ids),
+                )
+        return history_ids
+    #
+    def check_query_plans(self, cr, uid, context=None):
+        """
+        verify the main history, answer and question lookups use their indexes
+
+        Sequential scans are disabled for the check so the result does not
+        depend on how much data the tables hold; raises if any lookup would not
+        use its index.
+        """
+        base_name = self._name.rsplit('.', 1)[0]
+        history = self._table
+        answer = self.pool.get('%s.answer' % (self._name, ))._table
+        question = self.pool.get('%s.question' % (base_name, ))._table
+        checks = [
+            (   # my open checklists
+                index_name(history, 'open_user_idx'),
+                'SELECT id FROM "%s" WHERE user_id = %%s AND state IN (%%s, %%s)' % history,
+                (uid, 'ready', 'active'),
+                ),
+            (   # overdue checklists
+                index_name(history, 'open_date_end_idx'),
+                'SELECT id FROM "%s" WHERE state IN (%%s, %%s) AND date_end < %%s' % history,
+                ('ready', 'active', '2000-01-01'),
+                ),
+            (   # histories of one checklist
+                index_name(history, 'checklist_idx'),
+                'SELECT id FROM "%s" WHERE checklist_id = %%s ORDER BY date_end' % history,
+                (1, ),
+                ),
+            (   # answers of some histories
+                index_name(answer, 'history_idx'),
+                'SELECT id FROM "%s" WHERE checklist_history_id IN %%s' % answer,
+                ((1, 2, 3), ),
+                ),
+            (   # questions of some checklists
+                index_name(question, 'checklist_idx'),
+                'SELECT id FROM "%s" WHERE checklist_id IN %%s' % question,
+                ((1, 2, 3), ),
+                ),
+            ]
+        failed = []
+        cr.execute('SAVEPOINT check_query_plans')
+        try:
+            cr.execute('SET LOCAL enable_seqscan = off')
+            for index, query, params in checks:
+                cr.execute('EXPLAIN ' + query, params)
+                plan = '\n'.join(r[0] for r in cr.fetchall())
+                if index not in plan:
+                    failed.append('%s\n%s' % (query, plan))
+        finally:
+            cr.execute('ROLLBACK TO SAVEPOINT check_query_plans')
+        if failed:
+            raise ERPError('Missing Index', '\n\n'.join(failed))
+        return True
+    #
+    # done histories can have their answers packed into the history row itself:
+    #
+    #   packed_answer_ids        answer id per question position...
+    #   packed_answers           ...its allowed_response id, 0 if unanswered
+    #   packed_detail_positions  positions that have a detail...
+    #   packed_details           ...and the details themselves
+    #
+    # packed answers keep their ids and can still be read (see
+    # question_history.read); changing the checklist or answers, or moving the
+    # history out of done restores the answer rows; the report and statistics
+    # read the packed columns directly; the questions themselves come from the
+    # history's checklist version
+    #
+    def pack_histories(self, cr, uid, ids=None, context=None):
+        """
+        move the answers of done histories into the packed columns
+
+        ids defaults to every done history; also usable as a scheduled action,
+        which runs as the administrator, the only user allowed to pack.  The
+        packed arrays are indexed by answer position, so histories whose
+        positions do not run 0, 1, 2, ... without gaps, repeats or NULLs are
+        left unpacked.
+        """
+        if uid != SUPERUSER_ID:
+            raise ERPError('Access Denied', 'only the administrator can pack histories')
+        answer_model = self.pool.get('%s.answer' % (self._name, ))
+        where = ''
+        params = ()
+        if ids is not None:
+            if not ids:
+                return True
+            where = 'AND h.id IN %s'
+            params = (tuple(ids), )
+        cr.execute(
+                '''WITH contiguous AS (
+                       SELECT a.checklist_history_id AS history_id
+                       FROM "%(answer)s" a
+                       JOIN "%(history)s" h ON h.id = a.checklist_history_id
+                       WHERE h.state = 'done' AND h.packed_answers IS NULL %(where)s
+                       GROUP BY a.checklist_history_id
+                       HAVING count(a.position) = count(*)
+                          AND count(DISTINCT a.position) = count(*)
+                          AND min(a.position) = 0
+                          AND max(a.position) = count(*) - 1
+                       ),
+                   packed AS (
+                       SELECT a.checklist_history_id AS history_id,
+                              array_agg(a.id ORDER BY a.position) AS ids,
+                              array_agg(COALESCE(a.answer_id, 0)::smallint ORDER BY a.position) AS codes,
+                              array_agg(a.position::smallint ORDER BY a.position)
+                                  FILTER (WHERE a.detail <> '') AS detail_positions,
+                              array_agg(a.detail ORDER BY a.position) FILTER (WHERE a.detail <> '') AS details
+                       FROM "%(answer)s" a
+                       JOIN contiguous c ON c.history_id = a.checklist_history_id
+                       GROUP BY a.checklist_history_id
+                       ),
+                   updated AS (
+                       UPDATE "%(history)s" h
+                       SET packed_answer_ids = p.ids,
+                           packed_answers = p.codes,
+                           packed_detail_positions = COALESCE(p.detail_positions, '{}'),
+                           packed_details = COALESCE(p.details, '{}'),
+                           write_date = now() AT TIME ZONE 'UTC'
+                       FROM packed p
+                       WHERE h.id = p.history_id
+                       RETURNING h.id
+                       )
+                   DELETE FROM "%(answer)s"
+                   WHERE checklist_history_id IN (SELECT id FROM updated)
+                   RETURNING id'''
+                   % {'answer': answer_model._table, 'history': self._table, 'where': where},
+                params,
+                )
+        # the rows are gone from the answer table, sync() sends the packed columns instead
+        packed_ids = [r[0] for r in cr.fetchall()]
+        self.pool.get('fnx.checklist.tombstone').add(cr, answer_model._name, packed_ids)
+        _logger.info('%s: %d answers packed', self._name, len(packed_ids))
+        # whatever answers are left belong to histories that were skipped
+        cr.execute(
+                '''SELECT count(DISTINCT a.checklist_history_id)
+                   FROM "%s" a
+                   JOIN "%s" h ON h.id = a.checklist_history_id
+                   WHERE h.state = 'done' AND h.packed_answers IS NULL %s'''
+                   % (answer_model._table, self._table, where),
+                params,
+                )
+        skipped = cr.fetchone()[0]
+        if skipped:
+            _logger.warning(
+                    '%s: %d histories left unpacked, their answer positions are not contiguous',
+                    self._name, skipped,
+                    )
+        return True
+    #
+    def unpack_histories(self, cr, uid, ids, context=None):
+        "restore the answer rows of any packed histories in ids"
+        if not ids:
+            return True
+        answer_model = self.pool.get('%s.answer' % (self._name, ))
+        cr.execute(
+                '''INSERT INTO "%s"
+                       (
+                         id, checklist_history_id, position, answer_id, detail,
+                         create_uid, create_date, write_uid, write_date
+                         )
+                   SELECT COALESCE(h.packed_answer_ids[u.pos], nextval('%s_id_seq')),
+                          h.id, u.pos - 1, NULLIF(u.code, 0), d.detail,
+                          %%s, now() AT TIME ZONE 'UTC', %%s, now() AT TIME ZONE 'UTC'
+                   FROM "%s" h
+                   CROSS JOIN LATERAL unnest(h.packed_answers) WITH ORDINALITY AS u(code, pos)
+                   LEFT JOIN LATERAL unnest(h.packed_detail_positions, h.packed_details)
+                        AS d(pos, detail) ON d.pos = u.pos - 1
+                   WHERE h.id IN %%s AND h.packed_answers IS NOT NULL
+                   ORDER BY h.id, u.pos
+                   RETURNING id'''
+                   % (answer_model._table, answer_model._table, self._table),
+                (uid, uid, tuple(ids)),
+                )
+        restored_ids = [r[0] for r in cr.fetchall()]
+        if restored_ids:
+            # the answers are back under their old ids, so they were never deleted
+            self.pool.get('fnx.checklist.tombstone').remove(cr, answer_model._name, restored_ids)
+            cr.execute(
+                    '''UPDATE "%s"
+                       SET packed_answer_ids = NULL, packed_answers = NULL,
+                           packed_detail_positions = NULL, packed_details = NULL,
+                           write_date = now() AT TIME ZONE 'UTC'
+                       WHERE id IN %%s AND packed_answers IS NOT NULL'''
+                       % (self._table, ),
+                    (tuple(ids), ),
+                    )
+        return True
+    #
+    # old done histories are moved out of the hot tables into <table>_archive,
+    # which is partitioned by month of _archive_date (falling back to the
+    # creation date); each archived history is a single row holding its header
+    # and a zlib-compressed payload of its packed answers.  Archived histories
+    # are read-only, found with search_archive(), and can still be printed.
+    #
+    _archive_date = 'date_end'
+    _archive_columns = ('id', 'name', 'checklist_id', 'version_id', 'user_id', 'date_end', 'create_date')
+    #
+    def _archive_date_sql(self, alias):
+        return 'COALESCE(%s."%s", %s.create_date)' % (alias, self._archive_date, alias)
+    #
+    def _archive_rule_sql(self, cr, uid, alias, context=None):
+        """
+        return (sql, params) keeping the archive rows (as alias) uid may read
+
+        The history record rules are applied to the archive when they only use
+        its columns; otherwise only uid's own histories are readable.
+        """
+        clauses, params, tables = self.pool.get('ir.rule').domain_get(cr, uid, self._name, 'read', context=context)
+        if not clauses:
+            return 'true', []
+        sql = ' AND '.join(clauses)
+        table = '"%s"' % (self._table, )
+        columns = set(re.findall(r'%s\."(\w+)"' % (re.escape(table), ), sql))
+        if (
+                tables == [table]
+                and sql.count(table) == sql.count(table + '.')
+                and columns <= set(self._archive_columns)
+            ):
+            return sql.replace(table + '.', alias + '.'), list(params)
+        return '%s.user_id = %%s' % (alias, ), [uid]
+    #
+    def archive_histories(self, cr, uid, months=None, context=None):
+        """
+        move done histories older than months (default ARCHIVE_AGE_MONTHS) to the archive
+
+        also usable as a scheduled action, which runs as the administrator, the
+        only user allowed to archive
+        """
+        if uid != SUPERUSER_ID:
+            raise ERPError('Access Denied', 'only the administrator can archive histories')
+        if months is None:
+            months = ARCHIVE_AGE_MONTHS
+        cr.execute(
+                '''SELECT h.id
+                   FROM "%s" h
+                   WHERE h.state = 'done'
+                     AND %s < date_trunc('month', now() AT TIME ZONE 'UTC') - %%s * interval '1 month'
+                   ORDER BY h.id'''
+                   % (self._table, self._archive_date_sql('h')),
+                (months, ),
+                )
+        ids = [r[0] for r in cr.fetchall()]
+        answer_model = self.pool.get('%s.answer' % (self._name, ))
+        archived = 0
+        for start in range(0, len(ids), ARCHIVE_BATCH_SIZE):
+            batch = tuple(ids[start:start+ARCHIVE_BATCH_SIZE])
+            self.pack_histories(cr, uid, list(batch), context=context)
+            # histories pack_histories skipped still have their answer rows,
+            # which would go with them; they stay until fixed
+            cr.execute(
+                    '''SELECT h.id, date_trunc('month', %s)::date, h.name, h.checklist_id, h.version_id,
+                              h.user_id, h.date_end, h.create_date,
+                              h.packed_answers, h.packed_detail_positions, h.packed_details
+                       FROM "%s" h
+                       WHERE h.id IN %%s
+                         AND NOT EXISTS (SELECT 1 FROM "%s" a WHERE a.checklist_history_id = h.id)'''
+                       % (self._archive_date_sql('h'), self._table, answer_model._table),
+                    (batch, ),
+                    )
+            rows = cr.fetchall()
+            if not rows:
+                continue
+            batch = tuple(r[0] for r in rows)
+            archived += len(batch)
+            add_archive_partitions(self, cr, set(r[1] for r in rows))
+            payloads = [
+                    psycopg2.Binary(zlib.compress(json.dumps([codes or [], positions or [], details or []])))
+                    for codes, positions, details in (r[8:] for r in rows)
+                    ]
+            cr.execute(
+                    '''INSERT INTO "%s_archive"
+                           (id, period, name, checklist_id, version_id, user_id, date_end, create_date, payload)
+                       SELECT *
+                       FROM unnest(
+                           %%s::int[], %%s::date[], %%s::varchar[], %%s::int[], %%s::int[], %%s::int[],
+                           %%s::timestamp[], %%s::timestamp[], %%s::bytea[]
+                           )'''
+                       % (self._table, ),
+                    [[r[i] for r in rows] for i in range(8)] + [payloads],
+                    )
+            # answers went with packing; the statistics keep counting them
+            cr.execute('DELETE FROM "%s" WHERE id IN %%s' % (self._table, ), (batch, ))
+            self.pool.get('fnx.checklist.tombstone').add(cr, self._name, batch)
+        _logger.info('%s: %d histories archived', self._name, archived)
+        return True
+    #
+    def search_archive(
+            self, cr, uid,
+            checklist_id=None, user_id=None, date_from=None, date_to=None, name=None,
+            limit=None, context=None,
+        ):
+        """
+        return the ids of archived histories matching all the given criteria
+
+        date_from and date_to bound the archive date (see _archive_date), which
+        also limits the monthly partitions read.
+        """
+        self.check_access_rights(cr, uid, 'read')
+        where = []
+        params = []
+        if checklist_id:
+            where.append('a.checklist_id = %s')
+            params.append(checklist_id)
+        if user_id:
+            where.append('a.user_id = %s')
+            params.append(user_id)
+        if date_from:
+            where.append("a.period >= date_trunc('month', %%s::timestamp) AND %s >= %%s" % (self._archive_date_sql('a'), ))
+            params.extend([date_from, date_from])
+        if date_to:
+            where.append('a.period <= %%s::timestamp AND %s <= %%s' % (self._archive_date_sql('a'), ))
+            params.extend([date_to, date_to])
+        if name:
+            where.append('a.name ILIKE %s')
+            params.append('%%%s%%' % (name, ))
+        rule_sql, rule_params = self._archive_rule_sql(cr, uid, 'a', context=context)
+        where.append(rule_sql)
+        params.extend(rule_params)
+        query = 'SELECT a.id FROM "%s_archive" a' % (self._table, )
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY a.period DESC, a.id DESC'
+        if limit:
+            query += ' LIMIT %d' % (limit, )
+        cr.execute(query, params)
+        return [r[0] for r in cr.fetchall()]
+    #
+    def read_archive(self, cr, uid, ids, context=None):
+        """
+        return the archived histories in ids
+
+        as [(id, name, checklist_id, version_id, user_id, date_end, create_date,
+             packed_answers, packed_detail_positions, packed_details), ...]
+        """
+        self.check_access_rights(cr, uid, 'read')
+        if not ids:
+            return []
+        rule_sql, rule_params = self._archive_rule_sql(cr, uid, 'a', context=context)
+        cr.execute(
+                '''SELECT id, name, checklist_id, version_id, user_id, date_end, create_date, payload,
+                          %s
+                   FROM "%s_archive" a
+                   WHERE id IN %%s'''
+                   % (rule_sql, self._table),
+                rule_params + [tuple(ids)],
+                )
+        rows = cr.fetchall()
+        denied = [r[0] for r in rows if not r[8]]
+        if denied:
+            raise ERPError(
+                    'Access Denied',
+                    'archived %s records %s may not be read' % (self._description, ', '.join(str(id) for id in denied)),
+                    )
+        return [
+                r[:7] + tuple(json.loads(zlib.decompress(r[7])))
+                for r in rows
+                ]
+    #
+    def iter_answers(self, cr, uid, date_from=None, date_to=None, chunk_size=None, context=None):
+        """
+        yield lists of up to chunk_size answers of the histories whose archive
+        date (see _archive_date) falls between date_from and date_to
+
+        Each answer is a tuple of EXPORT_FIELDS.  Live and packed answers are
+        read through a server-side cursor, archived ones ARCHIVE_BATCH_SIZE
+        histories at a time, so memory use does not grow with the range.  Only
+        histories uid may read are included, archived ones as well (see
+        _archive_rule_sql).
+        """
+        chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+        answer_model = self.pool.get('%s.answer' % (self._name, ))
+        checklist_model = self.pool.get(self._columns['checklist_id']._obj)
+        self.check_access_rights(cr, uid, 'read')
+        answer_model.check_access_rights(cr, uid, 'read')
+        where = []
+        params = []
+        if date_from:
+            where.append('%s >= %%s' % (self._archive_date_sql('h'), ))
+            params.append(date_from)
+        if date_to:
+            where.append('%s <= %%s' % (self._archive_date_sql('h'), ))
+            params.append(date_to)
+        rule_clause, rule_params, rule_tables = self.pool.get('ir.rule').domain_get(cr, uid, self._name, 'read', context=context)
+        if rule_clause:
+            where.append('h.id IN (SELECT "%s".id FROM %s WHERE %s)' % (
+                    self._table, ', '.join(rule_tables), ' AND '.join(rule_clause),
+                    ))
+            params.extend(rule_params)
+        query = '''
+            WITH h AS (
+                SELECT h.* FROM "%(history)s" h %(where)s
+                ),
+            a AS (
+                SELECT a.checklist_history_id AS history_id, a.position, a.answer_id, a.detail
+                FROM "%(answer)s" a
+                JOIN h ON h.id = a.checklist_history_id
+              UNION ALL
+                SELECT h.id, u.pos - 1, NULLIF(u.code, 0), d.detail
+                FROM h
+                CROSS JOIN LATERAL unnest(h.packed_answers) WITH ORDINALITY AS u(code, pos)
+                LEFT JOIN LATERAL unnest(h.packed_detail_positions, h.packed_details)
+                     AS d(pos, detail) ON d.pos = u.pos - 1
+                WHERE h.packed_answers IS NOT NULL
+                )
+            SELECT h.id, h.name, c.name, p.name, h.date_end,
+                   a.position, q.question, q.response_type, r.name, a.detail
+            FROM h
+            JOIN a ON a.history_id = h.id
+            LEFT JOIN "%(checklist)s" c ON c.id = h.checklist_id
+            LEFT JOIN res_users usr ON usr.id = h.user_id
+            LEFT JOIN res_partner p ON p.id = usr.partner_id
+            LEFT JOIN fnx_checklist_version_question q ON q.version_id = h.version_id AND q.position = a.position
+            LEFT JOIN fnx_checklist_allowed_response r ON r.id = a.answer_id
+            ORDER BY h.id, a.position''' % {
+                'history': self._table,
+                'answer': answer_model._table,
+                'checklist': checklist_model._table,
+                'where': where and 'WHERE ' + ' AND '.join(where) or '',
+                }
+        rows = cr._cnx.cursor('%s_export' % (self._table, ))
+        try:
+            rows.itersize = chunk_size
+            rows.execute(query, params)
+            while True:
+                chunk = rows.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            rows.close()
+        # archived answers have to be decompressed first; search_archive keeps
+        # to the archived histories the record rules let uid read
+        archived_ids = self.search_archive(cr, uid, date_from=date_from, date_to=date_to, context=context)
+        archived_ids.sort()
+        responses = self.pool.get('fnx.checklist.allowed_response').get_responses(cr, SUPERUSER_ID)
+        response_names = dict((r.id, r.name) for resps in responses.values() for r in resps)
+        chunk = []
+        for start in range(0, len(archived_ids), ARCHIVE_BATCH_SIZE):
+            histories = self.read_archive(cr, uid, archived_ids[start:start+ARCHIVE_BATCH_SIZE], context=context)
+            checklist_ids = list(set(h[2] for h in histories if h[2]))
+            checklist_names = dict(
+                    (c['id'], c['name'])
+                    for c in checklist_model.read(cr, SUPERUSER_ID, checklist_ids, ['name'], context=context)
+                    )
+            user_names = dict(self.pool.get('res.users').name_get(
+                    cr, SUPERUSER_ID, list(set(h[4] for h in histories if h[4])), context=context,
+                    ))
+            questions = self.pool.get('fnx.checklist.version').get_questions(
+                    cr, SUPERUSER_ID, list(set(h[3] for h in histories if h[3])),
+                    )
+            for id, name, checklist_id, version_id, user_id, date_end, _, codes, detail_positions, details in histories:
+                version = questions.get(version_id, ())
+                details = dict(zip(detail_positions or (), details or ()))
+                for position, code in enumerate(codes):
+                    question = position < len(version) and version[position] or None
+                    chunk.append((
+                            id, name, checklist_names.get(checklist_id), user_names.get(user_id), date_end,
+                            position,
+                            question and question.question, question and question.response_type,
+                            response_names.get(code), details.get(position),
+                            ))
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+    #
+    def export_answers(self, cr, uid, date_from=None, date_to=None, format='csv', path=None, context=None):
+        """
+        write the answers of iter_answers() to a gzipped file, a chunk at a time
+
+        format is 'csv' (a header row of EXPORT_FIELDS, then one row per answer)
+        or 'columnar' (one json object of {field: [values]} per line and chunk).
+        The file is written to path (superuser only), or else attached to no
+        record as an ir.attachment; returns the path or the attachment id.
+        """
+        if format not in ('csv', 'columnar'):
+            raise ERPError('Invalid Format', 'export format must be csv or columnar, not %r' % (format, ))
+        if path and uid != SUPERUSER_ID:
+            raise ERPError('Access Denied', 'only the administrator can export to a server file')
+        if path:
+            output = open(path, 'wb')
+        else:
+            output = SpooledTemporaryFile(max_size=STREAM_SPOOL_SIZE)
+        try:
+            archive = gzip.GzipFile(fileobj=output, mode='wb')
+            if format == 'csv':
+                writer = csv.writer(archive)
+                writer.writerow(EXPORT_FIELDS)
+            count = 0
+            for chunk in self.iter_answers(cr, uid, date_from, date_to, context=context):
+                chunk = [[export_value(v) for v in row] for row in chunk]
+                if format == 'csv':
+                    writer.writerows(chunk)
+                else:
+                    archive.write(json.dumps(dict(zip(EXPORT_FIELDS, zip(*chunk)))))
+                    archive.write('\n')
+                count += len(chunk)
+            archive.close()
+            _logger.info('%s: %d answers exported', self._name, count)
+            if path:
+                return path
+            filename = 'answers-%s-%s.%s.gz' % (
+                    (date_from or 'start')[:10], (date_to or 'now')[:10],
+                    format == 'csv' and 'csv' or 'jsonl',
+                    )
+            return attach_file(self.pool, cr, uid, {
+                    'name': filename,
+                    'datas_fname': filename,
+                    'res_model': self._name,
+                    }, output, context=context)
+        finally:
+            output.close()
 
 
 class question_history(Normalize, osv.AbstractModel):
@@ -169,6 +1949,7 @@ class question_history(Normalize, osv.AbstractModel):
     _name = "fnx.checklist.history.answer"
     _description = "answer"
     _rec_name = 'question'
+    _order = 'position, id'
     #
     def __init__(self, pool, cr):
         super(question_history, self).__init__(pool, cr)
@@ -178,18 +1959,242 @@ class question_history(Normalize, osv.AbstractModel):
     def _auto_init(self, cr, context=None):
         res = super(question_history, self)._auto_init(cr, context=context)
         # one-time creation of structures
-        add_permissions(self, cr, context)
+        queue_bootstrap(self, cr)
+        add_indexes(self, cr, [
+                ('history_idx', '(checklist_history_id, id)'),
+                ('write_date_idx', '(write_date)'),
+                ])
+        add_text_indexes(self, cr, [
+                ('detail', 'detail'),
+                ])
+        return res
+    #
+    def _auto_end(self, cr, context=None):
+        res = super(question_history, self)._auto_end(cr, context=context)
+        run_bootstrap(cr, context)
+        return res
+    #
+    # the compliance statistics and history answer summaries are kept current
+    # in the same transaction; for answers saved with their history the
+    # history does it instead (checklist_statistics_deferred when it changes
+    # checklist, checklist_scores_deferred always)
+    #
+    def create(self, cr, uid, values, context=None):
+        context = context or {}
+        id = super(question_history, self).create(cr, uid, values, context=context)
+        if values.get('answer_id'):
+            if not context.get('checklist_statistics_deferred'):
+                self.pool.get('fnx.checklist.statistic').add_answers(cr, self, [id], 1)
+            if values.get('checklist_history_id') and not context.get('checklist_scores_deferred'):
+                self._history_model().update_scores(cr, [values['checklist_history_id']])
+        return id
+    #
+    def write(self, cr, uid, ids, values, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        context = context or {}
+        self._unpack(cr, uid, ids, context=context)
+        statistic = self.pool.get('fnx.checklist.statistic')
+        counted = set(values) & set(statistic._answer_fields)
+        deferred = context.get('checklist_statistics_deferred')
+        if counted:
+            if not deferred:
+                statistic.add_answers(cr, self, ids, -1)
+            history_ids = self._get_history_ids(cr, ids)
+        res = super(question_history, self).write(cr, uid, ids, values, context=context)
+        if counted:
+            if not deferred:
+                statistic.add_answers(cr, self, ids, 1)
+            if values.get('checklist_history_id'):
+                history_ids.append(values['checklist_history_id'])
+            if not context.get('checklist_scores_deferred'):
+                self._history_model().update_scores(cr, history_ids)
+        return res
+    #
+    def unlink(self, cr, uid, ids, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        context = context or {}
+        self._unpack(cr, uid, ids, context=context)
+        if not context.get('checklist_statistics_deferred'):
+            self.pool.get('fnx.checklist.statistic').add_answers(cr, self, ids, -1)
+        history_ids = self._get_history_ids(cr, ids)
+        res = super(question_history, self).unlink(cr, uid, ids, context=context)
+        if not context.get('checklist_scores_deferred'):
+            self._history_model().update_scores(cr, history_ids)
+        self.pool.get('fnx.checklist.tombstone').add(cr, self._name, ids)
+        return res
+    #
+    def _history_model(self):
+        return self.pool.get(self._columns['checklist_history_id']._obj)
+    #
+    # answers of packed histories (see checklist_history.pack_histories) are
+    # not in the table; they are read from their history's packed columns, and
+    # restored before being changed
+    #
+    def _get_packed(self, cr, ids):
+        "return {id: (history_id, position, answer_id, detail, version_id)} for the packed answers in ids"
+        if not ids:
+            return {}
+        cr.execute('SELECT id FROM "%s" WHERE id IN %%s' % (self._table, ), (tuple(ids), ))
+        missing = list(set(ids) - set(r[0] for r in cr.fetchall()))
+        if not missing:
+            return {}
+        cr.execute(
+                '''SELECT u.id, h.id, u.pos - 1, NULLIF(h.packed_answers[u.pos], 0),
+                          d.detail, h.version_id
+                   FROM "%s" h
+                   CROSS JOIN LATERAL unnest(h.packed_answer_ids) WITH ORDINALITY AS u(id, pos)
+                   LEFT JOIN LATERAL unnest(h.packed_detail_positions, h.packed_details)
+                        AS d(pos, detail) ON d.pos = u.pos - 1
+                   WHERE h.packed_answer_ids && %%s::int[] AND u.id = ANY(%%s)'''
+                   % (self._history_model()._table, ),
+                (missing, missing),
+                )
+        return dict((r[0], r[1:]) for r in cr.fetchall())
+    #
+    def _unpack(self, cr, uid, ids, context=None):
+        "restore the answer rows of the packed answers in ids"
+        packed = self._get_packed(cr, ids)
+        if packed:
+            history_ids = list(set(p[0] for p in packed.values()))
+            self._history_model().unpack_histories(cr, uid, history_ids, context=context)
+    #
+    def read(self, cr, uid, ids, fields=None, context=None, load='_classic_read'):
+        single = isinstance(ids, (int, long))
+        if single:
+            ids = [ids]
+        packed = self._get_packed(cr, ids)
+        live = [id for id in ids if id not in packed]
+        res = []
+        if live:
+            res = super(question_history, self).read(cr, uid, live, fields=fields, context=context, load=load)
+        if packed:
+            res.extend(self._read_packed(cr, uid, packed, fields, context=context, load=load))
+            order = dict((id, i) for i, id in enumerate(ids))
+            res.sort(key=lambda r: order[r['id']])
+        if single:
+            return res and res[0] or False
+        return res
+    #
+    def _read_packed(self, cr, uid, packed, fields=None, context=None, load='_classic_read'):
+        "return the packed answers as read() would"
+        history_model = self._history_model()
+        self.check_access_rights(cr, uid, 'read')
+        history_ids = list(set(p[0] for p in packed.values()))
+        history_model.check_access_rule(cr, uid, history_ids, 'read', context=context)
+        questions = {}
+        cr.execute(
+                '''SELECT version_id, position, question, response_type
+                   FROM fnx_checklist_version_question
+                   WHERE version_id IN %s''',
+                (tuple(set(p[4] for p in packed.values() if p[4])) or (None, ), ),
+                )
+        for version_id, position, text, response_type in cr.fetchall():
+            questions[version_id, position] = text, response_type
+        history_names = {}
+        response_names = {}
+        if load == '_classic_read':
+            history_names = dict(history_model.name_get(cr, uid, history_ids, context=context))
+            response_ids = list(set(p[2] for p in packed.values() if p[2]))
+            response_model = self.pool.get('fnx.checklist.allowed_response')
+            response_names = dict(response_model.name_get(cr, uid, response_ids, context=context))
+        res = []
+        for id, (history_id, position, answer_id, detail, version_id) in packed.items():
+            text, response_type = questions.get((version_id, position), (False, False))
+            values = {
+                    'position': position,
+                    'question': text,
+                    'response_type': response_type,
+                    'checklist_history_id': history_id,
+                    'answer_id': answer_id or False,
+                    'detail': detail or False,
+                    }
+            if load == '_classic_read':
+                values['checklist_history_id'] = (history_id, history_names.get(history_id, ''))
+                values['answer_id'] = answer_id and (answer_id, response_names.get(answer_id, '')) or False
+            record = {'id': id}
+            for field in fields or self._columns:
+                if field != 'id':
+                    record[field] = values.get(field, False)
+            res.append(record)
+        return res
+    #
+    def _get_history_ids(self, cr, ids):
+        if not ids:
+            return []
+        cr.execute(
+                '''SELECT DISTINCT checklist_history_id FROM "%s"
+                   WHERE id IN %%s AND checklist_history_id IS NOT NULL'''
+                % (self._table, ),
+                (tuple(ids), ),
+                )
+        return [r[0] for r in cr.fetchall()]
+    #
+    # question text and response type are kept once per checklist version
+    #
+    def _get_question(self, cr, uid, ids, field_names, arg, context=None):
+        history_model = self.pool.get(self._columns['checklist_history_id']._obj)
+        res = dict((id, {'question': False, 'response_type': False}) for id in ids)
+        if not ids:
+            return res
+        cr.execute(
+                '''SELECT a.id, q.question, q.response_type
+                   FROM "%s" a
+                   JOIN "%s" h ON h.id = a.checklist_history_id
+                   JOIN fnx_checklist_version_question q
+                        ON q.version_id = h.version_id AND q.position = a.position
+                   WHERE a.id IN %%s'''
+                   % (self._table, history_model._table),
+                (tuple(ids), ),
+                )
+        for id, text, response_type in cr.fetchall():
+            res[id] = {'question': text, 'response_type': response_type}
+        return res
+    #
+    def _search_question(self, cr, uid, obj, name, domain, context=None):
+        history_model = self.pool.get(self._columns['checklist_history_id']._obj)
+        res = []
+        for field, op, value in domain:
+            if op not in ('=', '!=', 'like', 'ilike', 'not like', 'not ilike', 'in', 'not in'):
+                raise ERPError('Invalid Search', 'unable to search %s with %r' % (field, op))
+            if op in ('in', 'not in'):
+                value = tuple(value) or (None, )
+            elif op.endswith('like'):
+                value = '%%%s%%' % (value, )
+            cr.execute(
+                    '''SELECT a.id
+                       FROM "%s" a
+                       JOIN "%s" h ON h.id = a.checklist_history_id
+                       JOIN fnx_checklist_version_question q
+                            ON q.version_id = h.version_id AND q.position = a.position
+                       WHERE q."%s" %s %%s'''
+                       % (self._table, history_model._table, field, op),
+                    (value, ),
+                    )
+            res.append(('id', 'in', [r[0] for r in cr.fetchall()]))
         return res
     #
     _columns = {
-        'question': fields.char("Question",size=128, required=True),
+        'position': fields.integer('Position'),
+        'question': fields.function(
+            _get_question,
+            fnct_search=_search_question,
+            type='char',
+            size=128,
+            string="Question",
+            multi='question',
+            ),
         'checklist_history_id': fields.many2one('fnx.checklist.history', 'Checklist'),
         'answer_id': fields.many2one('fnx.checklist.allowed_response', string="Response"),
         'detail': fields.char("Detail",size=128),
-        'response_type': fields.selection(
-            Allowed_Response_Type,
+        'response_type': fields.function(
+            _get_question,
+            fnct_search=_search_question,
+            type='selection',
+            selection=Allowed_Response_Type,
             string='Allowed Responses',
-            required=True,
+            multi='question',
             ),
         }
 
@@ -204,66 +2209,1101 @@ class responses(osv.Model):
         'name': fields.char('Name', size=7),
         'type': fields.char('Type', size=9),
         }
-
-def add_permissions(model, cr, context):
-    "add default permissions if none exist"
-    cr.execute("SELECT id FROM ir_model WHERE model='%s'" % (model._name, ))
-    model_id = cr.fetchone()[0]
-    cr.execute("SELECT id FROM ir_model_access WHERE model_id=%s" % (model_id, ))
-    #
-    if not cr.rowcount:
-        imd_name = 'access_%s_all' % (model._table, )
-        ima_name = '%s_all' % (model._table, )
-        #
-        cr.execute("SELECT nextval('ir_model_access_id_seq')")
-        ima_id = cr.fetchone()[0]
-        cr.execute("""
-                INSERT INTO ir_model_access
-                    (
-                      id, name, model_id, perm_read, perm_write, perm_create, perm_unlink,
-                      create_uid, create_date, write_uid, write_date
-                      )
-                VALUES
+    #
+    # the response vocabulary is tiny and almost never changes, so it is cached
+    # per registry; clear_caches() also bumps the registry signaling sequence so
+    # other workers drop their copy at the start of their next request
+    #
+    def create(self, cr, uid, values, context=None):
+        res = super(responses, self).create(cr, uid, values, context=context)
+        self.clear_caches()
+        return res
+    #
+    def write(self, cr, uid, ids, values, context=None):
+        res = super(responses, self).write(cr, uid, ids, values, context=context)
+        self.clear_caches()
+        return res
+    #
+    def unlink(self, cr, uid, ids, context=None):
+        res = super(responses, self).unlink(cr, uid, ids, context=context)
+        self.clear_caches()
+        return res
+    #
+    def clear_caches(self):
+        super(responses, self).clear_caches()
+        # the base only signals when this process had filled the cache itself
+        self.pool._any_cache_cleared = True
+    #
+    @ormcache(skiparg=3)
+    def get_responses(self, cr, uid):
+        """
+        return {type: (Response(id, name), ...)}
+
+        responses are ordered affirmative, negative, not applicable; the result
+        is shared by every caller and must not be modified
+        """
+        cr.execute('SELECT id, name, type FROM "%s" ORDER BY id' % (self._table, ))
+        grouped = defaultdict(list)
+        for id, name, type in cr.fetchall():
+            grouped[type].append(Response(id, name))
+        return dict((type, tuple(resps)) for type, resps in grouped.items())
+    #
+    def get_results(self, cr, uid):
+        "return {response_id: Response_Result name}"
+        results = {}
+        for resps in self.get_responses(cr, uid).values():
+            for resp, result in zip(resps, Response_Result):
+                results[resp.id] = result.name
+        return results
+    #
+    def name_get(self, cr, uid, ids, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        names = {}
+        for resps in self.get_responses(cr, SUPERUSER_ID).values():
+            for resp in resps:
+                names[resp.id] = resp.name
+        missing = [id for id in ids if id not in names]
+        if missing:
+            names.update(super(responses, self).name_get(cr, uid, missing, context=context))
+        return [(id, names[id]) for id in ids if id in names]
+
+class statistic(osv.Model):
+    """
+    answer counts per checklist, question, result and week
+
+    Maintained by the answer models as answers are created, changed and
+    deleted; rebuild() recomputes everything from the answer tables.
+    """
+    _name = 'fnx.checklist.statistic'
+    _description = 'compliance statistic'
+    _order = 'period desc, model, checklist_id, question'
+    _rec_name = 'question'
+    #
+    _answer_fields = ('position', 'answer_id', 'checklist_history_id')
+    #
+    _columns = {
+        'model': fields.char('Checklist Model', size=64, required=True, readonly=True),
+        'checklist_id': fields.integer('Checklist', required=True, readonly=True),
+        'question': fields.char('Question', size=128, required=True, readonly=True),
+        'response_type': fields.selection(
+            Allowed_Response_Type,
+            string='Allowed Responses',
+            required=True,
+            readonly=True,
+            ),
+        'result': fields.selection(Response_Result, 'Result', required=True, readonly=True),
+        'period': fields.date('Week of', required=True, readonly=True),
+        'answer_count': fields.integer('Answers', readonly=True, group_operator='sum'),
+        }
+    #
+    def _auto_init(self, cr, context=None):
+        res = super(statistic, self)._auto_init(cr, context=context)
+        add_indexes(self, cr, [
+                ('period_idx', '(period, model, checklist_id)'),
+                ])
+        return res
+    #
+    _sql_constraints = [
+        ('statistic_uniq',
+         'unique(model, checklist_id, question, response_type, result, period)',
+         'duplicate statistic',
+         ),
+        ]
+    #
+    def add_answers(self, cr, answer_model, answer_ids, sign):
+        """
+        add (sign=1) or subtract (sign=-1) the answers in answer_ids
+
+        Only answered questions of histories with a checklist are counted; the
+        period is the week the history was created.
+        """
+        if not answer_ids:
+            return
+        history_model = self.pool.get(answer_model._columns['checklist_history_id']._obj)
+        results = self.pool.get('fnx.checklist.allowed_response').get_results(cr, SUPERUSER_ID)
+        cr.execute(
+                '''INSERT INTO "%s"
+                       (model, checklist_id, question, response_type, result, period, answer_count)
+                   SELECT %%s, h.checklist_id, q.question, q.response_type, r.result,
+                          date_trunc('week', h.create_date)::date, %%s * count(*)
+                   FROM "%s" a
+                   JOIN "%s" h ON h.id = a.checklist_history_id
+                   JOIN fnx_checklist_version_question q
+                        ON q.version_id = h.version_id AND q.position = a.position
+                   JOIN unnest(%%s::int[], %%s::varchar[]) AS r(id, result) ON r.id = a.answer_id
+                   WHERE a.id IN %%s AND h.checklist_id IS NOT NULL
+                   GROUP BY 2, 3, 4, 5, 6
+                   ON CONFLICT (model, checklist_id, question, response_type, result, period)
+                   DO UPDATE SET answer_count = "%s".answer_count + EXCLUDED.answer_count'''
+                   % (self._table, answer_model._table, history_model._table, self._table),
+                (
+                    history_model._columns['checklist_id']._obj, sign,
+                    list(results.keys()), list(results.values()),
+                    tuple(answer_ids),
+                    ))
+    #
+    def rebuild(self, cr, uid, context=None):
+        "recompute all statistics from the answer tables; administrator only"
+        if uid != SUPERUSER_ID:
+            raise ERPError('Access Denied', 'only the administrator can rebuild the statistics')
+        results = self.pool.get('fnx.checklist.allowed_response').get_results(cr, SUPERUSER_ID)
+        cr.execute('DELETE FROM "%s"' % (self._table, ))
+        for answer_model in concrete_models(self.pool, question_history):
+            history_model = self.pool.get(answer_model._columns['checklist_history_id']._obj)
+            cr.execute(
+                    '''INSERT INTO "%s"
+                           (model, checklist_id, question, response_type, result, period, answer_count)
+                       SELECT %%s, a.checklist_id, q.question, q.response_type, r.result,
+                              date_trunc('week', a.create_date)::date, count(*)
+                       FROM (
+                           SELECT h.checklist_id, h.create_date, h.version_id, a.position, a.answer_id
+                           FROM "%s" a
+                           JOIN "%s" h ON h.id = a.checklist_history_id
+                         UNION ALL
+                           SELECT h.checklist_id, h.create_date, h.version_id, u.pos - 1, u.answer_id
+                           FROM "%s" h
+                           CROSS JOIN LATERAL unnest(h.packed_answers) WITH ORDINALITY AS u(answer_id, pos)
+                           WHERE h.packed_answers IS NOT NULL
+                           ) a
+                       JOIN fnx_checklist_version_question q
+                            ON q.version_id = a.version_id AND q.position = a.position
+                       JOIN unnest(%%s::int[], %%s::varchar[]) AS r(id, result) ON r.id = a.answer_id
+                       WHERE a.checklist_id IS NOT NULL
+                       GROUP BY 2, 3, 4, 5, 6'''
+                       % (self._table, answer_model._table, history_model._table, history_model._table),
                     (
-                      %s, '%s', %s, true, true, true, true,
-                      1, now() AT TIME ZONE 'UTC', 1, now() AT TIME ZONE 'UTC'
-                      )
-                    """
-                    % (ima_id, ima_name, model_id)
+                        history_model._columns['checklist_id']._obj,
+                        list(results.keys()), list(results.values()),
+                        ))
+            _logger.info('%s: %d statistics rebuilt', answer_model._name, cr.rowcount)
+            # archived answers are only readable after decompressing them
+            cr.execute('SELECT id FROM "%s_archive"' % (history_model._table, ))
+            archived_ids = [r[0] for r in cr.fetchall()]
+            for start in range(0, len(archived_ids), ARCHIVE_BATCH_SIZE):
+                rows = history_model.read_archive(cr, uid, archived_ids[start:start+ARCHIVE_BATCH_SIZE])
+                answers = [
+                        (checklist_id, create_date, version_id, position, code)
+                        for _, _, checklist_id, version_id, _, _, create_date, codes, _, _ in rows
+                        for position, code in enumerate(codes)
+                        if checklist_id and code
+                        ]
+                if not answers:
+                    continue
+                cr.execute(
+                        '''INSERT INTO "%s"
+                               (model, checklist_id, question, response_type, result, period, answer_count)
+                           SELECT %%s, a.checklist_id, q.question, q.response_type, r.result,
+                                  date_trunc('week', a.create_date)::date, count(*)
+                           FROM unnest(%%s::int[], %%s::timestamp[], %%s::int[], %%s::int[], %%s::int[])
+                                AS a(checklist_id, create_date, version_id, position, answer_id)
+                           JOIN fnx_checklist_version_question q
+                                ON q.version_id = a.version_id AND q.position = a.position
+                           JOIN unnest(%%s::int[], %%s::varchar[]) AS r(id, result) ON r.id = a.answer_id
+                           GROUP BY 2, 3, 4, 5, 6
+                           ON CONFLICT (model, checklist_id, question, response_type, result, period)
+                           DO UPDATE SET answer_count = "%s".answer_count + EXCLUDED.answer_count'''
+                           % (self._table, self._table),
+                        [history_model._columns['checklist_id']._obj]
+                        + [list(c) for c in zip(*answers)]
+                        + [list(results.keys()), list(results.values())],
+                        )
+        return True
+
+
+class version(osv.Model):
+    """
+    the questions of a checklist as they stood at some point
+
+    Histories point to the version they were issued from, so editing a
+    checklist never changes the questions of histories already issued, and
+    the question text is stored once per version instead of once per answer.
+    Versions are never modified; a new one is added whenever a checklist's
+    questions change.
+    """
+    _name = 'fnx.checklist.version'
+    _description = 'checklist version'
+    _order = 'model, checklist_id, sequence desc'
+    _rec_name = 'sequence'
+    #
+    def __init__(self, pool, cr):
+        super(version, self).__init__(pool, cr)
+        # {version_id: (TemplateQuestion, ...)}, safe to keep as versions never change
+        self._questions = {}
+    #
+    _columns = {
+        'model': fields.char('Checklist Model', size=64, required=True, readonly=True),
+        'checklist_id': fields.integer('Checklist', readonly=True),
+        'sequence': fields.integer('Version', required=True, readonly=True),
+        'question_ids': fields.one2many('fnx.checklist.version.question', 'version_id', 'Questions', readonly=True),
+        }
+    #
+    def _auto_init(self, cr, context=None):
+        res = super(version, self)._auto_init(cr, context=context)
+        add_indexes(self, cr, [
+                ('checklist_idx', '(model, checklist_id, sequence)'),
+                ])
+        return res
+    #
+    def write(self, cr, uid, ids, values, context=None):
+        raise ERPError('Read Only', 'checklist versions cannot be changed')
+    #
+    def unlink(self, cr, uid, ids, context=None):
+        self._questions.clear()
+        return super(version, self).unlink(cr, uid, ids, context=context)
+    #
+    def get_questions(self, cr, uid, version_ids, context=None):
+        """
+        return {version_id: (TemplateQuestion, ...)} in position order
+
+        TemplateQuestion.id is the position; unknown ids are left out.
+        """
+        missing = [id for id in set(version_ids) if id and id not in self._questions]
+        if missing:
+            compiled = dict((id, []) for id in missing)
+            cr.execute(
+                    '''SELECT version_id, position, question, response_type
+                       FROM fnx_checklist_version_question
+                       WHERE version_id IN %s
+                       ORDER BY version_id, position''',
+                    (tuple(missing), ),
                     )
-        #
-        cr.execute("SELECT nextval('ir_model_data_id_seq')")
-        imd_id = cr.fetchone()[0]
-        cr.execute("""
-                INSERT into ir_model_data
-                    (
-                    id, module, name, model, res_id, date_init, date_update,
-                    create_uid, create_date, write_uid, write_date,
-                    noupdate
+            for version_id, position, text, response_type in cr.fetchall():
+                compiled[version_id].append(TemplateQuestion(position, text, response_type))
+            cr.execute('SELECT id FROM "%s" WHERE id IN %%s' % (self._table, ), (tuple(missing), ))
+            for (version_id, ) in cr.fetchall():
+                self._questions[version_id] = tuple(compiled[version_id])
+        return dict(
+                (id, self._questions[id])
+                for id in version_ids
+                if id in self._questions
+                )
+    #
+    def add_versions(self, cr, uid, model, new):
+        """
+        create versions from new, a list of (checklist_id, sequence, [(question, response_type), ...])
+
+        Returns the new version ids, in new order.
+        """
+        if not new:
+            return []
+        cr.execute(
+                "SELECT nextval('%s_id_seq') FROM generate_series(1, %%s)" % (self._table, ),
+                (len(new), ),
+                )
+        version_ids = [r[0] for r in cr.fetchall()]
+        cr.execute(
+                '''INSERT INTO "%s"
+                       (
+                         id, model, checklist_id, sequence,
+                         create_uid, create_date, write_uid, write_date
+                         )
+                   SELECT v.id, %%s, v.checklist_id, v.sequence,
+                          %%s, now() AT TIME ZONE 'UTC', %%s, now() AT TIME ZONE 'UTC'
+                   FROM unnest(%%s::int[], %%s::int[], %%s::int[]) AS v(id, checklist_id, sequence)'''
+                   % (self._table, ),
+                (
+                    model, uid, uid, version_ids,
+                    [n[0] for n in new], [n[1] for n in new],
+                    ))
+        question_version_ids = []
+        positions = []
+        texts = []
+        types = []
+        for version_id, (_, _, questions) in zip(version_ids, new):
+            for position, (text, response_type) in enumerate(questions):
+                question_version_ids.append(version_id)
+                positions.append(position)
+                texts.append(text)
+                types.append(response_type)
+        cr.execute(
+                '''INSERT INTO fnx_checklist_version_question
+                       (
+                         version_id, position, question, response_type,
+                         create_uid, create_date, write_uid, write_date
+                         )
+                   SELECT v.version_id, v.position, v.question, v.response_type,
+                          %s, now() AT TIME ZONE 'UTC', %s, now() AT TIME ZONE 'UTC'
+                   FROM unnest(%s::int[], %s::int[], %s::varchar[], %s::varchar[])
+                        AS v(version_id, position, question, response_type)''',
+                (uid, uid, question_version_ids, positions, texts, types),
+                )
+        return version_ids
+    #
+    def snapshot(self, cr, uid, question_model, checklist_ids):
+        """
+        make sure the latest version of each checklist matches its questions
+
+        Returns {checklist_id: version_id} with the (possibly new) latest version
+        of each existing checklist in checklist_ids.
+        """
+        if not checklist_ids:
+            return {}
+        checklist_model = self.pool.get(question_model._columns['checklist_id']._obj)
+        checklist_ids = tuple(set(checklist_ids))
+        cr.execute(
+                '''SELECT c.id, array_remove(array_agg(q.question ORDER BY q.id), NULL),
+                          array_remove(array_agg(q.response_type ORDER BY q.id), NULL)
+                   FROM "%s" c
+                   LEFT JOIN "%s" q ON q.checklist_id = c.id
+                   WHERE c.id IN %%s
+                   GROUP BY c.id'''
+                   % (checklist_model._table, question_model._table),
+                (checklist_ids, ),
+                )
+        current = dict((r[0], tuple(zip(r[1], r[2]))) for r in cr.fetchall())
+        cr.execute(
+                '''SELECT DISTINCT ON (checklist_id) checklist_id, id, sequence
+                   FROM "%s"
+                   WHERE model = %%s AND checklist_id IN %%s
+                   ORDER BY checklist_id, sequence DESC'''
+                   % (self._table, ),
+                (checklist_model._name, checklist_ids),
+                )
+        latest = dict((r[0], (r[1], r[2])) for r in cr.fetchall())
+        contents = self.get_questions(cr, uid, [v[0] for v in latest.values()])
+        res = {}
+        new = []
+        for checklist_id, questions in current.items():
+            version_id, sequence = latest.get(checklist_id, (None, 0))
+            if version_id is not None and questions == tuple(
+                    (q.question, q.response_type) for q in contents[version_id]
+                ):
+                res[checklist_id] = version_id
+            else:
+                new.append((checklist_id, sequence + 1, questions))
+        for (checklist_id, _, _), version_id in zip(new, self.add_versions(cr, uid, checklist_model._name, new)):
+            res[checklist_id] = version_id
+        return res
+
+
+class version_question(osv.Model):
+    "one question of a checklist version"
+    _name = 'fnx.checklist.version.question'
+    _description = 'checklist version question'
+    _order = 'version_id, position'
+    _rec_name = 'question'
+    #
+    _columns = {
+        'version_id': fields.many2one('fnx.checklist.version', 'Version', required=True, ondelete='cascade', readonly=True),
+        'position': fields.integer('Position', required=True, readonly=True),
+        'question': fields.char('Question', size=128, required=True, readonly=True),
+        'response_type': fields.selection(
+            Allowed_Response_Type,
+            string='Allowed Responses',
+            required=True,
+            readonly=True,
+            ),
+        }
+    #
+    _sql_constraints = [
+        ('position_uniq', 'unique(version_id, position)', 'duplicate question position'),
+        ]
+    #
+    def _auto_init(self, cr, context=None):
+        res = super(version_question, self)._auto_init(cr, context=context)
+        add_text_indexes(self, cr, [
+                ('question', 'question'),
+                ])
+        return res
+
+
+class timing(osv.Model):
+    """
+    sampled timings of traced operations, one row per span
+
+    See INSTRUMENT_SAMPLE_KEY; the whole operation is the 'total' span.
+    """
+    _name = 'fnx.checklist.timing'
+    _description = 'checklist timing sample'
+    _order = 'create_date desc, id'
+    _rec_name = 'span'
+    _log_access = False
+    #
+    _columns = {
+        'create_date': fields.datetime('Sampled', readonly=True),
+        'operation': fields.char('Operation', size=32, required=True, readonly=True),
+        'model': fields.char('Model', size=64, required=True, readonly=True),
+        'span': fields.char('Span', size=32, required=True, readonly=True),
+        'calls': fields.integer('Calls', readonly=True),
+        'seconds': fields.float('Seconds', digits=(16, 6), readonly=True),
+        'queries': fields.integer('Queries', readonly=True),
+        'bytes': fields.integer('Bytes', readonly=True),
+        }
+    #
+    def _auto_init(self, cr, context=None):
+        res = super(timing, self)._auto_init(cr, context=context)
+        add_indexes(self, cr, [
+                ('create_date_idx', '(create_date)'),
+                ])
+        return res
+    #
+    def add_sample(self, cr, trace):
+        "store the spans of trace"
+        names = sorted(trace.spans)
+        cr.execute(
+                '''INSERT INTO "%s" (create_date, operation, model, span, calls, seconds, queries, bytes)
+                   SELECT now() AT TIME ZONE 'UTC', %%s, %%s, v.span, v.calls, v.seconds, v.queries, v.bytes
+                   FROM unnest(%%s::varchar[], %%s::int[], %%s::float[], %%s::int[], %%s::int[])
+                        AS v(span, calls, seconds, queries, bytes)'''
+                   % (self._table, ),
+                [trace.operation, trace.model, names] + [
+                    [trace.spans[n][i] for n in names]
+                    for i in range(4)
+                    ])
+    #
+    def prune(self, cr, uid, days=None, context=None):
+        "remove samples older than days (default TIMING_KEEP_DAYS); scheduled action, administrator only"
+        if uid != SUPERUSER_ID:
+            raise ERPError('Access Denied', 'only the administrator can prune timing samples')
+        if days is None:
+            days = TIMING_KEEP_DAYS
+        cr.execute(
+                '''DELETE FROM "%s" WHERE create_date < now() AT TIME ZONE 'UTC' - interval '1 day' * %%s'''
+                % (self._table, ),
+                (days, ),
+                )
+        return True
+
+
+class timing_summary(osv.Model):
+    "latency percentiles of the sampled timings"
+    _name = 'fnx.checklist.timing.summary'
+    _description = 'checklist timing summary'
+    _auto = False
+    _order = 'operation, model, span'
+    _rec_name = 'span'
+    #
+    _columns = {
+        'operation': fields.char('Operation', size=32, readonly=True),
+        'model': fields.char('Model', size=64, readonly=True),
+        'span': fields.char('Span', size=32, readonly=True),
+        'samples': fields.integer('Samples', readonly=True),
+        'p50': fields.float('p50 (s)', digits=(16, 4), readonly=True),
+        'p95': fields.float('p95 (s)', digits=(16, 4), readonly=True),
+        'max': fields.float('Max (s)', digits=(16, 4), readonly=True),
+        'queries': fields.float('Queries (avg)', digits=(16, 1), readonly=True),
+        'bytes': fields.float('Bytes (avg)', digits=(16, 0), readonly=True),
+        }
+    #
+    def init(self, cr):
+        cr.execute('''
+                CREATE OR REPLACE VIEW fnx_checklist_timing_summary AS
+                SELECT row_number() OVER (ORDER BY operation, model, span) AS id,
+                       operation, model, span,
+                       count(*) AS samples,
+                       percentile_cont(0.5) WITHIN GROUP (ORDER BY seconds) AS p50,
+                       percentile_cont(0.95) WITHIN GROUP (ORDER BY seconds) AS p95,
+                       max(seconds) AS max,
+                       avg(queries) AS queries,
+                       avg(bytes) AS bytes
+                FROM fnx_checklist_timing
+                GROUP BY operation, model, span
+                ''')
+
+
+class report_job(osv.Model):
+    """
+    a checklist report drawn in the background
+
+    Identical requests (same user, model and records) that are still pending
+    or running share one job; the finished pdf is attached to the job.
+    """
+    _name = 'fnx.checklist.report.job'
+    _description = 'checklist report job'
+    _order = 'id desc'
+    #
+    def _get_progress(self, cr, uid, ids, field_name, arg, context=None):
+        res = {}
+        for job in self.read(cr, uid, ids, ['record_count', 'records_done', 'state'], context=context):
+            if job['state'] == 'done':
+                res[job['id']] = 100.0
+            else:
+                res[job['id']] = 100.0 * (job['records_done'] or 0) / (job['record_count'] or 1)
+        return res
+    #
+    _columns = {
+        'name': fields.char('Report', size=128, readonly=True),
+        'model': fields.char('Model', size=64, required=True, readonly=True),
+        'res_ids': fields.text('Records', required=True, readonly=True),
+        'key': fields.char('Key', size=40, required=True, readonly=True),
+        'state': fields.selection(Job_Status, 'Status', readonly=True),
+        'record_count': fields.integer('Records', readonly=True),
+        'records_done': fields.integer('Records Drawn', readonly=True),
+        'progress': fields.function(_get_progress, type='float', string='Progress'),
+        'create_date': fields.datetime('Requested', readonly=True),
+        'date_start': fields.datetime('Started', readonly=True),
+        'date_done': fields.datetime('Finished', readonly=True),
+        'error': fields.text('Error', readonly=True),
+        'attachment_id': fields.many2one('ir.attachment', 'Attachment', readonly=True, ondelete='set null'),
+        'pdf': fields.related('attachment_id', 'datas', type='binary', string='PDF', readonly=True),
+        'filename': fields.related('attachment_id', 'datas_fname', type='char', string='File Name', readonly=True),
+        }
+    #
+    _defaults = {
+        'state': lambda *a: Job_Status.pending,
+        }
+    #
+    def _auto_init(self, cr, context=None):
+        res = super(report_job, self)._auto_init(cr, context=context)
+        add_indexes(self, cr, [
+                ('open_key_idx', "(key) WHERE state IN ('pending', 'running')"),
+                ], unique=True)
+        add_indexes(self, cr, [
+                ('pending_idx', "(id) WHERE state = 'pending'"),
+                ])
+        return res
+    #
+    def queue(self, cr, uid, model, ids, context=None):
+        """
+        return the id of the job drawing the report of model for ids
+
+        An identical job that is still pending or running is reused; the
+        background worker is started if needed.
+        """
+        ids = list(ids)
+        key = hashlib.sha1(repr((uid, model, ids))).hexdigest()
+        title = self.pool.get(model)._description.title()
+        cr.execute(
+                '''INSERT INTO "%s"
+                       (
+                         name, model, res_ids, key, state, record_count, records_done,
+                         create_uid, create_date, write_uid, write_date
+                         )
+                   VALUES (
+                         %%s, %%s, %%s, %%s, 'pending', %%s, 0,
+                         %%s, now() AT TIME ZONE 'UTC', %%s, now() AT TIME ZONE 'UTC'
+                         )
+                   ON CONFLICT (key) WHERE state IN ('pending', 'running') DO NOTHING
+                   RETURNING id'''
+                   % (self._table, ),
+                ('%s (%d)' % (title, len(ids)), model, json.dumps(ids), key, len(ids), uid, uid),
+                )
+        row = cr.fetchone()
+        if row is None:
+            cr.execute(
+                    '''SELECT id FROM "%s" WHERE key = %%s AND state IN ('pending', 'running')'''
+                    % (self._table, ),
+                    (key, ),
+                    )
+            row = cr.fetchone()
+        start_job_worker(cr.dbname)
+        return row[0]
+    #
+    def claim(self, cr):
+        "mark the oldest pending job running and return (id, model, ids, uid), or None"
+        cr.execute(
+                '''UPDATE "%(table)s"
+                   SET state = 'running', records_done = 0, error = NULL,
+                       date_start = now() AT TIME ZONE 'UTC', write_date = now() AT TIME ZONE 'UTC'
+                   WHERE id = (
+                       SELECT id FROM "%(table)s"
+                       WHERE state = 'pending'
+                       ORDER BY id
+                       LIMIT 1
+                       FOR UPDATE SKIP LOCKED
+                       )
+                   RETURNING id, name, model, res_ids, create_uid'''
+                   % {'table': self._table},
+                )
+        row = cr.fetchone()
+        if row is None:
+            return None
+        id, name, model, res_ids, uid = row
+        return id, name, model, json.loads(res_ids), uid
+    #
+    def run_job(self, cr, job_id, name, model, ids, uid, context=None):
+        """
+        draw the report of job_id as uid and attach it to the job
+
+        Progress is committed through a second cursor so it shows while the
+        report is being drawn; the job ends up done or failed.
+        """
+        progress_cr = pooler.get_db(cr.dbname).cursor()
+        last = [time.time()]
+        def progress(count):
+            now = time.time()
+            if now - last[0] < JOB_POLL_SECONDS:
+                return
+            last[0] = now
+            progress_cr.execute(
+                    '''UPDATE "%s" SET records_done = %%s, write_date = now() AT TIME ZONE 'UTC' WHERE id = %%s'''
+                    % (self._table, ),
+                    (count, job_id),
                     )
-                VALUES
+            progress_cr.commit()
+        try:
+            try:
+                service = Service._services['report.%s.%s' % (self.pool.get(model)._module, model)]
+                job_context = dict(
+                        context or {},
+                        report_job=job_id, report_stream=True, report_file=True, report_progress=progress,
+                        )
+                pdf, _ = service.create(cr, uid, ids, {'model': model}, context=job_context)
+                try:
+                    attachment_id = attach_file(self.pool, cr, uid, {
+                            'name': name,
+                            'datas_fname': '%s.pdf' % (name, ),
+                            'res_model': self._name,
+                            'res_id': job_id,
+                            }, pdf, context=context)
+                finally:
+                    pdf.close()
+            except Exception:
+                cr.rollback()
+                _logger.exception('%s: job %d failed', self._name, job_id)
+                cr.execute(
+                        '''UPDATE "%s"
+                           SET state = 'failed', error = %%s,
+                               date_done = now() AT TIME ZONE 'UTC', write_date = now() AT TIME ZONE 'UTC'
+                           WHERE id = %%s'''
+                           % (self._table, ),
+                        (traceback.format_exc(), job_id),
+                        )
+            else:
+                cr.execute(
+                        '''UPDATE "%s"
+                           SET state = 'done', records_done = record_count, attachment_id = %%s,
+                               date_done = now() AT TIME ZONE 'UTC', write_date = now() AT TIME ZONE 'UTC'
+                           WHERE id = %%s'''
+                           % (self._table, ),
+                        (attachment_id, job_id),
+                        )
+        finally:
+            progress_cr.close()
+    #
+    def run_jobs(self, cr, uid, context=None):
+        """
+        retry stale running jobs and make sure pending jobs are being drawn
+
+        scheduled action; jobs are normally started as they are queued
+        """
+        cr.execute(
+                '''UPDATE "%s"
+                   SET state = 'pending'
+                   WHERE state = 'running'
+                     AND write_date < now() AT TIME ZONE 'UTC' - interval '1 minute' * %%s'''
+                   % (self._table, ),
+                (JOB_STALE_MINUTES, ),
+                )
+        if cr.rowcount:
+            _logger.warning('%s: %d stale job(s) queued again', self._name, cr.rowcount)
+        start_job_worker(cr.dbname)
+        return True
+
+
+class tombstone(osv.Model):
+    "a deleted checklist record, kept for sync()"
+    _name = 'fnx.checklist.tombstone'
+    _description = 'deleted checklist record'
+    _log_access = False
+    _order = 'create_date, id'
+    #
+    _columns = {
+        'create_date': fields.datetime('Deleted', readonly=True),
+        'model': fields.char('Model', size=64, required=True, readonly=True),
+        'res_id': fields.integer('Record', required=True, readonly=True),
+        }
+    #
+    def _auto_init(self, cr, context=None):
+        res = super(tombstone, self)._auto_init(cr, context=context)
+        add_indexes(self, cr, [
+                ('model_date_idx', '(model, create_date)'),
+                ])
+        return res
+    #
+    def add(self, cr, model, ids):
+        "remember ids of model as deleted"
+        if not ids:
+            return
+        cr.execute(
+                '''INSERT INTO "%s" (create_date, model, res_id)
+                   SELECT now() AT TIME ZONE 'UTC', %%s, v.id
+                   FROM unnest(%%s::int[]) AS v(id)'''
+                   % (self._table, ),
+                (model, list(ids)),
+                )
+    #
+    def remove(self, cr, model, ids):
+        "forget ids of model as deleted (they were restored)"
+        if not ids:
+            return
+        cr.execute(
+                'DELETE FROM "%s" WHERE model = %%s AND res_id = ANY(%%s)' % (self._table, ),
+                (model, list(ids)),
+                )
+    #
+    def get_deleted(self, cr, model, since):
+        "return the ids of model deleted since the given date"
+        cr.execute(
+                '''SELECT DISTINCT res_id FROM "%s" WHERE model = %%s AND create_date >= %%s ORDER BY res_id'''
+                % (self._table, ),
+                (model, since),
+                )
+        return [r[0] for r in cr.fetchall()]
+    #
+    def prune(self, cr, uid, days=None, context=None):
+        "delete tombstones older than days (default TOMBSTONE_KEEP_DAYS); scheduled action, administrator only"
+        if uid != SUPERUSER_ID:
+            raise ERPError('Access Denied', 'only the administrator can prune tombstones')
+        cr.execute(
+                '''DELETE FROM "%s" WHERE create_date < now() AT TIME ZONE 'UTC' - interval '1 day' * %%s'''
+                % (self._table, ),
+                (days or TOMBSTONE_KEEP_DAYS, ),
+                )
+        _logger.info('%s: %d tombstones pruned', self._name, cr.rowcount)
+        return True
+
+
+def concrete_models(pool, base):
+    "return the registry's models that derive from the abstract class base"
+    return [
+            model
+            for name, model in sorted(pool.models.items())
+            if isinstance(model, base) and model._auto and name != base._name
+            ]
+
+def queue_bootstrap(model, cr, report=False):
+    "schedule add_permissions (and add_report) for model; see run_bootstrap"
+    pending = _pending_bootstrap[cr.dbname]
+    pending['permissions'].append(model)
+    if report:
+        pending['reports'].append(model)
+
+def run_bootstrap(cr, context=None):
+    """
+    create the access rules and reports queued by the models' _auto_init
+
+    Called from _auto_end, which runs once every model of the module being
+    loaded has been through _auto_init, so each module is handled in one go.
+    """
+    pending = _pending_bootstrap.pop(cr.dbname, None)
+    if not pending:
+        return
+    model = (pending['permissions'] or pending['reports'])[0]
+    trace = start_trace(model.pool, cr, 'bootstrap', model._module, sampled=False)
+    if pending['permissions']:
+        with trace.span('add_permissions'):
+            add_permissions(pending['permissions'], cr, context)
+    if pending['reports']:
+        with trace.span('add_report'):
+            add_report(pending['reports'], cr, context)
+    trace.finish()
+
+_pending_bootstrap = defaultdict(lambda: {'permissions': [], 'reports': []})
+
+def start_job_worker(dbname):
+    "make sure a thread is drawing the pending report jobs of dbname"
+    with _job_lock:
+        _job_pending[dbname] = True
+        worker = _job_workers.get(dbname)
+        if worker is not None and worker.is_alive():
+            return
+        worker = _job_workers[dbname] = threading.Thread(
+                target=_job_worker,
+                args=(dbname, ),
+                name='fnx_checklist jobs %s' % (dbname, ),
+                )
+        worker.daemon = True
+        worker.start()
+
+def process_jobs(dbname):
+    "draw pending report jobs of dbname until there are none; returns how many were drawn"
+    jobs = pooler.get_pool(dbname).get('fnx.checklist.report.job')
+    drawn = 0
+    while True:
+        cr = pooler.get_db(dbname).cursor()
+        try:
+            claimed = jobs.claim(cr)
+            cr.commit()
+            if claimed is None:
+                return drawn
+            jobs.run_job(cr, *claimed)
+            cr.commit()
+        finally:
+            cr.close()
+        drawn += 1
+
+def _job_worker(dbname):
+    # jobs queued by a request only become visible once it commits, so keep
+    # polling for a while after the last one
+    threading.current_thread().dbname = dbname
+    idle = 0
+    while True:
+        with _job_lock:
+            _job_pending[dbname] = False
+        try:
+            drawn = process_jobs(dbname)
+        except Exception:
+            _logger.exception('%s: report job worker failed', dbname)
+            drawn = 0
+        idle = 0 if drawn else idle + JOB_POLL_SECONDS
+        with _job_lock:
+            if idle >= JOB_IDLE_SECONDS and not _job_pending[dbname]:
+                del _job_workers[dbname]
+                return
+        time.sleep(JOB_POLL_SECONDS)
+
+_job_lock = threading.Lock()
+_job_workers = {}
+_job_pending = {}
+
+def add_indexes(model, cr, indexes, unique=False):
+    """
+    create any missing indexes on model's table
+
+    indexes is a list of (suffix, definition); the index is named
+    <table>_<suffix> (see index_name), and definition is everything after
+    ON <table>
+    """
+    if not model._auto:
+        return
+    trace = start_trace(model.pool, cr, 'bootstrap', model._name, sampled=False)
+    with trace.span('add_indexes'):
+        cr.execute('SELECT indexname FROM pg_indexes WHERE tablename = %s', (model._table, ))
+        existing = set(r[0] for r in cr.fetchall())
+        for suffix, definition in indexes:
+            index = index_name(model._table, suffix)
+            if index not in existing:
+                _logger.info('creating index %s', index)
+                cr.execute('CREATE %sINDEX "%s" ON "%s" %s' % (
+                        unique and 'UNIQUE ' or '', index, model._table, definition,
+                        ))
+    trace.finish()
+
+def index_name(table, suffix):
+    """
+    name of table's <suffix> index as PostgreSQL stores it
+
+    Identifiers are cut to PG_NAME_LENGTH bytes, so long table names must be
+    cut the same way to find the index again.
+    """
+    name = '%s_%s' % (table, suffix)
+    if len(name) > PG_NAME_LENGTH:
+        name = name.encode('utf-8')[:PG_NAME_LENGTH].decode('utf-8', 'ignore')
+    return name
+
+def add_columns(model, cr, columns):
+    """
+    create any missing columns, not managed by the ORM, on model's table
+
+    columns is a list of (name, sql type)
+    """
+    if not model._auto:
+        return
+    trace = start_trace(model.pool, cr, 'bootstrap', model._name, sampled=False)
+    with trace.span('add_columns'):
+        cr.execute(
+                'SELECT column_name FROM information_schema.columns WHERE table_name = %s',
+                (model._table, ),
+                )
+        existing = set(r[0] for r in cr.fetchall())
+        for name, sql_type in columns:
+            if name not in existing:
+                _logger.info('adding column %s.%s', model._table, name)
+                cr.execute('ALTER TABLE "%s" ADD COLUMN "%s" %s' % (model._table, name, sql_type))
+    trace.finish()
+
+def text_search_mode(cr, table):
+    """
+    return 'trgm' or 'fts', whichever kind of text index table has
+
+    A table without text indexes gets 'trgm' if pg_trgm is (or can be)
+    installed in cr's database, else 'fts'.
+    """
+    cr.execute(
+            'SELECT bool_or(indexdef LIKE %s), bool_or(indexdef LIKE %s) FROM pg_indexes WHERE tablename = %s',
+            ('%gin_trgm_ops%', '%to_tsvector%', table),
+            )
+    trgm, fts = cr.fetchone()
+    if trgm:
+        return 'trgm'
+    if fts:
+        return 'fts'
+    cr.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    if cr.fetchone() is not None:
+        return 'trgm'
+    cr.execute('SAVEPOINT text_search_mode')
+    try:
+        cr.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except psycopg2.Error:
+        cr.execute('ROLLBACK TO SAVEPOINT text_search_mode')
+        _logger.warning('pg_trgm is not available in %s, using full text indexes', cr.dbname)
+        return 'fts'
+    cr.execute('RELEASE SAVEPOINT text_search_mode')
+    return 'trgm'
+
+def add_text_indexes(model, cr, indexes):
+    """
+    create any missing text search indexes on model's table
+
+    indexes is a list of (suffix, expression); see text_match for their use
+    """
+    if not model._auto:
+        return
+    if text_search_mode(cr, model._table) == 'trgm':
+        add_indexes(model, cr, [
+                ('%s_trgm_idx' % (suffix, ), 'USING gin ((%s) gin_trgm_ops)' % (expression, ))
+                for suffix, expression in indexes
+                ])
+    else:
+        add_indexes(model, cr, [
+                ('%s_fts_idx' % (suffix, ), "USING gin (to_tsvector('simple', %s))" % (expression, ))
+                for suffix, expression in indexes
+                ])
+
+def text_match(mode, expression, text):
+    """
+    return (condition, parameter) finding text in expression
+
+    mode is the text_search_mode of expression's table, so the condition
+    matches the index add_text_indexes made for expression: a substring match
+    with pg_trgm, all of text's words otherwise.
+    """
+    if mode == 'trgm':
+        text = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return '(%s) ILIKE %%s' % (expression, ), '%%%s%%' % (text, )
+    return "to_tsvector('simple', %s) @@ plainto_tsquery('simple', %%s)" % (expression, ), text
+
+def highlight_text(words, text):
+    "return text as html, with the matches of the words pattern in <b>"
+    parts = []
+    end = 0
+    for match in words.finditer(text):
+        parts.append(cgi.escape(text[end:match.start()]))
+        parts.append('<b>%s</b>' % cgi.escape(match.group()))
+        end = match.end()
+    parts.append(cgi.escape(text[end:]))
+    return ''.join(parts)
+
+def add_archive(model, cr):
+    "create the archive of history model, partitioned by month, if missing"
+    if not model._auto:
+        return
+    cr.execute('SELECT to_regclass(%s)', ('"%s_archive"' % (model._table, ), ))
+    if cr.fetchone()[0]:
+        return
+    _logger.info('creating table %s_archive', model._table)
+    cr.execute(
+            '''CREATE TABLE "%(table)s_archive" (
+                   id integer NOT NULL,
+                   period date NOT NULL,
+                   name varchar,
+                   checklist_id integer,
+                   version_id integer,
+                   user_id integer,
+                   date_end timestamp,
+                   create_date timestamp,
+                   payload bytea NOT NULL,
+                   PRIMARY KEY (id, period)
+                   ) PARTITION BY RANGE (period)'''
+               % {'table': model._table}
+            )
+    for suffix, definition in (
+            ('checklist_idx', '(checklist_id, period)'),
+            ('user_idx', '(user_id, period)'),
+        ):
+        cr.execute(
+                'CREATE INDEX "%s" ON "%s_archive" %s'
+                % (index_name('%s_archive' % (model._table, ), suffix), model._table, definition)
+                )
+
+def add_archive_partitions(model, cr, periods):
+    "create any missing monthly partitions of model's archive; periods are first days of months"
+    for period in periods:
+        partition = '%s_archive_%04d_%02d' % (model._table, period.year, period.month)
+        cr.execute('SELECT to_regclass(%s)', ('"%s"' % (partition, ), ))
+        if cr.fetchone()[0]:
+            continue
+        _logger.info('creating archive partition %s', partition)
+        # partition bounds have to be plain literals before PostgreSQL 12
+        next_period = date(period.year + period.month // 12, period.month % 12 + 1, 1)
+        cr.execute(
+                '''CREATE TABLE "%s" PARTITION OF "%s_archive"
+                   FOR VALUES FROM (%%s) TO (%%s)'''
+                   % (partition, model._table),
+                (period.strftime(DEFAULT_SERVER_DATE_FORMAT), next_period.strftime(DEFAULT_SERVER_DATE_FORMAT)),
+                )
+
+def staff_group_id(pool, cr, xml_id):
+    "return the id of group xml_id, looked up once per database"
+    key = cr.dbname, xml_id
+    group_id = _group_ids.get(key)
+    if not group_id:
+        group_id = fields.ref(xml_id)(pool, cr)
+        if group_id:
+            # not cached until the group exists (e.g. during installation)
+            _group_ids[key] = group_id
+    return group_id
+
+_group_ids = {}
+
+def add_permissions(models, cr, context):
+    "add default permissions to models that have none"
+    if not isinstance(models, (list, tuple)):
+        models = [models]
+    #
+    # ir_model_access gets <table>_all with full access, and ir_model_data the
+    # matching access_<table>_all entry; models with any access rule are skipped
+    #
+    cr.execute("""
+            WITH missing AS (
+                SELECT m.id AS model_id, v.module, v.table_name
+                FROM unnest(%s::varchar[], %s::varchar[], %s::varchar[]) AS v(model, module, table_name)
+                JOIN ir_model m ON m.model = v.model
+                WHERE NOT EXISTS (SELECT 1 FROM ir_model_access a WHERE a.model_id = m.id)
+                ),
+            access AS (
+                INSERT INTO ir_model_access
                     (
-                      %s, '%s', '%s', 'ir.model.access', %s, now() AT TIME ZONE 'UTC', now() AT TIME ZONE 'UTC',
-                      1, now() AT TIME ZONE 'UTC', 1, now() AT TIME ZONE 'UTC',
-                      true
+                      name, model_id, perm_read, perm_write, perm_create, perm_unlink,
+                      create_uid, create_date, write_uid, write_date
                       )
-                    """
-                    % (imd_id, model._module, imd_name, ima_id)
-                    )
+                SELECT
+                      table_name || '_all', model_id, true, true, true, true,
+                      1, now() AT TIME ZONE 'UTC', 1, now() AT TIME ZONE 'UTC'
+                FROM missing
+                RETURNING id, model_id
+                )
+            INSERT into ir_model_data
+                (
+                module, name, model, res_id, date_init, date_update,
+                create_uid, create_date, write_uid, write_date,
+                noupdate
+                )
+            SELECT
+                  missing.module, 'access_' || missing.table_name || '_all', 'ir.model.access', access.id,
+                  now() AT TIME ZONE 'UTC', now() AT TIME ZONE 'UTC',
+                  1, now() AT TIME ZONE 'UTC', 1, now() AT TIME ZONE 'UTC',
+                  true
+            FROM access
+            JOIN missing ON missing.model_id = access.model_id
+            """,
+            (
+                [m._name for m in models],
+                [m._module for m in models],
+                [m._table for m in models],
+                ))
 
-def add_report(model, cr, context):
-    "add checklist report to model"
+def add_report(models, cr, context):
+    "add checklist report to models"
+    if not isinstance(models, (list, tuple)):
+        models = [models]
     #
     # calculate db values
     #
-    module = model._module
-    model_name = model._name
-    title_name = model.__class__.__doc__.title().replace('.',' ')
-    report_xml_id = '%s.%s' % (module, model_name)
-    imd_xml_id = 'report_%s_%s' % (module, model._table)
+    entries = []
+    for model in models:
+        module = model._module
+        model_name = model._name
+        title_name = model.__class__.__doc__.title().replace('.',' ')
+        report_xml_id = '%s.%s' % (module, model_name)
+        imd_xml_id = 'report_%s_%s' % (module, model._table)
+        entries.append((model_name, module, title_name, report_xml_id, imd_xml_id))
+    model_names, modules, title_names, report_xml_ids, imd_xml_ids = [list(c) for c in zip(*entries)]
     # ???_id will be calculated later
     #
-    # get or create ir.actions.report.xml entry (ir_act_report_xml)
+    # get or create ir.actions.report.xml entries (ir_act_report_xml)
     # -------------------------------------------------------------------------------------------------------
     # |  id | header | model         | name         | report_name     | report_type | type                  |
     # | --- | ------ | ------------- | ------------ | --------------- | ----------- | --------------------- |
@@ -271,22 +3311,23 @@ def add_report(model, cr, context):
     # -------------------------------------------------------------------------------------------------------
     #
     cr.execute("""
-        SELECT id
-        FROM ir_act_report_xml
-        WHERE header='t' AND report_type='pdf' AND type='ir.actions.report.xml' AND
-              model='%s' AND name='%s' AND report_name='%s'
-              """
-              % (model_name, title_name, report_xml_id)
+        SELECT v.model, r.id
+        FROM unnest(%s::varchar[], %s::varchar[], %s::varchar[]) AS v(model, name, report_name)
+        JOIN ir_act_report_xml r ON
+              r.header='t' AND r.report_type='pdf' AND r.type='ir.actions.report.xml' AND
+              r.model=v.model AND r.name=v.name AND r.report_name=v.report_name
+              """,
+              (model_names, title_names, report_xml_ids),
               )
-    rows = cr.fetchall()
-    if len(rows) > 1:
-        raise ValueError('%s: too many matches found:\n%s' % (model_name, rows))
-    elif rows:
-        action_id = rows[0][0]
-    else:
-        # create it
-        cr.execute("SELECT nextval('ir_actions_id_seq')")
-        action_id = cr.fetchone()[0]
+    action_ids = defaultdict(list)
+    for model_name, action_id in cr.fetchall():
+        action_ids[model_name].append(action_id)
+    for model_name, rows in action_ids.items():
+        if len(rows) > 1:
+            raise ValueError('%s: too many matches found:\n%s' % (model_name, rows))
+    missing = [e for e in entries if e[0] not in action_ids]
+    if missing:
+        # create them
         cr.execute("""
             INSERT INTO ir_act_report_xml
                 (
@@ -294,17 +3335,23 @@ def add_report(model, cr, context):
                   create_uid, create_date, write_uid, write_date,
                   auto, multi, attachment_use
                    )
-            VALUES
-                (
-                  %s, 't', 'pdf', 'ir.actions.report.xml', '%s', '%s', '%s',
+            SELECT
+                  nextval('ir_actions_id_seq'), 't', 'pdf', 'ir.actions.report.xml', v.model, v.name, v.report_name,
                   1, now() AT TIME ZONE 'UTC', 1, now() AT TIME ZONE 'UTC',
                   false, false, false
-                  )
-                """
-                % (action_id, model_name, title_name, report_xml_id)
-                  )
+            FROM unnest(%s::varchar[], %s::varchar[], %s::varchar[]) AS v(model, name, report_name)
+            RETURNING model, id
+                """,
+                (
+                    [e[0] for e in missing],
+                    [e[2] for e in missing],
+                    [e[3] for e in missing],
+                    ))
+        for model_name, action_id in cr.fetchall():
+            action_ids[model_name].append(action_id)
+    action_ids = dict((model_name, rows[0]) for model_name, rows in action_ids.items())
     #
-    # get or create ir.model.data entry (ir_model_data)
+    # get or create ir.model.data entries (ir_model_data)
     #
     # --------------------------------------------------------------------
     # | module           | name         | model                 | res_id |
@@ -313,16 +3360,28 @@ def add_report(model, cr, context):
     # --------------------------------------------------------------------
     #
     cr.execute("""
-        SELECT id, model, res_id
-        FROM ir_model_data
-        WHERE module='%s' AND name='%s'
-        """
-        % (module, imd_xml_id)
+        SELECT d.module, d.name, d.model, d.res_id
+        FROM unnest(%s::varchar[], %s::varchar[]) AS v(module, name)
+        JOIN ir_model_data d ON d.module=v.module AND d.name=v.name
+        """,
+        (modules, imd_xml_ids),
         )
-    if not cr.rowcount:
-        # create entry
-        cr.execute("SELECT nextval('ir_model_data_id_seq')")
-        imd_id = cr.fetchone()[0]
+    existing = dict(((module, name), (model, res_id)) for module, name, model, res_id in cr.fetchall())
+    missing = []
+    for model_name, module, title_name, report_xml_id, imd_xml_id in entries:
+        if (module, imd_xml_id) not in existing:
+            missing.append((model_name, module, imd_xml_id))
+            continue
+        # validate entry
+        imd_model, imd_res_id = existing[module, imd_xml_id]
+        if imd_model != model_name or imd_res_id != action_ids[model_name]:
+            raise ERPError(
+                    'Duplicate Entry',
+                    'record %s.%s already exists and points to %s:%s'
+                        % (module, imd_xml_id, imd_model, imd_res_id),
+                        )
+    if missing:
+        # create entries
         cr.execute("""
             INSERT into ir_model_data
                 (
@@ -330,26 +3389,20 @@ def add_report(model, cr, context):
                 create_uid, create_date, write_uid, write_date,
                 noupdate
                 )
-            VALUES
-                (
-                  '%s', '%s', '%s', %s, now() AT TIME ZONE 'UTC', now() AT TIME ZONE 'UTC',
+            SELECT
+                  v.module, v.name, v.model, v.res_id, now() AT TIME ZONE 'UTC', now() AT TIME ZONE 'UTC',
                   1, now() AT TIME ZONE 'UTC', 1, now() AT TIME ZONE 'UTC',
                   true
-                  )
-                """
-                % (module, imd_xml_id, model_name, action_id)
-                )
-    else:
-        # validate entry
-        imd_id, imd_model, imd_res_id = cr.fetchone()
-        if imd_model != model_name or imd_res_id != action_id:
-            raise ERPError(
-                    'Duplicate Entry',
-                    'record %s.%s already exists and points to %s:%s'
-                        % (module, imd_xml_id, imd_model, imd_res_id),
-                        )
+            FROM unnest(%s::varchar[], %s::varchar[], %s::varchar[], %s::int[]) AS v(module, name, model, res_id)
+                """,
+                (
+                    [m[1] for m in missing],
+                    [m[2] for m in missing],
+                    [m[0] for m in missing],
+                    [action_ids[m[0]] for m in missing],
+                    ))
     #
-    # get or create ir.values entry (ir_values)
+    # get or create ir.values entries (ir_values)
     #
     # --------------------------------------------------------------------------------------------
     # | key    | key2               | value                        | model        | name         |
@@ -357,33 +3410,463 @@ def add_report(model, cr, context):
     # | action | client_print_multi | ir.actions.report.xml,???_id | <model.name> | <title name> |
     # --------------------------------------------------------------------------------------------
     cr.execute("""
-        SELECT id
-        FROM ir_values
-        WHERE
-            key='action' AND
-            key2='client_print_multi' AND
-            value='ir.actions.report.xml,%s' AND
-            model='%s'
-            """
-            % (action_id, model_name),
+        INSERT INTO ir_values
+            (
+              key, key2, value, model, name, res_id,
+              create_uid, create_date, write_uid, write_date
+              )
+        SELECT
+              'action', 'client_print_multi', 'ir.actions.report.xml,' || v.action_id, v.model, v.name, 0,
+              1, now() AT TIME ZONE 'UTC', 1, now() AT TIME ZONE 'UTC'
+        FROM unnest(%s::int[], %s::varchar[], %s::varchar[]) AS v(action_id, model, name)
+        WHERE NOT EXISTS (
+            SELECT 1
+            FROM ir_values
+            WHERE
+                key='action' AND
+                key2='client_print_multi' AND
+                value='ir.actions.report.xml,' || v.action_id AND
+                model=v.model
             )
-    if not cr.rowcount:
-        cr.execute("SELECT nextval('ir_values_id_seq')")
-        iv_id = cr.fetchone()[0]
-        cr.execute("""
-            INSERT INTO ir_values
-                (
-                  id, key, key2, value, model, name, res_id,
-                  create_uid, create_date, write_uid, write_date
-                  )
-            VALUES
-                (
-                  %s, 'action', 'client_print_multi', 'ir.actions.report.xml,%s', '%s', '%s', 0,
-                  1, now() AT TIME ZONE 'UTC', 1, now() AT TIME ZONE 'UTC'
-                  )
-                """
-                % (iv_id, action_id, model_name, title_name),
+            """,
+            (
+                [action_ids[e[0]] for e in entries],
+                [e[0] for e in entries],
+                [e[2] for e in entries],
+                ))
+
+def instrument_settings(cr):
+    "return (log, sample_rate) for cr's database; see INSTRUMENT_LOG_KEY"
+    now = time.time()
+    settings = _instrument_settings.get(cr.dbname)
+    if settings is None or settings[0] < now:
+        cr.execute(
+                'SELECT key, value FROM ir_config_parameter WHERE key IN %s',
+                ((INSTRUMENT_LOG_KEY, INSTRUMENT_SAMPLE_KEY), ),
                 )
+        values = dict(cr.fetchall())
+        try:
+            rate = min(max(float(values.get(INSTRUMENT_SAMPLE_KEY) or 0), 0.0), 1.0)
+        except ValueError:
+            _logger.warning('invalid %s: %r', INSTRUMENT_SAMPLE_KEY, values[INSTRUMENT_SAMPLE_KEY])
+            rate = 0.0
+        log = (values.get(INSTRUMENT_LOG_KEY) or '0').lower() not in ('0', 'false', 'no', 'off')
+        settings = _instrument_settings[cr.dbname] = now + INSTRUMENT_REFRESH, log, rate
+    return settings[1:]
+
+_instrument_settings = {}
+
+def start_trace(pool, cr, operation, model, sampled=True):
+    """
+    return a perf_trace for operation on model, disabled unless instrumented
+
+    sampled=False traces are only ever logged (e.g. while tables are still
+    being created)
+    """
+    log, rate = instrument_settings(cr)
+    sample = sampled and rate > 0 and random.random() < rate
+    if not (log or sample):
+        return NO_TRACE
+    return perf_trace(pool, cr, operation, model, log, sample)
+
+class perf_trace(object):
+    """
+    named timing spans of one operation
+
+    Spans with the same name are added together: calls, seconds, queries (as
+    counted by the cursor) and bytes.  finish() logs the spans and/or stores
+    them as a sample.  A disabled trace does nothing, and traces pickled into
+    worker processes are disabled.
+    """
+
+    def __init__(self, pool, cr, operation, model, log=False, sample=False):
+        self.pool = pool
+        self.cr = cr
+        self.operation = operation
+        self.model = model
+        self.log = log
+        self.sample = sample
+        self.enabled = log or sample
+        # {name: [calls, seconds, queries, bytes]}
+        self.spans = {}
+        if self.enabled:
+            self.start = time.time(), self.queries()
+
+    def __getstate__(self):
+        return {'enabled': False, 'spans': {}}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def queries(self):
+        return getattr(self.cr, 'sql_log_count', 0)
+
+    def span(self, name):
+        "context manager timing the enclosed block as name"
+        if not self.enabled:
+            return _no_span
+        return _span(self, name)
+
+    def add(self, name, seconds=0.0, queries=0, bytes=0, calls=1):
+        if not self.enabled:
+            return
+        span = self.spans.setdefault(name, [0, 0.0, 0, 0])
+        span[0] += calls
+        span[1] += seconds
+        span[2] += queries
+        span[3] += bytes
+
+    def add_bytes(self, name, bytes):
+        self.add(name, bytes=bytes, calls=0)
+
+    def finish(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        start, queries = self.start
+        total = self.spans.setdefault('total', [1, 0.0, 0, 0])
+        total[1] = time.time() - start
+        total[2] = self.queries() - queries
+        if self.log:
+            _perf_logger.info(json.dumps({
+                    'db': self.cr.dbname,
+                    'operation': self.operation,
+                    'model': self.model,
+                    'spans': dict(
+                        (name, {'calls': c, 'seconds': round(s, 6), 'queries': q, 'bytes': b})
+                        for name, (c, s, q, b) in self.spans.items()
+                        ),
+                    }, sort_keys=True))
+        if self.sample:
+            timing_model = self.pool.get('fnx.checklist.timing')
+            if timing_model is not None:
+                timing_model.add_sample(self.cr, self)
+
+NO_TRACE = perf_trace(None, None, None, None)
+
+class _span(object):
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time(), self.trace.queries()
+        return self
+
+    def __exit__(self, *exc):
+        start, queries = self.start
+        self.trace.add(self.name, time.time() - start, self.trace.queries() - queries)
+
+class _null_span(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+_no_span = _null_span()
+
+def fetch_report_data(pool, cr, uid, model_name, ids, context=None):
+    """
+    return [(ReportHeader, [ReportLine, ...]), ...] for ids, in ids order
+
+    Everything the report needs is read with a fixed number of set-based
+    queries, no matter how many records are selected.  Archived histories are
+    included.
+    """
+    model = pool.get(model_name)
+    model.check_access_rights(cr, uid, 'read')
+    if not ids:
+        return []
+    ids = tuple(ids)
+    archived = ()
+    if model_name.endswith('.checklist.history'):
+        # read_archive applies the record rules to these
+        cr.execute('SELECT id FROM "%s_archive" WHERE id IN %%s' % (model._table, ), (ids, ))
+        archived = set(r[0] for r in cr.fetchall())
+    model.check_access_rule(cr, uid, [id for id in ids if id not in archived], 'read', context=context)
+    base_name = model_name.rsplit('.', 1)[0]
+    headers = {}
+    lines = defaultdict(list)
+    if model_name.endswith('.checklist'):
+        question_model = pool.get('%s.question' % (model_name, ))
+        cr.execute(
+                'SELECT id, name FROM "%s" WHERE id IN %%s' % (model._table, ),
+                (ids, ),
+                )
+        for id, name in cr.fetchall():
+            headers[id] = ReportHeader(id, name, None, '', None)
+        snapshots = question_model.get_snapshots(cr, uid, ids, context=context)
+        for checklist_id, snapshot in snapshots.items():
+            lines[checklist_id] = [
+                    ReportLine(q.question, q.response_type, None, None)
+                    for q in snapshot.questions
+                    ]
+    elif model_name.endswith('.checklist.history'):
+        checklist_model = pool.get(base_name)
+        answer_model = pool.get('%s.answer' % (model_name, ))
+        cr.execute(
+                '''SELECT h.id, h.name, COALESCE(c.name, ''), h.user_id, h.date_end, h.version_id,
+                          h.packed_answers, h.packed_detail_positions, h.packed_details
+                   FROM "%s" h
+                   LEFT JOIN "%s" c ON c.id = h.checklist_id
+                   WHERE h.id IN %%s'''
+                   % (model._table, checklist_model._table),
+                (ids, ),
+                )
+        rows = cr.fetchall()
+        if archived:
+            archived_rows = model.read_archive(cr, uid, list(archived), context=context)
+            cr.execute(
+                    'SELECT id, name FROM "%s" WHERE id IN %%s' % (checklist_model._table, ),
+                    (tuple(set(r[2] for r in archived_rows)) or (None, ), ),
+                    )
+            checklist_names = dict(cr.fetchall())
+            rows.extend(
+                    (id, name, checklist_names.get(checklist_id, ''), user_id, date_end, version_id,
+                     codes, detail_positions, details)
+                    for id, name, checklist_id, version_id, user_id, date_end, _,
+                        codes, detail_positions, details in archived_rows
+                    )
+        user_ids = list(set(r[3] for r in rows if r[3]))
+        users = dict(pool.get('res.users').name_get(cr, SUPERUSER_ID, user_ids, context=context))
+        versions = pool.get('fnx.checklist.version').get_questions(
+                cr, SUPERUSER_ID,
+                list(set(r[5] for r in rows if r[5])),
+                )
+        response_names = {}
+        for resps in pool.get('fnx.checklist.allowed_response').get_responses(cr, SUPERUSER_ID).values():
+            for resp in resps:
+                response_names[resp.id] = resp.name
+        for (
+                id, name, checklist_name, user_id, date_end, version_id,
+                codes, detail_positions, details,
+            ) in rows:
+            headers[id] = ReportHeader(id, name or '', checklist_name, users.get(user_id, ''), date_end)
+            questions = versions.get(version_id, ())
+            if codes is not None:
+                details = dict(zip(detail_positions, details))
+                lines[id] = [
+                        ReportLine(q.question, q.response_type, response_names.get(code, ''), details.get(i))
+                        for i, (code, q) in enumerate(zip(codes, questions))
+                        ]
+        cr.execute(
+                '''SELECT a.checklist_history_id, h.version_id, a.position, r.name, a.detail
+                   FROM "%s" a
+                   JOIN "%s" h ON h.id = a.checklist_history_id
+                   LEFT JOIN fnx_checklist_allowed_response r ON r.id = a.answer_id
+                   WHERE a.checklist_history_id IN %%s
+                   ORDER BY a.checklist_history_id, a.position, a.id'''
+                   % (answer_model._table, model._table),
+                (ids, ),
+                )
+        for history_id, version_id, position, response, detail in cr.fetchall():
+            questions = versions.get(version_id, ())
+            if position is None or position >= len(questions):
+                continue
+            q = questions[position]
+            lines[history_id].append(ReportLine(q.question, q.response_type, response or '', detail))
+    else:
+        raise ERPError('Invalid Model', '%s is not a checklist or checklist history' % (model_name, ))
+    return [(headers[id], lines[id]) for id in ids if id in headers]
+
+def stored_columns(model):
+    "return the sorted names of model's columns that are stored as is (no binaries)"
+    return sorted(
+            name
+            for name, column in model._columns.items()
+            if column._classic_write and column._type != 'binary'
+            )
+
+def shared_columns(source, target):
+    "return the stored columns source and target both have, with the same type"
+    target_columns = target._columns
+    return [
+            name
+            for name in stored_columns(source)
+            if name in target_columns and target_columns[name]._type == source._columns[name]._type
+            ]
+
+def columnar(model, cr, ids, extra=()):
+    """
+    return {'fields': [name, ...], 'values': [[value, ...], ...]} for ids of model
+
+    values holds one list per field, ordered by id; only stored columns (and
+    the extra table columns named) are included, many2ones are plain ids,
+    dates are server-format strings, and NULLs are False so the result can go
+    over xml-rpc.
+    """
+    names = ['id'] + stored_columns(model) + list(extra)
+    values = [[] for _ in names]
+    if ids:
+        cr.execute(
+                'SELECT %s FROM "%s" WHERE id IN %%s ORDER BY id'
+                % (', '.join('"%s"' % n for n in names), model._table),
+                (tuple(ids), ),
+                )
+        for row in cr.fetchall():
+            for column, value in zip(values, row):
+                if value is None:
+                    value = False
+                elif isinstance(value, datetime):
+                    value = value.strftime(DEFAULT_SERVER_DATETIME_FORMAT)
+                elif isinstance(value, date):
+                    value = value.strftime(DEFAULT_SERVER_DATE_FORMAT)
+                column.append(value)
+    return {'fields': names, 'values': values}
+
+def export_value(value):
+    "return value ready for csv or json: utf-8 text and server-format dates"
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, datetime):
+        return value.strftime(DEFAULT_SERVER_DATETIME_FORMAT)
+    return value
+
+def iter_report_data(pool, cr, uid, model_name, ids, chunk_size=None, context=None):
+    """
+    yield (ReportHeader, [ReportLine, ...]) for ids, in ids order
+
+    Only chunk_size ids (default STREAM_CHUNK_SIZE) are loaded at a time, and
+    nothing is kept between chunks: the rows do not go through browse(), so
+    there is no browse cache to clear.
+    """
+    chunk_size = chunk_size or STREAM_CHUNK_SIZE
+    for i in range(0, len(ids), chunk_size):
+        for record in fetch_report_data(pool, cr, uid, model_name, ids[i:i+chunk_size], context=context):
+            yield record
+
+def fragment_keys(pool, cr, model_name, headers, layout):
+    """
+    return {id: key} for the records of headers whose rendered pdf can be cached
+
+    headers are the ReportHeaders the records are drawn with.  Checklist
+    templates are always cacheable, histories only once done.  The key changes
+    whenever the record or any of its questions/answers is written, added or
+    removed, when the header data drawn from other tables (checklist and
+    assigned user names) changes, or when the layout or response vocabulary
+    changes.
+    """
+    if not headers:
+        return {}
+    headers = dict((h.id, h) for h in headers)
+    ids = list(headers)
+    model = pool.get(model_name)
+    if model_name.endswith('.checklist'):
+        child_model = pool.get('%s.question' % (model_name, ))
+        child_column = 'checklist_id'
+        where = ''
+    else:
+        child_model = pool.get('%s.answer' % (model_name, ))
+        child_column = 'checklist_history_id'
+        where = "AND p.state = 'done'"
+    cr.execute(
+            '''SELECT p.id, p.write_date, max(c.write_date), count(c.id)
+               FROM "%s" p
+               LEFT JOIN "%s" c ON c."%s" = p.id
+               WHERE p.id IN %%s %s
+               GROUP BY p.id, p.write_date'''
+               % (model._table, child_model._table, child_column, where),
+            (tuple(ids), ),
+            )
+    static = (
+            cr.dbname, model_name,
+            layout.__class__.__name__, layout.version,
+            sorted(layout.responses.items()),
+            )
+    return dict(
+            (id, hashlib.sha1(repr(static + (tuple(headers[id]), write_date, child_date, child_count))).hexdigest())
+            for id, write_date, child_date, child_count in cr.fetchall()
+            )
+
+def get_fragment_cache(dbname):
+    "return the fragment cache for dbname, or None if caching is disabled"
+    if PdfFileMerger is None:
+        return None
+    max_size = int(config.get('checklist_pdf_cache_size', FRAGMENT_CACHE_SIZE) or 0)
+    if not max_size:
+        return None
+    cache = _fragment_caches.get(dbname)
+    if cache is None:
+        path = config.get('checklist_pdf_cache_dir') or os.path.join(gettempdir(), 'fnx_checklist_pdf')
+        cache = _fragment_caches[dbname] = fragment_cache(os.path.join(path, dbname), max_size)
+    return cache
+
+_fragment_caches = {}
+
+
+class fragment_cache(object):
+    """
+    size-bounded LRU of rendered record pdfs, kept on disk
+
+    The directory may be shared by several worker processes: entries are
+    written atomically, and an entry vanishing under us is just a miss.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                if not os.path.isdir(path):
+                    raise
+
+    def _filename(self, key):
+        return os.path.join(self.path, '%s.pdf' % (key, ))
+
+    def get(self, key):
+        filename = self._filename(key)
+        try:
+            with open(filename, 'rb') as f:
+                pdf = f.read()
+            # mark as recently used
+            os.utime(filename, None)
+        except (IOError, OSError):
+            return None
+        return pdf
+
+    def put(self, key, pdf):
+        handle, temp = mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                f.write(pdf)
+            os.rename(temp, self._filename(key))
+        except (IOError, OSError):
+            _logger.warning('unable to cache %s', key, exc_info=True)
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+
+    def prune(self):
+        "remove least recently used entries until the cache fits in max_size"
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            if not name.endswith('.pdf'):
+                continue
+            filename = os.path.join(self.path, name)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+            total += stat.st_size
+        if total <= self.max_size:
+            return
+        entries.sort()
+        for _, size, filename in entries:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total -= size
+            if total <= self.max_size:
+                break
 
 
 class external_pdf(render):
@@ -397,8 +3880,190 @@ class external_pdf(render):
         return self.pdf
 
 
+class checklist_layout(object):
+    """
+    draw checklists or histories from plain report rows
+
+    Each record is first paginated into plain Page data (page breaks, wrapped
+    lines and positions), then emitted in a single pass with one text object
+    per page.  Line wrapping and string widths are measured once per distinct
+    text.  Layouts hold only plain data so they can be pickled into worker
+    processes.
+    """
+
+    # bump whenever the drawing changes, to invalidate cached pdfs
+    version = 2
+
+    # set by the report to time the drawing; see perf_trace
+    trace = NO_TRACE
+
+    page = Area(*letter)
+    left_margin = 0.75*inch
+    bottom_margin = 1.0*inch
+    right_margin = page.width - 0.75*inch
+    top_margin = page.height - 0.75*inch
+
+    font = 'Helvetica'
+    font_size = 10
+    leading = 0.18*inch
+    width = 7.0*inch
+    row_height = 0.5*inch
+    detail_indent = 0.25*inch
+    detail_offset = 0.2*inch
+    # least space between the last line of a row and the next row
+    row_gap = 0.3*inch
+    # room left for the choice/response at the end of a question line
+    choice_width = 1.75*inch
+
+    # every page shares the same geometry: header, rule, then the rows
+    header_height = 0.62*inch
+    rule_top = top_margin - header_height - 0.0625*inch
+    first_row_top = rule_top - 0.5*inch
+
+    def __init__(self, kind, responses):
+        # kind is 'checklist' or 'history'
+        self.kind = kind
+        self.responses = responses
+        # {(text, width): lines} and {text: width}
+        self.wrapped = {}
+        self.widths = {}
+
+    def render(self, records, title, stream):
+        """
+        draw records onto a new canvas writing to stream, each record on its own page(s)
+
+        title can be a callable, which is called once all records are drawn;
+        returns the number of pages of each record
+        """
+        trace = self.trace
+        self.display = Canvas(stream, pagesize=letter, bottomup=1, pageCompression=1)
+        page_counts = []
+        for checklist, questions in records:
+            with trace.span('layout'):
+                pages = self.paginate(checklist, questions)
+            page_counts.append(len(pages))
+            with trace.span('draw'):
+                for page in pages:
+                    self.emit(page)
+        if callable(title):
+            title = title()
+        self.set_meta(title)
+        with trace.span('save'):
+            self.display.save()
+        self.display = None
+        return page_counts
+
+    def paginate(self, checklist, questions):
+        "return [Page, ...] for one record"
+        pages = [Page(checklist, self.rule_top, [])]
+        top = self.first_row_top
+        for question in questions:
+            row = self.layout_row(question, top)
+            if row.bottom < self.bottom_margin and pages[-1].rows:
+                pages.append(Page(None, self.rule_top, []))
+                top = self.first_row_top
+                row = self.layout_row(question, top)
+            pages[-1].rows.append(row)
+            top = min(top - self.row_height, row.bottom - self.row_gap)
+        return pages
+
+    def layout_row(self, question, top):
+        "return the PageRow for question with its first line at top"
+        if self.kind == 'checklist':
+            choice = '%s  /  %s' % tuple(r.name for r in self.responses[question.response_type][:2])
+        else:
+            choice = question.response or ''
+        text = self.wrap(question.question or '', self.width - self.choice_width)
+        bottom = top - self.leading * (len(text) - 1)
+        detail = ()
+        detail_top = None
+        if self.kind != 'checklist' and question.detail:
+            detail = self.wrap('add. info:  %s' % (question.detail, ), self.width - self.detail_indent)
+            detail_top = bottom - self.detail_offset
+            bottom = detail_top - self.leading * (len(detail) - 1)
+        return PageRow(top, text, choice, detail_top, detail, bottom)
+
+    def text_width(self, text):
+        width = self.widths.get(text)
+        if width is None:
+            width = self.widths[text] = stringWidth(text, self.font, self.font_size)
+        return width
+
+    def wrap(self, text, width):
+        "return text split into lines no wider than width; question texts repeat, so results are kept"
+        key = text, width
+        lines = self.wrapped.get(key)
+        if lines is None:
+            if stringWidth(text, self.font, self.font_size) <= width:
+                lines = (text, )
+            else:
+                lines = tuple(simpleSplit(text, self.font, self.font_size, width)) or ('', )
+            self.wrapped[key] = lines
+        return lines
+
+    def emit(self, page):
+        "draw one Page; all of its lines go into a single text object"
+        display = self.display
+        left = self.left_margin
+        if page.header is not None:
+            self.set_header(page.header, Point(left, self.top_margin))
+        display.line(left, page.rule, left + self.width, page.rule)
+        lines = []
+        for row in page.rows:
+            for i, line in enumerate(row.text):
+                lines.append((left, row.top - i * self.leading, line))
+            if row.choice:
+                lines.append((left + self.width - self.text_width(row.choice), row.top, row.choice))
+            for i, line in enumerate(row.detail):
+                lines.append((left + self.detail_indent, row.detail_top - i * self.leading, line))
+        text = display.beginText()
+        text.setFont(self.font, self.font_size)
+        # each line is placed relative to the previous one, the shortest form
+        x, y = left, self.first_row_top
+        text.setTextOrigin(x, y)
+        for line_x, line_y, line in lines:
+            text.moveCursor(line_x - x, y - line_y)
+            text.textOut(line)
+            x, y = line_x, line_y
+        display.drawText(text)
+        display.showPage()
+
+    def set_header(self, checklist, anchor):
+        with self.trace.span('set_header'):
+            return self._set_header(checklist, anchor)
+
+    def _set_header(self, checklist, anchor):
+        # display global checklist fields
+        self.display.setFont(self.font, 19)
+        left, top = anchor
+        if checklist.checklist is not None:
+            self.display.drawString(left, top, checklist.checklist)
+            top -= 0.31*inch
+            self.display.drawString(left, top, checklist.name)
+        else:
+            self.display.drawString(left, top, checklist.name)
+            top -= 0.31*inch
+        self.display.setFontSize(12)
+        top -= 0.31*inch
+        self.display.drawString(left, top, 'Assigned to:  %s' % checklist.user)
+        completed = 'Completed:  %s' % (
+                checklist.date_end and
+                checklist.date_end.strftime(DEFAULT_SERVER_DATETIME_FORMAT)
+                or ''
+                )
+        self.display.drawString(left+4.5*inch, top, completed)
+        return Point(left, top)
+
+    def set_meta(self, title):
+        self.display.setAuthor(PDF_AUTHOR)
+        self.display.setSubject(PDF_SUBJECT)
+        self.display.setTitle(title)
+
+
 class checklist_report(report_int):
 
+    _layout = checklist_layout
+
     def __init__(self, model, *args, **kwds):
         self._model = model
         super(checklist_report, self).__init__(*args, **kwds)
@@ -407,113 +4072,441 @@ class checklist_report(report_int):
         if context is None:
             context = {}
         pool = pooler.get_pool(cr.dbname)
+        if not context.get('report_job') and not context.get('report_sync') and len(ids) > 1 and (
+                context.get('report_async')
+                or len(ids) >= ASYNC_MIN_RECORDS
+            ):
+            # too big to wait for; queue it and hand back a notice instead
+            job_id = pool.get('fnx.checklist.report.job').queue(cr, uid, self._model, ids, context=context)
+            self.records = []
+            self.count = 0
+            self._filename = self.get_filename([])
+            self.obj = None
+            return (render_job_notice(job_id, len(ids)), 'pdf')
+        # get response types
+        responses = pool.get('fnx.checklist.allowed_response').get_responses(cr, SUPERUSER_ID)
+        kind = self._model.endswith('.checklist') and 'checklist' or 'history'
+        layout = self._layout(kind, responses)
+        layout.trace = trace = start_trace(pool, cr, 'report', self._model)
         # get lists
         checklist_ids = ids
-        oe_checklist = pool.get(self._model)
-        self.records = lists = oe_checklist.browse(
-                cr, uid, checklist_ids,
-                context=context,
-                )
+        if context.get('report_stream') or len(checklist_ids) >= STREAM_MIN_RECORDS:
+            # only reached by report jobs and report_sync prints, the others are
+            # queued above; rows are fetched a chunk at a time and drawn a part
+            # at a time into files; with report_file in the context the
+            # concatenated file itself is returned (see report_job.run_job),
+            # otherwise the rpc protocol needs it as one string
+            self.records = lists = []
+            count = [0]
+            progress = context.get('report_progress')
+            def records():
+                rows = iter_report_data(pool, cr, uid, self._model, checklist_ids, context=context)
+                while True:
+                    with trace.span('fetch'):
+                        record = next(rows, None)
+                    if record is None:
+                        break
+                    # only the first headers are kept, which is all the title needs
+                    if len(lists) < 2:
+                        lists.append(record[0])
+                    count[0] += 1
+                    if progress is not None:
+                        progress(count[0])
+                    yield record
+            output = render_pdf_streamed(layout, records(), lambda: self.get_title(lists))
+            self.count = count[0]
+            self._filename = self.get_filename(lists)
+            self.obj = None
+            output.seek(0, os.SEEK_END)
+            trace.add_bytes('total', output.tell())
+            output.seek(0)
+            trace.finish()
+            if context.get('report_file'):
+                return (output, 'pdf')
+            try:
+                return (output.read(), 'pdf')
+            finally:
+                output.close()
+        with trace.span('fetch'):
+            records = fetch_report_data(pool, cr, uid, self._model, checklist_ids, context=context)
+        self.records = lists = [header for header, _ in records]
         self.count = len(lists)
-        # get response types
-        responses = defaultdict(list)
-        for resp in pool.get('fnx.checklist.allowed_response').read(cr, SUPERUSER_ID, [('id','!=',0)], context=context):
-            responses[resp['type']].append(resp['name'])
-        # create canvas
-        pdf_io = BytesIO()
-        self.display = display = Canvas(pdf_io, pagesize=letter, bottomup=1)
-        self.set_meta(lists)
-        page = Area(*letter)
-        # viewable_area = Area(page.width - 1.5*inch, page.height - 1.5*inch)
-        left_margin = 0.75*inch
-        bottom_margin = 1.0*inch
-        right_margin = page.width - 0.75*inch
-        top_margin = page.height - 0.75*inch
-        self.margins = top_margin, right_margin, bottom_margin, left_margin
-        top_left = Point(left_margin, top_margin)
-        anchor = top_left
-        for checklist in lists:
-            anchor = self.set_header(checklist, anchor)
-            left, top = anchor
-            top -= 0.0625 * inch
-            self.display.line(left, top, left+7.0*inch, top)
-            top -= 0.5 * inch
-            self.display.setFontSize(10)
-            question_anchor = left, top
-            if oe_checklist._name.endswith('.checklist'):
-                for question in checklist.question_ids:
-                    if top < bottom_margin:
-                        left, top = question_anchor
-                        self.display.showPage()
-                        self.display.line(left, top+0.5*inch, left+7.0*inch, top+0.5*inch)
-                        self.display.setFontSize(10)
-                    choice = '%s  /  %s' % tuple(responses[question.response_type])[:2]
-                    self.display.drawString(left, top, question.question)
-                    self.display.drawRightString(left+7.0*inch, top, choice)
-                    top -= 0.5 * inch
-            elif oe_checklist._name.endswith('.checklist.history'):
-                for question in checklist.answer_ids:
-                    if top < bottom_margin:
-                        self.showPage()
-                        left, top = question_anchor
-                    choice = question.answer_id.name
-                    detail = question.detail
-                    self.display.drawString(left, top, question.question)
-                    self.display.drawRightString(left+7.0*inch, top, choice)
-                    if detail:
-                        self.display.drawString(left+0.25*inch, top-0.2*inch, 'add. info:  %s' % detail)
-                    top -= 0.5 * inch
-        display.showPage()
-        display.save()
+        # lay out and draw
+        cache = get_fragment_cache(cr.dbname)
+        if cache is not None:
+            keys = fragment_keys(pool, cr, self._model, lists, layout)
+        if cache is not None and keys:
+            pdf = render_pdf_cached(layout, records, self.get_title(lists), keys, cache)
+        else:
+            pdf = render_pdf(layout, records, self.get_title(lists))
         self._filename = self.get_filename(lists)
-        self.obj = external_pdf(pdf_io.getvalue())
+        self.obj = external_pdf(pdf)
         self.obj.render()
+        trace.add_bytes('total', len(self.obj.pdf))
+        trace.finish()
         return (self.obj.pdf, 'pdf')
 
     def get_filename(self, lists):
         return 'Checklist'
 
-    def set_header(self, checklist, anchor):
-        # display global checklist fields
-        self.display.setFontSize(19)
-        left, top = anchor
-        # top -= 0.25*inch
-        if 'checklist_id' in checklist:
-            self.display.drawString(left, top, checklist.checklist_id.name)
-            top -= 0.31*inch
-            self.display.drawString(left, top, checklist.name)
+    def get_title(self, lists):
+        if len(lists) == 1:
+            return '%s' % (lists[0].name, )
         else:
-            self.display.drawString(left, top, checklist.name)
-            top -= 0.31*inch
-        self.display.setFontSize(12)
-        top -= 0.31*inch
-        user = 'user_id' in checklist and checklist.user_id.name or ''
-        self.display.drawString(left, top, 'Assigned to:  %s' % user)
-        completed = 'Completed:  %s' % (
-                'date_end' in checklist and
-                checklist['date_end'] and
-                checklist.date_end.strftime(DEFAULT_SERVER_DATETIME_FORMAT)
-                or ''
-                )
-        self.display.drawString(left+4.5*inch, top, completed)
-        return Point(left, top) # - 0.25*inch)
+            return 'Checklists'
 
-    def set_meta(self, lists):
-        self.display.setAuthor('Sunridge Farms')
-        self.display.setSubject('Product Specification Labels')
-        if len(lists) == 1:
-            self.display.setTitle('%s' % (lists[0].name, ))
+
+def render_pdf(layout, records, title):
+    """
+    return the pdf for records as a string
+
+    Large selections are split into chunks and drawn in a process pool, then
+    merged back together in order; small selections, or servers where that is
+    not possible (see render_chunks), are drawn serially.
+    """
+    if (
+            PdfFileMerger is None
+            or len(records) < PARALLEL_MIN_RECORDS
+            or not can_fork_renderers()
+        ):
+        return _render_chunk((layout, records, title))
+    chunks = [
+            (layout, records[i:i+PARALLEL_CHUNK_SIZE], title)
+            for i in range(0, len(records), PARALLEL_CHUNK_SIZE)
+            ]
+    with layout.trace.span('draw (pool)'):
+        parts = render_chunks(chunks)
+    with layout.trace.span('merge'):
+        return merge_pdfs(parts, title)
+
+def render_job_notice(job_id, count):
+    "return a one page pdf saying the report was queued as job_id"
+    pdf_io = BytesIO()
+    display = Canvas(pdf_io, pagesize=letter)
+    display.setAuthor(PDF_AUTHOR)
+    display.setSubject(PDF_SUBJECT)
+    display.setTitle('Checklists')
+    display.setFont('Helvetica', 19)
+    display.drawString(0.75*inch, letter[1] - 1.0*inch, 'Checklist report queued')
+    display.setFont('Helvetica', 12)
+    display.drawString(
+            0.75*inch, letter[1] - 1.5*inch,
+            '%d records are being drawn in the background (job %d).' % (count, job_id),
+            )
+    display.drawString(
+            0.75*inch, letter[1] - 1.8*inch,
+            'The finished report can be downloaded from Checklists / Report Jobs.',
+            )
+    display.showPage()
+    display.save()
+    return pdf_io.getvalue()
+
+def render_pdf_cached(layout, records, title, keys, cache):
+    """
+    return the pdf for records as a string, reusing cached per-record fragments
+
+    keys maps record ids to their fragment cache keys; records without a key
+    are always drawn, and are not stored.  The records not found are drawn in
+    chunks like render_pdf does, and each chunk is split into the per-record
+    fragments that are cached.
+    """
+    parts = [None] * len(records)
+    missing = []
+    for i, (header, _) in enumerate(records):
+        key = keys.get(header.id)
+        if key is not None:
+            parts[i] = cache.get(key)
+        if parts[i] is None:
+            missing.append(i)
+    if missing:
+        chunks = [
+                (layout, [records[i] for i in missing[j:j+PARALLEL_CHUNK_SIZE]], title)
+                for j in range(0, len(missing), PARALLEL_CHUNK_SIZE)
+                ]
+        if len(missing) < PARALLEL_MIN_RECORDS:
+            drawn = [_render_fragments(c) for c in chunks]
         else:
-            self.display.setTitle('Checklists')
+            with layout.trace.span('draw (pool)'):
+                drawn = render_chunks(chunks, _render_fragments)
+        drawn = [pdf for fragments in drawn for pdf in fragments]
+        for i, pdf in zip(missing, drawn):
+            parts[i] = pdf
+            key = keys.get(records[i][0].id)
+            if key is not None:
+                cache.put(key, pdf)
+        cache.prune()
+    layout.trace.add('cached', calls=len(records) - len(missing))
+    with layout.trace.span('merge'):
+        return merge_pdfs(parts, title)
 
+def can_fork_renderers():
+    """
+    return True if reports may be drawn in a process pool
 
-class Area(NamedTuple):
-    width = 0
-    height = 1
+    Only prefork workers (--workers) may fork: the threaded server would fork
+    every thread's state, open cursors and locks included, into the pool.
+    """
+    return openerp.multi_process and cpu_count() > 1
 
-class Point(NamedTuple):
-    x = 0
-    y = 1
+def render_chunks(chunks, render_chunk=None):
+    """
+    return [render_chunk(chunk), ...] for chunks of (layout, records, title), in order
+
+    render_chunk defaults to _render_chunk, which returns the pdf of a chunk.
+    Chunks are drawn in a process pool when possible (see can_fork_renderers),
+    serially otherwise.
+    """
+    render_chunk = render_chunk or _render_chunk
+    if not can_fork_renderers() or len(chunks) < 2:
+        return [render_chunk(c) for c in chunks]
+    try:
+        workers = Pool(min(cpu_count(), len(chunks)))
+    except (AssertionError, OSError):
+        # daemonic worker processes cannot have children
+        _logger.warning('unable to start render pool, drawing serially', exc_info=True)
+        return [render_chunk(c) for c in chunks]
+    try:
+        parts = workers.map(render_chunk, chunks)
+        workers.close()
+    except Exception:
+        workers.terminate()
+        raise
+    finally:
+        workers.join()
+    return parts
+
+def render_pdf_streamed(layout, records, title, part_size=None):
+    """
+    return a file holding the pdf for records, positioned at its start
+
+    records should be an iterator (see iter_report_data).  reportlab keeps a
+    whole document in memory until it is saved, so every part_size records
+    (default STREAM_PART_SIZE) are drawn onto their own canvas and saved to a
+    temporary file; the parts are then concatenated (see concat_pdf_files)
+    into a file spooled to disk past STREAM_SPOOL_SIZE.
+    """
+    part_size = part_size or STREAM_PART_SIZE
+    output = SpooledTemporaryFile(max_size=STREAM_SPOOL_SIZE)
+    parts = []
+    try:
+        while True:
+            chunk = list(islice(records, part_size))
+            if not chunk:
+                break
+            part = TemporaryFile()
+            parts.append(part)
+            # the concatenation sets the real title
+            layout.render(chunk, '', part)
+            del chunk
+        if not parts:
+            layout.render([], callable(title) and title() or title, output)
+        else:
+            with layout.trace.span('merge'):
+                concat_pdf_files(parts, callable(title) and title() or title, output)
+        layout.trace.add('parts', calls=len(parts))
+    except Exception:
+        output.close()
+        raise
+    finally:
+        for part in parts:
+            part.close()
+    output.seek(0)
+    return output
+
+def concat_pdf_files(parts, title, output):
+    """
+    concatenate pdf files written by reportlab into one document written to output
+
+    Unlike merge_pdf_files, only one part is in memory at a time: its objects
+    are renumbered and copied out as they are read, and only their offsets and
+    the page numbers are kept for the cross-reference table and page tree.
+    Objects 1 to 3 of the result are the page tree, catalog and info.
+    """
+    offsets = [0, 0, 0, 0]
+    pages = []
+    position = [0]
+    def write(data):
+        output.write(data)
+        position[0] += len(data)
+    write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    for part in parts:
+        part.seek(0)
+        data = part.read()
+        xref = int(_pdf_startxref.findall(data)[-1])
+        trailer_at = data.index(b'trailer', xref)
+        objects = {}
+        for first, entries in _pdf_xref_section.findall(data[xref:trailer_at]):
+            for i, (offset, state) in enumerate(_pdf_xref_entry.findall(entries)):
+                if state == b'n':
+                    objects[int(first) + i] = int(offset)
+        starts = sorted(objects.values()) + [xref]
+        ends = dict(zip(starts, starts[1:]))
+        def body(number):
+            return data[objects[number]:ends[objects[number]]]
+        # the part's catalog, info and page tree are replaced by the result's
+        trailer = data[trailer_at:]
+        root = int(_pdf_root.search(trailer).group(1))
+        skipped = set([root])
+        info = _pdf_info.search(trailer)
+        if info:
+            skipped.add(int(info.group(1)))
+        tree = set()
+        part_pages = []
+        nodes = [int(_pdf_pages.search(body(root)).group(1))]
+        while nodes:
+            number = nodes.pop(0)
+            kids = _pdf_kids.search(body(number))
+            if kids is None:
+                part_pages.append(number)
+            else:
+                tree.add(number)
+                nodes[0:0] = [int(n) for n in _pdf_ref.findall(kids.group(1))]
+        skipped |= tree
+        base = len(offsets) - 1
+        pages.extend(number + base for number in part_pages)
+        def renumber(match):
+            number = int(match.group(1))
+            return b'%d 0 R' % (number in tree and 1 or number + base, )
+        for number in sorted(objects):
+            if number in skipped:
+                continue
+            obj = body(number)
+            # references are only renumbered outside of stream data
+            stream = _pdf_stream.search(obj)
+            head, tail = (obj[:stream.end()], obj[stream.end():]) if stream else (obj, b'')
+            head = _pdf_obj.sub(b'%d 0 obj' % (number + base, ), head, count=1)
+            offsets.extend([0] * (number + base + 1 - len(offsets)))
+            offsets[number + base] = position[0]
+            write(_pdf_ref.sub(renumber, head) + tail)
+            if not obj.endswith(b'\n'):
+                write(b'\n')
+    # page tree, catalog and info
+    offsets[1] = position[0]
+    write(b'1 0 obj\n<< /Type /Pages /Count %d /Kids [ ' % (len(pages), ))
+    for start in range(0, len(pages), 1000):
+        write(b''.join(b'%d 0 R ' % (number, ) for number in pages[start:start+1000]))
+    write(b'] >>\nendobj\n')
+    offsets[2] = position[0]
+    write(b'2 0 obj\n<< /Type /Catalog /Pages 1 0 R /PageMode /UseNone >>\nendobj\n')
+    offsets[3] = position[0]
+    write(b'3 0 obj\n<< /Title %s /Author %s /Subject %s /Producer %s >>\nendobj\n' % (
+            pdf_text(title), pdf_text(PDF_AUTHOR), pdf_text(PDF_SUBJECT), pdf_text('ReportLab PDF Library'),
+            ))
+    xref = position[0]
+    write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(offsets), ))
+    for offset in offsets[1:]:
+        write(offset and b'%010d 00000 n \n' % (offset, ) or b'0000000000 65535 f \n')
+    write(b'trailer\n<< /Size %d /Root 2 0 R /Info 3 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(offsets), xref))
+
+_pdf_startxref = re.compile(br'startxref\s+(\d+)')
+_pdf_xref_section = re.compile(br'(\d+) \d+\s*\n((?:\d{10} \d{5} [nf]\s*\n?)*)')
+_pdf_xref_entry = re.compile(br'(\d{10}) \d{5} ([nf])')
+_pdf_root = re.compile(br'/Root (\d+) 0 R')
+_pdf_info = re.compile(br'/Info (\d+) 0 R')
+_pdf_pages = re.compile(br'/Pages (\d+) 0 R')
+_pdf_kids = re.compile(br'/Kids \[([^\]]*)\]')
+_pdf_ref = re.compile(br'(\d+) 0 R')
+_pdf_obj = re.compile(br'\d+ 0 obj')
+_pdf_stream = re.compile(br'>>\s*stream\r?\n')
+
+def pdf_text(text):
+    "return text as a pdf string (utf-16, hex encoded)"
+    if not isinstance(text, unicode):
+        text = text.decode('utf-8')
+    return b'<FEFF%s>' % (binascii.hexlify(text.encode('utf-16-be')).upper(), )
+
+def merge_pdfs(parts, title):
+    "merge pdf strings into one document, keeping order and metadata"
+    pdf_io = BytesIO()
+    merge_pdf_files([BytesIO(part) for part in parts], title, pdf_io)
+    return pdf_io.getvalue()
+
+def merge_pdf_files(parts, title, output):
+    "merge pdf files into one document written to output, keeping order and metadata"
+    merger = PdfFileMerger()
+    for part in parts:
+        part.seek(0)
+        merger.append(part)
+    merger.addMetadata({
+            '/Title': title,
+            '/Author': PDF_AUTHOR,
+            '/Subject': PDF_SUBJECT,
+            })
+    merger.write(output)
+    merger.close()
+
+def attach_file(pool, cr, uid, values, output, context=None):
+    """
+    create an ir.attachment from values holding the content of the file output
+
+    With a file store (ir_attachment.location) the file is copied into it a
+    block at a time; a database store needs the content as one string.
+    Returns the attachment id.
+    """
+    attachments = pool.get('ir.attachment')
+    location = pool.get('ir.config_parameter').get_param(cr, SUPERUSER_ID, 'ir_attachment.location')
+    output.seek(0)
+    if not location:
+        values = dict(values, datas=base64.b64encode(output.read()))
+        return attachments.create(cr, uid, values, context=context)
+    # same layout as ir.attachment._file_write: <sha1[:3]>/<sha1>
+    root = attachments._full_path(cr, uid, location, '')
+    if not os.path.isdir(root):
+        os.makedirs(root)
+    handle, temp_path = mkstemp(dir=root)
+    digest = hashlib.sha1()
+    size = 0
+    try:
+        with os.fdopen(handle, 'wb') as target:
+            while True:
+                block = output.read(1024 * 1024)
+                if not block:
+                    break
+                digest.update(block)
+                size += len(block)
+                target.write(block)
+        store_fname = '%s/%s' % (digest.hexdigest()[:3], digest.hexdigest())
+        full_path = attachments._full_path(cr, uid, location, store_fname)
+        if not os.path.isdir(os.path.dirname(full_path)):
+            os.makedirs(os.path.dirname(full_path))
+        if os.path.exists(full_path):
+            os.remove(temp_path)
+        else:
+            os.rename(temp_path, full_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    values = dict(values, store_fname=store_fname, file_size=size)
+    return attachments.create(cr, uid, values, context=context)
+
+def _render_chunk(args):
+    layout, records, title = args
+    pdf_io = BytesIO()
+    layout.render(records, title, pdf_io)
+    with layout.trace.span('getvalue'):
+        pdf = pdf_io.getvalue()
+    layout.trace.add_bytes('getvalue', len(pdf))
+    return pdf
+
+def _render_fragments(args):
+    "draw a chunk as one document, and return it split into one pdf per record"
+    layout, records, title = args
+    pdf_io = BytesIO()
+    page_counts = layout.render(records, title, pdf_io)
+    with layout.trace.span('split'):
+        reader = PdfFileReader(pdf_io)
+        fragments = []
+        start = 0
+        for count in page_counts:
+            writer = PdfFileWriter()
+            for page in range(start, start + count):
+                writer.addPage(reader.getPage(page))
+            start += count
+            fragment = BytesIO()
+            writer.write(fragment)
+            fragments.append(fragment.getvalue())
+    return fragments
 
 
 # new module template